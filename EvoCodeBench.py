@@ -1,20 +1,25 @@
 import json
 import os
+import queue
 import shutil
-import subprocess
 import textwrap
 import threading
 import traceback
 from abc import abstractmethod
-from parser.add_func_call import process as rprocess
+from parser.add_func_call import VisitorCache
+from parser.add_func_call import dependencies as rdependencies
 from types import SimpleNamespace
 from typing import Callable
 
-import func_timeout
 import yaml
+from canonical import is_empty_body
 from EvoCodeBenchWS import WebSocketClient, WebSocketServer
+from injection import Overlay, preflight, render_completion
 from loguru import logger
 from python_repo import PythonRepo
+from recall_k import PARSE_FAILED
+from result_cache import ResultCache, pass_k_key, recall_k_key
+from utils import link_tree
 
 
 def adjust_indent(code, new_indent): return textwrap.indent(textwrap.dedent(code), ' ' * new_indent)
@@ -48,9 +53,10 @@ class Test:
 
 
 class EnvManager:
-    def __init__(self, source_root, dest_root) -> None:
+    def __init__(self, source_root, dest_root, link: bool = False) -> None:
         self.source_root = source_root
         self.dest_root = dest_root
+        self.link = link  # hard-link venv files instead of copying them (see utils.link_tree)
 
     def copy_project(self, project_name: str):
         src_env_dir = os.path.join(self.source_root, project_name)
@@ -58,152 +64,185 @@ class EnvManager:
         if os.path.exists(dst_env_dir):
             logger.success(f"EXISTING: {dst_env_dir}")
             return
-        logger.info(f"COPY: {src_env_dir} => {dst_env_dir}")
-        shutil.copytree(src_env_dir, dst_env_dir)
-        logger.success(f"COPY: {src_env_dir} => {dst_env_dir} FINISHED")
+        logger.info(f"{'LINK' if self.link else 'COPY'}: {src_env_dir} => {dst_env_dir}")
+        if self.link:
+            link_tree(src_env_dir, dst_env_dir)
+        else:
+            shutil.copytree(src_env_dir, dst_env_dir)
+        logger.success(f"{'LINK' if self.link else 'COPY'}: {src_env_dir} => {dst_env_dir} FINISHED")
 
 
 class PassKTest(Test, EnvManager):
-    def __init__(self, source_code_root, env_source_root, env_dest_root) -> None:
+    def __init__(self, source_code_root, env_source_root, env_dest_root, link: bool = False,
+                 injection: str = "inplace", fork_server: bool = False, batch_tests: bool = False,
+                 exitfirst: bool = True, cache_file: str = None) -> None:
         self.source_code_root = source_code_root
         self.tmp_prefix = "ppppppptmp_"
-        EnvManager.__init__(self, env_source_root, env_dest_root)
+        self.injection = injection  # "inplace": rewrite the project file, "overlay": see injection.Overlay
+        self.fork_server = fork_server  # see python_repo.PytestForkServer
+        self.batch_tests = batch_tests  # all tests of a completion in one pytest session
+        self.exitfirst = exitfirst
+        self.cache = ResultCache.open(cache_file) if cache_file else None  # shared by all handlers of the file
+        EnvManager.__init__(self, env_source_root, env_dest_root, link)
 
     def SetUp_evaluation(self, data, completion):
         completion_path = os.path.join(self.source_code_root, data['completion_path'])
         head_tail = os.path.split(completion_path)
         completion_tmp_path = os.path.join(head_tail[0], self.tmp_prefix + head_tail[1])
-        subprocess.run(['cp', completion_path, completion_tmp_path])
-        sos, eos = data['body_position'][0]-1, data['body_position'][1]
-        with open(completion_path, 'r') as f:
-            file_lines = f.readlines()
-        file_lines = file_lines[:sos] + ['\n', completion, '\n'] + file_lines[eos:]
+        content = render_completion(completion_path, data, completion)
+        shutil.copyfile(completion_path, completion_tmp_path)
         with open(completion_path, 'w') as f:
-            f.write(''.join(file_lines))
+            f.write(content)
 
     def TearDown_evaluation(self, data):
         completion_path = os.path.join(self.source_code_root, data['completion_path'])
         head_tail = os.path.split(completion_path)
         completion_tmp_path = os.path.join(head_tail[0], self.tmp_prefix + head_tail[1])
-        subprocess.run(['mv', completion_tmp_path, completion_path])
+        os.replace(completion_tmp_path, completion_path)
 
     def run_test(self, data: dict):
         completion = data['completion']
-        if completion == "    pass\n":
+        if is_empty_body(completion):
             return 'Fail'
         completion = adjust_indent(completion, data['indent'])
 
         project_name = data['completion_path'].split('/')[0]
         self.copy_project(project_name)
-        self.SetUp_evaluation(data, completion)
+        if self.cache is None:
+            return self.evaluate(data, completion)
+        key = pass_k_key(self.source_code_root, data, completion)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached['Result']
+        result = self.evaluate(data, completion)
+        self.cache.put(key, {'Result': result})
+        return result
+
+    def evaluate(self, data: dict, completion: str):
+        project_name, relative_path = data['completion_path'].split('/', 1)
         project_path = os.path.join(self.source_code_root, project_name)
-        flag = 'Pass'
-        python_repo = PythonRepo(project_path)
+        source_path = os.path.join(project_path, relative_path)
+        content = render_completion(source_path, data, completion)
+        reason = preflight(source_path, content)
+        if reason is not None:
+            logger.info(f"{data['namespace']} fails without running tests: {reason}")
+            return 'Fail'
+
+        python_repo = PythonRepo(project_path, fork_server=self.fork_server)
+        if self.injection == "overlay":
+            with Overlay(project_path, relative_path, content) as overlay:
+                python_repo.env_var = overlay.environ(python_repo.env_var)
+                return self.run_tests(python_repo, data)
+
+        self.SetUp_evaluation(data, completion)
+        try:
+            return self.run_tests(python_repo, data)
+        finally:
+            self.TearDown_evaluation(data)
+
+    def run_tests(self, python_repo: PythonRepo, data: dict):
         python_repo.prepare_env()
+        if self.batch_tests:
+            passed, _ = python_repo.run_tests(data['tests'], exitfirst=self.exitfirst)
+            return 'Pass' if passed else 'Fail'
 
+        flag = 'Pass'
         for test in data['tests']:
-            try:
-                result = python_repo.run_test(test)
-                if not result:
-                    flag = 'Fail'
-                    break
-            except func_timeout.exceptions.FunctionTimedOut:
+            if not python_repo.run_test(test):
                 flag = 'Fail'
-                break
-        self.TearDown_evaluation(data)
+                if self.exitfirst:
+                    break
         return flag
 
 
 class RecallKTest(Test, EnvManager):
-    def __init__(self, source_code_root, dependency_data_root, dependency_tmp_dir, env_source_root, env_dest_root) -> None:
+    def __init__(self, source_code_root, dependency_data_root, dependency_tmp_dir, env_source_root, env_dest_root,
+                 visitor_cache: bool = False, visitor_cache_memory: float = 16, cache_file: str = None) -> None:
         self.source_code_root = source_code_root
         self.dependency_data_root = dependency_data_root
-        self.dependency_tmp_dir = dependency_tmp_dir
-        self.tmp_prefix = "rrrrrrrtmp_"
+        self.dependency_tmp_dir = dependency_tmp_dir  # unused, dependencies are no longer dumped to disk
+        # see parser.add_func_call.VisitorCache, memory in GB
+        self.visitor_cache = VisitorCache(memory_limit=visitor_cache_memory * 1024 * 1024 * 1024) if visitor_cache else None
+        self.cache = ResultCache.open(cache_file, table='recall_k') if cache_file else None
         EnvManager.__init__(self, env_source_root, env_dest_root)
 
     def SetUp_evaluation(self, data, completion):
-        scompletion = adjust_indent(data['completion'], data['indent'])
+        """Return the patched content of the completion file, the analyzer never reads it from disk."""
+        scompletion = adjust_indent(completion, data['indent'])
         completion_path = os.path.join(self.source_code_root, data['completion_path'])
-        head_tail = os.path.split(completion_path)
-        completion_tmp_path = os.path.join(head_tail[0], self.tmp_prefix + head_tail[1])
-        subprocess.run(['cp', completion_path, completion_tmp_path])
-        sos, eos = data['body_position'][0]-1, data['body_position'][1]
-        with open(completion_path, 'r') as f:
-            file_lines = f.readlines()
-        file_lines = file_lines[:sos] + ['\n', scompletion, '\n'] + file_lines[eos:]
-        with open(completion_path, 'w') as f:
-            f.write(''.join(file_lines))
+        return render_completion(completion_path, data, scompletion)
 
-    def TearDown_evaluation(self, data):
-        project_name = data['completion_path'].split('/')[0]
-        completion_path = os.path.join(self.source_code_root, data['completion_path'])
-        head_tail = os.path.split(completion_path)
-        completion_tmp_path = os.path.join(head_tail[0], self.tmp_prefix + head_tail[1])
-        dependency_tmp_path = os.path.join(self.dependency_tmp_dir, project_name)
-        subprocess.run(['mv', completion_tmp_path, completion_path])
-        subprocess.run(['rm', '-rf', dependency_tmp_path])
-
-    def parse_dependency(self, data):
+    def parse_dependency(self, data, content):
+        """Return the generated dependency of data['namespace'] in the patched content, None if it is not
+        found there, or PARSE_FAILED if parsing raised."""
         project_name = data['completion_path'].split('/')[0]
         project_root = os.path.join(self.source_code_root, project_name)
         file_to_parse = os.path.join(self.source_code_root, data['completion_path'])
-        output_path = os.path.join(self.dependency_tmp_dir, project_name)
         analyzer_result_path = os.path.join(self.dependency_data_root, project_name, 'analyzer_result.pkl')
         try:
-            rprocess(target_object=project_root, func_object_root=project_root, func_path=file_to_parse,
-                     analyzer_result=analyzer_result_path, target_root=output_path)
+            attributes = (self.visitor_cache.dependencies if self.visitor_cache is not None else rdependencies)(
+                target_object=project_root, func_object_root=project_root, func_path=file_to_parse,
+                analyzer_result=analyzer_result_path, namespace=data['namespace'], func_content=content)
         except Exception as e:
-            return False
-        return True
-
-    def extract_dependency(self, data):
-        dependency_path = os.path.join(self.dependency_tmp_dir, data['completion_path'].replace('.py', '.json'))
-        if not os.path.exists(dependency_path):
-            return None
-        with open(dependency_path, 'r') as f:
-            dependency_data = json.load(f)
-        if data['namespace'] not in dependency_data:
+            return PARSE_FAILED
+        if attributes is None:
             return None
-        attributes = dependency_data[data['namespace']]
-        generated_dependency = {'intra_class': [], 'intra_file': [], 'cross_file': []}
-        for _item in attributes['in_class']:
-            generated_dependency['intra_class'].append(_item['name'])
-        for _item in attributes['in_file']:
-            generated_dependency['intra_file'].append(_item['name'])
-        for _item in attributes['in_object']:
-            generated_dependency['cross_file'].append(_item['name'])
-        return generated_dependency
+        return {'intra_class': attributes['in_class'],
+                'intra_file': attributes['in_file'],
+                'cross_file': attributes['in_object']}
 
     def run_test(self, data: dict):
         project_name = data['completion_path'].split('/')[0]
         self.copy_project(project_name)
-        self.SetUp_evaluation(data, data['completion'])
-        if self.parse_dependency(data) == True:
-            generated_dependency = self.extract_dependency(data)
-            self.TearDown_evaluation(data)
-            return generated_dependency
-        else:
-            self.TearDown_evaluation(data)
-            return None
+        if self.cache is None:
+            content = self.SetUp_evaluation(data, data['completion'])
+            generated_dependency = self.parse_dependency(data, content)
+            return None if generated_dependency is PARSE_FAILED else generated_dependency
+        key = recall_k_key(self.source_code_root, self.dependency_data_root, data, data['completion'])
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached['generated_dependency']
+        content = self.SetUp_evaluation(data, data['completion'])
+        generated_dependency = self.parse_dependency(data, content)
+        if generated_dependency is PARSE_FAILED:
+            return None  # not cached, the failure may be transient
+        self.cache.put(key, {'generated_dependency': generated_dependency})
+        return generated_dependency
 
 
 class EvoCodeTestServer(SingletonMixin):
-    def __init__(self, pass_k_test_configs: dict, recall_k_test_configs: dict) -> None:
+    def __init__(self, pass_k_test_configs: dict, recall_k_test_configs: dict,
+                 workers: int = 1, worker_root: str = None) -> None:
         SingletonMixin.__init__(self)
-        self.pass_k_test_handler = PassKTest(**pass_k_test_configs)
+        # NOTE::每个worker持有独立的项目副本，互不干扰，可并发执行
+        self.pass_k_test_handlers = queue.Queue()
+        if workers > 1:
+            for i in range(workers):
+                root = os.path.join(worker_root, f"worker_{i}")
+                self.pass_k_test_handlers.put(PassKTest(source_code_root=root,
+                                                        env_source_root=pass_k_test_configs["env_source_root"],
+                                                        env_dest_root=root, link=True,
+                                                        injection=pass_k_test_configs.get("injection", "inplace"),
+                                                        fork_server=pass_k_test_configs.get("fork_server", False),
+                                                        batch_tests=pass_k_test_configs.get("batch_tests", False),
+                                                        exitfirst=pass_k_test_configs.get("exitfirst", True),
+                                                        cache_file=pass_k_test_configs.get("cache_file")))
+        else:
+            self.pass_k_test_handlers.put(PassKTest(**pass_k_test_configs))
         self.recall_k_test_handler = RecallKTest(**recall_k_test_configs)
         self.lock = threading.Lock()
 
     def pass_k_test(self, data_dict: dict):
-        with self.lock:  # NOTE::阻止并发，多实例无法同时执行
-            ret = None
-            error = None
-            try:
-                ret = self.pass_k_test_handler.run_test(data_dict)
-            except Exception:
-                error = traceback.format_exc()
-            return {"return": ret, "error": error}
+        handler = self.pass_k_test_handlers.get()  # blocks until a worker copy is free
+        ret = None
+        error = None
+        try:
+            ret = handler.run_test(data_dict)
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            self.pass_k_test_handlers.put(handler)
+        return {"return": ret, "error": error}
 
     def recall_k_test(self, data_dict: dict):
         with self.lock:  # NOTE::阻止并发，多实例无法同时执行
@@ -288,7 +327,9 @@ def server_app():
     logger.info(f"loaded args: {args}")
     ws_server = WebSocketServer()
     ec_server = EvoCodeTestServer(pass_k_test_configs=args.pass_k_test_configs,
-                                  recall_k_test_configs=args.recall_k_test_configs)
+                                  recall_k_test_configs=args.recall_k_test_configs,
+                                  workers=getattr(args, "workers", 1),
+                                  worker_root=getattr(args, "worker_root", None))
 
     def passk_handle(**kwargs):
         print(kwargs.keys())
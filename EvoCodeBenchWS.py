@@ -96,7 +96,8 @@ class WebSocketServer:
         async def awaitable_handler(connection: ServerConnection):
             try:
                 async for message in connection:
-                    result = handler(**json.loads(message))
+                    # run in a thread so that requests on other connections are served concurrently
+                    result = await asyncio.to_thread(handler, **json.loads(message))
                     await connection.send(json.dumps(result))
             except ConnectionClosedError:
                 logger.error(f"Connection closed on socket `ws://{host}:{port}`")
@@ -0,0 +1,262 @@
+"""
+Build or update `Dependency_Data/<project>/analyzer_result.pkl` from `Source_Code/<project>`.
+
+Next to every artifact a manifest (`analyzer_result.files.json`) records the
+content hash of each source file it was built from. On the next run a project
+whose files are unchanged is skipped. When files only changed in place, the
+pickled visitor is loaded and just the changed files and the files importing
+them are analyzed again (CallGraphVisitor.replace_files). Added or removed files,
+a new Python version or an artifact that does not match its manifest rebuild
+the whole project, as does `--full`. The update does not follow imports
+transitively, so a full rebuild can still differ slightly.
+
+Projects are built concurrently, one per process. The pickle, its compact call
+graph (if there is one, see pyan_zyf_v2/compact.py) and the manifest are each
+written to a temporary file and renamed, the manifest last.
+
+    python build_dependency_data.py --source_code_root Source_Code \
+        --dependency_data_root Dependency_Data [--projects a,b] [--workers 8] [--full] [--data_file data.jsonl]
+
+Pass the same `source_code_root` as to recall_k.py: the pickled visitor keeps
+the file names it was built from. Module names are inferred from the packages
+like pyan does without a root (`pkg/util.py` is `pkg.util`), as the namespaces
+of data.jsonl and recall_k.py name them. A built project fails if none of its
+namespaces in `--data_file` resolve to a function of the artifact.
+"""
+
+import ast
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+from argparse import ArgumentParser
+
+import dill as pickle
+
+from parser.add_func_call import load_visitor
+from pyan_zyf_v2.analyzer import CallGraphVisitor
+from pyan_zyf_v2.anutils import ParseCache, get_module_name
+from pyan_zyf_v2.compact import COMPACT_NAME, CompactCallGraph
+
+ARTIFACT_NAME = 'analyzer_result.pkl'
+MANIFEST_NAME = 'analyzer_result.files.json'
+MANIFEST_VERSION = 2  # 1 named modules after the project directory
+FULL_REBUILD_RATIO = 0.5  # rebuild from scratch when at least this share of the files has to be analyzed again
+
+
+def find_py_files(project_root: str) -> list[str]:
+    """Python files of a project, sorted, skipping hidden directories like add_func_call.find_py_files."""
+    py_files = []
+    for root, dirs, files in os.walk(project_root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if name.endswith('.py'):
+                py_files.append(os.path.join(root, name))
+    return py_files
+
+
+def read_sources(project_root: str) -> dict:
+    """{file name: source} of every python file of the project."""
+    sources = {}
+    for path in find_py_files(project_root):
+        with open(path, 'rt', encoding='utf-8', errors='replace') as f:
+            sources[path] = f.read()
+    return sources
+
+
+def content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def imported_names(content: str, module_name: str, is_package: bool) -> set:
+    """Dotted names a module imports, relative imports resolved; `from a import b` gives a and a.b."""
+    try:
+        tree = ast.parse(content)
+    except SyntaxError:
+        return set()
+    package = module_name.split('.') if is_package else module_name.split('.')[:-1]
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ''
+            if node.level:
+                parent = package[:len(package) - node.level + 1]
+                base = '.'.join(parent + ([base] if base else []))
+            if base:
+                names.add(base)
+            names.update('%s.%s' % (base, alias.name) if base else alias.name for alias in node.names)
+    return names
+
+
+def imports_module(names: set, module_name: str) -> bool:
+    """Whether one of the imported names can refer to module_name (or a package of it).
+
+    Module names are inferred from the packages, so `pkg.mod` is usually imported
+    as is; a tail of the name also counts, for code that runs with a directory
+    inside the package tree on sys.path.
+    """
+    parts = module_name.split('.')
+    for i in range(len(parts)):
+        tail = '.'.join(parts[i:])
+        for name in names:
+            if name == tail or tail.startswith(name + '.'):
+                return True
+    return False
+
+
+def affected_files(sources: dict, changed: list) -> list:
+    """The changed files and the files importing one of them, in the order of sources."""
+    changed_modules = [get_module_name(path) for path in changed]
+    affected = set(changed)
+    for path, content in sources.items():
+        if path in affected:
+            continue
+        names = imported_names(content, get_module_name(path), os.path.basename(path) == '__init__.py')
+        if any(imports_module(names, module_name) for module_name in changed_modules):
+            affected.add(path)
+    return [path for path in sources if path in affected]
+
+
+def atomic_write(path: str, data: bytes):
+    tmp_path = path + '.tmp%d' % os.getpid()
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def read_manifest(output_dir: str) -> dict | None:
+    """The manifest of the artifact in output_dir, None if it is missing or does not describe that artifact."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        stat = os.stat(os.path.join(output_dir, ARTIFACT_NAME))
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('python') != sys.implementation.cache_tag or \
+            manifest.get('artifact') != [stat.st_size, stat.st_mtime_ns]:
+        return None
+    return manifest
+
+
+def write_artifacts(v, output_dir: str, hashes: dict):
+    v.parse_cache = ParseCache()  # the artifact must not write to the build's parse cache when it is used
+    artifact = os.path.join(output_dir, ARTIFACT_NAME)
+    atomic_write(artifact, pickle.dumps(v))
+    compact = os.path.join(output_dir, COMPACT_NAME)
+    if os.path.exists(compact):
+        CompactCallGraph.from_visitor(v).dump(compact)
+    stat = os.stat(artifact)
+    manifest = {'version': MANIFEST_VERSION, 'python': sys.implementation.cache_tag,
+                'artifact': [stat.st_size, stat.st_mtime_ns], 'files': hashes}
+    atomic_write(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, indent=1, sort_keys=True).encode())
+
+
+def load_namespaces(data_file: str) -> dict:
+    """{project: [namespace]} of the benchmark samples in data_file, empty if there is none."""
+    namespaces = {}
+    if data_file and os.path.exists(data_file):
+        with open(data_file, 'r') as f:
+            for line in f:
+                js = json.loads(line)
+                namespaces.setdefault(js['completion_path'].split('/')[0], []).append(js['namespace'])
+    return namespaces
+
+
+def unresolved_namespaces(v, namespaces: list) -> list:
+    """The namespaces that name no defined node of the visitor."""
+    return [namespace for namespace in namespaces
+            if not any(n.defined and n.get_name() == namespace for n in v.nodes.get(namespace.split('.')[-1], []))]
+
+
+def build_project(task) -> tuple[str, str]:
+    """Build or update the artifact of one project, return (project, what was done)."""
+    project, namespaces, args = task
+    project_root = os.path.join(args.source_code_root, project)
+    output_dir = os.path.join(args.dependency_data_root, project)
+    try:
+        sources = read_sources(project_root)
+        names = {path: os.path.relpath(path, project_root) for path in sources}  # as recorded in the manifest
+        hashes = {names[path]: content_digest(content) for path, content in sources.items()}
+        manifest = None if args.full else read_manifest(output_dir)
+        if manifest is not None and manifest['files'] == hashes:
+            return project, 'unchanged'
+
+        affected = None
+        if manifest is not None and manifest['files'].keys() == hashes.keys():
+            changed = [path for path in sources if manifest['files'][names[path]] != hashes[names[path]]]
+            affected = affected_files(sources, changed)
+            if len(affected) >= FULL_REBUILD_RATIO * len(sources):
+                affected = None
+
+        os.makedirs(output_dir, exist_ok=True)
+        if affected is None:
+            v = CallGraphVisitor(list(sources), workers=args.project_workers, cache_dir=args.cache_dir)
+            done = 'built from %d files' % len(sources)
+        else:
+            v = load_visitor(os.path.join(output_dir, ARTIFACT_NAME))
+            v.replace_files({path: sources[path] for path in affected})
+            done = 'updated %d changed and %d importing of %d files' % (
+                len(changed), len(affected) - len(changed), len(sources))
+        unresolved = unresolved_namespaces(v, namespaces)
+        if namespaces and len(unresolved) == len(namespaces):
+            return project, 'failed, none of its %d namespaces resolves, e.g. %s' % (len(namespaces), namespaces[0])
+        if unresolved:
+            done += ', %d of %d namespaces do not resolve' % (len(unresolved), len(namespaces))
+        write_artifacts(v, output_dir, hashes)
+        return project, done
+    except Exception:
+        return project, 'failed\n' + traceback.format_exc()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--source_code_root', type=str, default='Source_Code')
+    parser.add_argument('--dependency_data_root', type=str, default='Dependency_Data')
+    parser.add_argument('--projects', type=str, default=None, help='comma separated, all projects by default')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--full', action='store_true', help='rebuild every project from scratch')
+    parser.add_argument('--data_file', type=str, default='data.jsonl',
+                        help='benchmark samples whose namespaces a built artifact must resolve')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='keep the scope tables of analyzed files here between builds (pyan --cache-dir)')
+    args = parser.parse_args()
+
+    if args.projects:
+        projects = args.projects.split(',')
+    else:
+        projects = sorted(d for d in os.listdir(args.source_code_root)
+                          if not d.startswith('.') and os.path.isdir(os.path.join(args.source_code_root, d)))
+    # pool processes cannot start the file pool of a visitor, a single project gets it instead
+    args.project_workers = args.workers if len(projects) == 1 else 1
+    namespaces = load_namespaces(args.data_file)
+    tasks = [(project, namespaces.get(project, []), args) for project in projects]
+
+    pool = None
+    if len(tasks) > 1 and args.workers > 1:
+        pool = multiprocessing.Pool(min(args.workers, len(tasks)))
+        results = pool.imap_unordered(build_project, tasks)
+    else:
+        results = map(build_project, tasks)
+    failed = 0
+    try:
+        for project, done in results:
+            failed += done.startswith('failed')
+            print('%s: %s' % (project, done))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if failed:
+        sys.exit('%d of %d projects failed' % (failed, len(tasks)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Canonical form of a completion, used to evaluate semantically identical completions once.
+
+A completion is a function body. It is re-indented like the evaluation does
+(`adjust_indent`), wrapped in a dummy function, parsed and unparsed, so that
+whitespace, comments, docstrings, quoting and redundant parentheses no longer
+tell two completions apart. Bodies that do not parse fall back to a whitespace
+normalization; they fail the same way however they are spelled.
+"""
+
+import ast
+import textwrap
+
+
+def strip_docstrings(tree: ast.AST):
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Module)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+                node.body = node.body[1:] or [ast.Pass()]
+
+
+def canonical_completion(completion: str) -> str:
+    body = textwrap.indent(textwrap.dedent(completion), ' ' * 4)
+    try:
+        tree = ast.parse('def _():\n' + body)
+    except (SyntaxError, ValueError):
+        lines = [line.rstrip() for line in textwrap.dedent(completion).splitlines()]
+        return '\n'.join(line for line in lines if line)
+    strip_docstrings(tree)
+    return ast.unparse(ast.Module(body=tree.body[0].body, type_ignores=[]))
+
+
+def is_empty_body(completion: str) -> bool:
+    """A body of nothing but `pass` statements, however indented or commented; such completions are not run."""
+    body = textwrap.indent(textwrap.dedent(completion), ' ' * 4)
+    try:
+        tree = ast.parse('def _():\n' + body)
+    except (SyntaxError, ValueError):
+        return False
+    return all(isinstance(statement, ast.Pass) for statement in tree.body[0].body)
@@ -22,7 +22,8 @@ for task in ["local_completion", "local_infilling", "baseline"]:
             "source_code_root": "Source_Code",
             "k": "1",
             "n": 1,
-            "write_rst": f"logout/{TASK}_{dirm}.txt"
+            "write_rst": f"logout/{TASK}_{dirm}.txt",
+            "cache_file": "logout/pass_k_cache.sqlite"
         }
         recall_config[dirm] = {
             "output_file": f"model_completion/{TASK}/{dirm}/completion.jsonl",
@@ -31,8 +32,8 @@ for task in ["local_completion", "local_infilling", "baseline"]:
             "source_code_root": f'{str(ROOT/"Source_Code")}',
             "dependency_data_root": f'{str(ROOT/"Dependency_Data")}',
             "data_file": f'{str(ROOT/"data.jsonl")}',
-            "dependency_tmp_dir": "dependency_data_tmp",
-            "write_rst": f"logout/{TASK}_{dirm}_recall.txt"
+            "write_rst": f"logout/{TASK}_{dirm}_recall.txt",
+            "cache_file": "logout/recall_k_cache.sqlite"
         }
         launch_json["configurations"].append({
             "name": f"{TASK}::{dirm}",
@@ -0,0 +1,195 @@
+"""
+Test impact: which tests can reach the patched function, and in which order to run them.
+
+The index maps every test of a project to the names it transitively uses in the
+pyan call graph of `Dependency_Data/<project>/analyzer_result.pkl`. The graph is
+static and incomplete (fixtures, dynamic dispatch), so reachability is
+over-approximated: the walk starts from the test function, its class, its module
+and the conftest modules above it, and entering a class enters all its methods.
+
+Tests are ordered by their historical failure rate per second of run time, taken
+from the `Tests` reports of earlier pass@k logs. With first-failure early exit a
+failing completion then usually costs one short pytest run.
+
+Build the index with
+    python impact.py --data_file data.jsonl --source_code_root Source_Code \
+        --dependency_data_root Dependency_Data --index_file test_impact.json
+"""
+
+import glob
+import json
+import os
+from argparse import ArgumentParser
+
+from tqdm import tqdm
+
+
+def entry_names(graph, test: str) -> list[str]:
+    """Names of the call graph nodes a test starts from, empty if its file was not analyzed."""
+    from pyan_zyf_v2.anutils import get_module_name
+    test_file, *names = test.split('[')[0].split('::')
+    filename = None
+    for analyzed in graph.filenames:
+        if analyzed.endswith(os.sep + test_file) or analyzed == test_file:
+            filename = analyzed
+            break
+    if filename is None:
+        return []
+    module_name = get_module_name(filename, root=graph.root)
+    roots = [module_name] + ['.'.join([module_name] + names[:i]) for i in range(1, len(names) + 1)]
+    # fixtures of conftest.py files are invisible to the call graph, start from them as well
+    directory = os.path.dirname(filename)
+    while True:
+        conftest = os.path.join(directory, 'conftest.py')
+        if conftest in graph.filenames:
+            roots.append(get_module_name(conftest, root=graph.root))
+        if directory == os.path.dirname(directory) or (graph.root and directory == graph.root):
+            break
+        directory = os.path.dirname(directory)
+    return roots
+
+
+def reachable(graph, roots: list[str]) -> set[str]:
+    from pyan_zyf_v2.node import Flavor
+    seen = set()
+    queue = list(roots)
+    while queue:
+        name = queue.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        for node in graph.uses(name):
+            queue.append(node.get_name())
+        for to_name, nodes in graph.virtual_uses(name).items():
+            queue.append(to_name)
+            queue.extend(node.get_name() for node in nodes)
+        node = graph.definition(name)
+        if node is not None and node.flavor == Flavor.CLASS:
+            queue.extend(member.get_name() for member in graph.defines(name))
+    return seen
+
+
+def load_graph(analyzer_result: str):
+    """The compact call graph next to analyzer_result if it is up to date, else one made from the pickle."""
+    # only building the index needs the call graph, ordering tests does not
+    from pyan_zyf_v2.compact import COMPACT_NAME, CompactCallGraph
+    compact = os.path.join(os.path.dirname(analyzer_result), COMPACT_NAME)
+    if os.path.exists(compact) and os.path.getmtime(compact) >= os.path.getmtime(analyzer_result):
+        return CompactCallGraph.load(compact)
+    import dill as pickle
+    with open(analyzer_result, 'rb') as f:
+        return CompactCallGraph.from_visitor(pickle.loads(f.read()))
+
+
+def build_project_index(analyzer_result: str, tests: list[str]) -> dict:
+    graph = load_graph(analyzer_result)
+    index = {}
+    for test in tests:
+        roots = entry_names(graph, test)
+        if roots:
+            index[test] = sorted(reachable(graph, roots))
+    return index
+
+
+class ImpactIndex:
+    """{project: {test: [reached names]}}; tests missing from it are of unknown impact."""
+
+    def __init__(self, index: dict) -> None:
+        self.index = {project: {test: set(names) for test, names in tests.items()} for project, tests in index.items()}
+
+    @classmethod
+    def load(cls, path: str) -> "ImpactIndex":
+        with open(path, 'r') as f:
+            return cls(json.load(f))
+
+    def reaches(self, project: str, test: str, namespace: str) -> bool | None:
+        names = self.index.get(project, {}).get(test)
+        if names is None:
+            return None
+        # node names may carry a longer package prefix than benchmark namespaces
+        suffix = '.' + namespace
+        return namespace in names or any(name.endswith(suffix) for name in names)
+
+
+class FailureHistory:
+    """Failure counts and run times of tests, from the `Tests` reports of pass@k logs."""
+
+    def __init__(self) -> None:
+        self.runs = {}
+        self.fails = {}
+        self.wall_time = {}
+
+    @classmethod
+    def from_logs(cls, patterns: list[str]) -> "FailureHistory":
+        history = cls()
+        for pattern in patterns:
+            for log_file in glob.glob(pattern):
+                with open(log_file, 'r') as f:
+                    for line in f:
+                        js = json.loads(line)
+                        if js.get('Tests') and not js.get('Cached'):
+                            history.update(js['namespace'], js['Tests'])
+        return history
+
+    def update(self, namespace: str, report: dict):
+        for test, outcome in report.items():
+            key = (namespace, test)
+            self.runs[key] = self.runs.get(key, 0) + 1
+            self.fails[key] = self.fails.get(key, 0) + (not outcome['passed'])
+            self.wall_time[key] = self.wall_time.get(key, 0.0) + outcome.get('wall_time', 0.0)
+
+    def priority(self, namespace: str, test: str) -> float:
+        """Expected failures per second; unseen tests get an even chance and a one second cost."""
+        key = (namespace, test)
+        runs = self.runs.get(key, 0)
+        fail_rate = (self.fails.get(key, 0) + 1) / (runs + 2)
+        cost = self.wall_time[key] / runs if runs else 1.0
+        return fail_rate / max(cost, 0.01)
+
+
+def order_tests(data: dict, index: ImpactIndex | None = None, history: FailureHistory | None = None,
+                select: bool = False) -> list[str]:
+    """The tests of a benchmark sample, most likely and cheapest failures first.
+
+    Tests that cannot reach the patched function go last, or are left out with
+    select (unless that would leave no test at all).
+    """
+    project_name = data['completion_path'].split('/')[0]
+    tests = list(data['tests'])
+    reaches = {test: index.reaches(project_name, test, data['namespace']) if index is not None else None
+               for test in tests}
+    if select:
+        selected = [test for test in tests if reaches[test] is not False]
+        tests = selected or tests
+    if history is not None:
+        tests.sort(key=lambda test: -history.priority(data['namespace'], test))
+    tests.sort(key=lambda test: reaches[test] is False)  # stable, keeps the order within both groups
+    return tests
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--data_file', type=str, default='data.jsonl')
+    parser.add_argument('--source_code_root', type=str, default='Source_Code')
+    parser.add_argument('--dependency_data_root', type=str, default='Dependency_Data')
+    parser.add_argument('--index_file', type=str, default='test_impact.json')
+    args = parser.parse_args()
+
+    tests = {}
+    with open(args.data_file, 'r') as f:
+        for line in f:
+            js = json.loads(line)
+            project_name = js['completion_path'].split('/')[0]
+            tests.setdefault(project_name, set()).update(js['tests'])
+
+    index = {}
+    for project_name, project_tests in tqdm(sorted(tests.items())):
+        analyzer_result = os.path.join(args.dependency_data_root, project_name, 'analyzer_result.pkl')
+        if os.path.exists(analyzer_result):
+            index[project_name] = build_project_index(analyzer_result, sorted(project_tests))
+    with open(args.index_file, 'w') as f:
+        json.dump(index, f)
+
+
+if __name__ == '__main__':
+    main()
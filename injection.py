@@ -0,0 +1,157 @@
+"""
+Inject a completion into a project without touching the project tree.
+
+`render_completion` splices the completion into the source in memory. `Overlay`
+writes the patched file into a scratch directory together with a
+`sitecustomize.py` import hook; putting that directory first on PYTHONPATH makes
+the test interpreter load the patched source whenever it imports the completion
+file, while the pristine file on disk is never rewritten.
+"""
+
+import os
+import shutil
+import tempfile
+import warnings
+from functools import lru_cache
+
+SITECUSTOMIZE = '''\
+import importlib.machinery
+import linecache
+import os
+import sys
+
+_PRISTINE = {pristine!r}
+_OVERLAY = {overlay!r}
+_TARGETS = {targets!r}  # dotted module name -> file path relative to the module root
+
+
+class _OverlayLoader(importlib.machinery.SourceFileLoader):
+    def get_data(self, path):
+        if path == self.path:
+            path = _OVERLAY
+        return super().get_data(path)
+
+    def get_code(self, fullname):
+        # never read or write the bytecode cache of the pristine file
+        source = self.get_data(self.path)
+        lines = source.decode('utf-8').splitlines(True)
+        linecache.cache[self.path] = (len(source), None, lines, self.path)  # tracebacks show the patched lines
+        return self.source_to_code(source, self.path)
+
+
+class _OverlayFinder:
+    @classmethod
+    def find_spec(cls, fullname, path=None, target=None):
+        if fullname not in _TARGETS:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path, target)
+        if spec is None or spec.origin is None:
+            return None
+        origin = os.path.realpath(spec.origin)
+        # the project tree itself, or a copy of the file installed into the running venv
+        if origin != _PRISTINE and not (origin.startswith(sys.prefix) and origin.endswith(_TARGETS[fullname])):
+            return None
+        spec.loader = _OverlayLoader(fullname, spec.origin)
+        return spec
+
+
+sys.meta_path.insert(0, _OverlayFinder)
+'''
+
+
+def render_completion(source_path, data, completion):
+    """Return the content of source_path with the body at data['body_position'] replaced by completion."""
+    sos, eos = data['body_position'][0]-1, data['body_position'][1]
+    with open(source_path, 'r') as f:
+        file_lines = f.readlines()
+    file_lines = file_lines[:sos] + ['\n', completion, '\n'] + file_lines[eos:]
+    return ''.join(file_lines)
+
+
+@lru_cache(maxsize=None)
+def compiles(source_path):
+    with open(source_path, 'rb') as f:
+        source = f.read()
+    return syntax_error(source_path, source) is None
+
+
+def syntax_error(source_path, content):
+    """Why content cannot be compiled as source_path, or None if it compiles."""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # e.g. invalid escape sequences are not our business
+            compile(content, source_path, 'exec', dont_inherit=True)
+    except (SyntaxError, ValueError) as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def preflight(source_path, content):
+    """Why the patched content of source_path cannot pass any test, or None if it has to be run.
+
+    Only judged when the pristine file compiles with this interpreter, projects may
+    use a python whose grammar differs from ours.
+    """
+    if not compiles(source_path):
+        return None
+    return syntax_error(source_path, content)
+
+
+def module_targets(relative_path):
+    """Map every dotted name the file could be imported as to the matching path suffix.
+
+    `src/pkg/mod.py` may be imported as `src.pkg.mod`, `pkg.mod` or `mod`
+    depending on the sys.path layout of the project.
+    """
+    parts = relative_path[:-len('.py')].split('/')
+    if parts[-1] == '__init__':
+        parts = parts[:-1]
+    targets = {}
+    for i in range(len(parts)):
+        suffix = os.sep + os.path.join(*parts[i:])
+        suffix += os.sep + '__init__.py' if relative_path.endswith('__init__.py') else '.py'
+        targets['.'.join(parts[i:])] = suffix
+    return targets
+
+
+def scratch_root():
+    """Prefer a tmpfs for overlays, they are written and deleted once per evaluation."""
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return None
+
+
+class Overlay:
+    """A scratch directory that shadows one source file of a project.
+
+    Usage:
+        with Overlay(project_path, completion_path, content) as overlay:
+            python_repo.env_var = overlay.environ(python_repo.env_var)
+            python_repo.run_test(test)
+    """
+
+    def __init__(self, project_path, relative_path, content):
+        self.pristine_path = os.path.realpath(os.path.join(project_path, relative_path))
+        self.relative_path = relative_path
+        self.content = content
+        self.overlay_dir = None
+
+    def __enter__(self):
+        self.overlay_dir = tempfile.mkdtemp(prefix='evo_overlay_', dir=scratch_root())
+        overlay_path = os.path.join(self.overlay_dir, 'patched_' + os.path.basename(self.relative_path))
+        with open(overlay_path, 'w') as f:
+            f.write(self.content)
+        with open(os.path.join(self.overlay_dir, 'sitecustomize.py'), 'w') as f:
+            f.write(SITECUSTOMIZE.format(pristine=self.pristine_path, overlay=overlay_path,
+                                         targets=module_targets(self.relative_path)))
+        return self
+
+    def __exit__(self, errtype, errvalue, traceback):
+        shutil.rmtree(self.overlay_dir, ignore_errors=True)
+        self.overlay_dir = None
+
+    def environ(self, env):
+        """Return a copy of env whose PYTHONPATH starts with the overlay directory."""
+        env = dict(env)
+        env['PYTHONPATH'] = os.pathsep.join(p for p in [self.overlay_dir, env.get('PYTHONPATH')] if p)
+        return env
@@ -0,0 +1,292 @@
+"""
+A leaderboard of every evaluation logged in logout/, kept up to date as logs grow.
+
+Logs are named like gen_config.py names them, `<setting>_<model>[_greedy].jsonl`
+for pass@k and `<setting>_<model>[_greedy]_recall.jsonl` for recall@k, and so are
+the completions they evaluate, `<completion_root>/<setting>/<model>[_greedy]/completion.jsonl`.
+For every log the builder remembers how far it has read and the result of every
+completion per namespace, so a refresh only reads the lines appended since the
+last one; a log that shrank or was replaced (its first bytes changed) is read
+again from the start. Logs are expected to only grow otherwise, like pass_k.py
+and recall_k.py write them. The state is kept in a pickle next to the logs.
+
+Scores are those of scoring.py: the completions of a namespace are the lines of
+its output file, in order, and the log is only looked up for their results. A
+completion that is not logged (yet) fails, and recall@k is the best of the first
+k completions.
+
+    python leaderboard.py --log_dir logout --data_file data.jsonl --k 1,3,5,10 \
+        --completion_root model_completion --output_file logout/leaderboard.md [--watch 60]
+"""
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+from scoring import DEPENDENCY_TYPES, dependency_recalls, load_benchmark_data, pass_at_k
+
+SETTINGS = ('local_completion', 'local_infilling', 'baseline')
+STATE_VERSION = 2
+HEAD_SIZE = 256  # bytes of a log fingerprinted to notice it was rewritten
+
+
+def parse_log_name(path):
+    """(model, setting, mode, metric) of a log file."""
+    stem = os.path.basename(path)[:-len('.jsonl')]
+    metric = 'pass_k'
+    if stem.endswith('_recall'):
+        stem, metric = stem[:-len('_recall')], 'recall_k'
+    setting = next((s for s in SETTINGS if stem.startswith(s + '_')), '')
+    model = stem[len(setting) + 1:] if setting else stem
+    mode = 'sampling'
+    if model.endswith('_greedy'):
+        model, mode = model[:-len('_greedy')], 'greedy'
+    return model, setting, mode, metric
+
+
+def output_file_of(path, completion_root):
+    """The output file a log evaluates, as named by gen_config.py."""
+    stem = os.path.basename(path)[:-len('.jsonl')]
+    if stem.endswith('_recall'):
+        stem = stem[:-len('_recall')]
+    setting = next((s for s in SETTINGS if stem.startswith(s + '_')), '')
+    return os.path.join(completion_root, setting, stem[len(setting) + 1:] if setting else stem, 'completion.jsonl')
+
+
+def completion_key(completion: str) -> str:
+    return hashlib.sha1(completion.encode()).hexdigest()[:16]
+
+
+class LogAggregate:
+    """What one log contributed so far: where reading stopped and the result of every completion per namespace,
+    and the completions of its output file."""
+
+    def __init__(self, path: str, output_file: str) -> None:
+        self.path = path
+        self.output_file = output_file
+        self.model, self.setting, self.mode, self.metric = parse_log_name(path)
+        self.output_stat = None
+        self.outputs = None  # namespace -> [completion key] in output order, None without an output file
+        self.reset()
+
+    def reset(self):
+        self.inode = None
+        self.mtime_ns = None
+        self.offset = 0
+        self.head = b''
+        self.results = {}  # namespace -> {completion key -> passed (pass@k) or dependency_recalls (recall@k)}
+        self.scores = None
+
+    def update_outputs(self, benchmark_data) -> bool:
+        """Read the output file again if it changed, return whether it did."""
+        try:
+            stat = os.stat(self.output_file)
+            output_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            output_stat = None
+        if output_stat == self.output_stat:
+            return False
+        self.output_stat = output_stat
+        self.outputs = None
+        if output_stat is not None:
+            self.outputs = {}
+            with open(self.output_file, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        js = json.loads(line)
+                        if js['namespace'] in benchmark_data:
+                            self.outputs.setdefault(js['namespace'], []).append(completion_key(js['completion']))
+        self.scores = None
+        return True
+
+    def fingerprint(self, f, size):
+        f.seek(0)
+        return hashlib.sha1(f.read(min(size, HEAD_SIZE))).digest()
+
+    def update(self, benchmark_data) -> bool:
+        """Fold the lines appended since the last update, return whether anything changed."""
+        changed = self.update_outputs(benchmark_data)
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) == (self.inode, self.mtime_ns, self.offset):
+            return changed
+        with open(self.path, 'rb') as f:
+            if stat.st_ino != self.inode or stat.st_size < self.offset or \
+                    self.fingerprint(f, min(self.offset, HEAD_SIZE)) != self.head:
+                self.reset()
+                self.inode = stat.st_ino
+                changed = True
+            f.seek(self.offset)
+            chunk = f.read(stat.st_size - self.offset)
+            end = chunk.rfind(b'\n') + 1  # a line still being written is read next time
+            for line in chunk[:end].splitlines():
+                if line.strip():
+                    changed |= self.fold(json.loads(line), benchmark_data)
+            self.offset += end
+            self.mtime_ns = stat.st_mtime_ns
+            self.head = self.fingerprint(f, min(self.offset, HEAD_SIZE))
+        if changed:
+            self.scores = None
+        return changed
+
+    def fold(self, js, benchmark_data) -> bool:
+        namespace = js.get('namespace')
+        if namespace not in benchmark_data:
+            return False
+        if self.metric == 'pass_k':
+            if 'Result' not in js:
+                return False
+            value = js['Result'] == 'Pass'
+        else:
+            if 'generated_dependency' not in js:
+                return False
+            value = dependency_recalls(js['generated_dependency'], benchmark_data[namespace]['dependency'])
+        self.results.setdefault(namespace, {})[completion_key(js['completion'])] = value
+        return True
+
+    def compute_scores(self, k_list, benchmark_data) -> dict:
+        """Column name -> percentage (None if not defined for this log), recomputed only after changes."""
+        if self.scores is not None and self.scores[0] == tuple(k_list):
+            return self.scores[1]
+        scores = {}
+        if self.metric == 'pass_k':
+            # like scoring.pass_k_scores, every line of the output file is a completion
+            n = np.array([len(keys) for keys in self.outputs.values()], dtype=int)
+            c = np.array([sum(self.results.get(namespace, {}).get(key, False) for key in keys)
+                          for namespace, keys in self.outputs.items()], dtype=int)
+            values = pass_at_k(n, c, k_list) if len(n) else np.zeros((0, len(k_list)))
+            for i, k in enumerate(k_list):
+                # like pass_k.py, pass@k needs at least k completions of every namespace
+                scores[f'pass@{k}'] = values[:, i].mean() * 100 if len(n) and k <= n.min() else None
+        else:
+            # like scoring.dependency_scores, of the namespaces parsed in the log (standalone ones are not),
+            # an unparsed completion recalls nothing
+            for _type in ('all',) + DEPENDENCY_TYPES:
+                recalls = []
+                for namespace, keys in self.outputs.items():
+                    if namespace not in self.results or \
+                            _type != 'all' and not benchmark_data[namespace]['dependency'].get(_type):
+                        continue
+                    results = self.results[namespace]
+                    recalls.append([(results[key][_type] or 0) if key in results else 0 for key in keys])
+                for k in k_list:
+                    best = [max(recall[:k]) for recall in recalls]
+                    name = f'recall@{k}' if _type == 'all' else f'recall@{k} {_type}'
+                    scores[name] = float(np.mean(best)) * 100 if best else None
+        self.scores = (tuple(k_list), scores)
+        return scores
+
+
+class Leaderboard:
+    """The aggregates of every log of a directory, persisted between runs."""
+
+    def __init__(self, log_dir: str, data_file: str, state_file: str = None,
+                 completion_root: str = 'model_completion') -> None:
+        self.log_dir = log_dir
+        self.data_file = data_file
+        self.completion_root = completion_root
+        self.state_file = state_file or os.path.join(log_dir, 'leaderboard.state')
+        self.benchmark_data = load_benchmark_data(data_file)
+        self.data_stat = self.stat_key(data_file)
+        self.logs = {}  # path -> LogAggregate
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'rb') as f:
+                state = pickle.load(f)
+            # references changed, every recall is stale
+            if state.get('version') == STATE_VERSION and state.get('data') == self.data_stat:
+                for path, fields in state['logs'].items():
+                    self.logs[path] = aggregate = LogAggregate.__new__(LogAggregate)
+                    aggregate.__dict__.update(fields)
+
+    @staticmethod
+    def stat_key(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def refresh(self) -> bool:
+        """Read what was appended to the logs, return whether the leaderboard changed."""
+        paths = set(glob.glob(os.path.join(self.log_dir, '*.jsonl')))
+        changed = False
+        for path in set(self.logs) - paths:
+            del self.logs[path]
+            changed = True
+        for path in sorted(paths):
+            output_file = output_file_of(path, self.completion_root)
+            if path not in self.logs or self.logs[path].output_file != output_file:
+                self.logs[path] = LogAggregate(path, output_file)
+            changed |= self.logs[path].update(self.benchmark_data)
+        return changed
+
+    def save(self):
+        tmp_path = self.state_file + f'.tmp{os.getpid()}'
+        with open(tmp_path, 'wb') as f:
+            # plain fields, the state does not depend on how this module was imported
+            logs = {path: vars(aggregate) for path, aggregate in self.logs.items()}
+            pickle.dump({'version': STATE_VERSION, 'data': self.data_stat, 'logs': logs}, f)
+        os.replace(tmp_path, self.state_file)
+
+    def rows(self, k_list) -> tuple[list[str], list[dict]]:
+        """Column names and one row per (model, setting, mode), pass@k and recall@k side by side."""
+        rows = {}
+        for aggregate in self.logs.values():
+            if not aggregate.outputs:
+                continue
+            row = rows.setdefault((aggregate.setting, aggregate.model, aggregate.mode),
+                                  {'model': aggregate.model, 'setting': aggregate.setting, 'mode': aggregate.mode})
+            row.update(aggregate.compute_scores(k_list, self.benchmark_data))
+        columns = ['model', 'setting', 'mode'] + [f'pass@{k}' for k in k_list] + [f'recall@{k}' for k in k_list] + \
+            [f'recall@{k} {_type}' for _type in DEPENDENCY_TYPES for k in k_list]
+        return columns, [rows[key] for key in sorted(rows)]
+
+    def markdown(self, k_list) -> str:
+        columns, rows = self.rows(k_list)
+        lines = ['| ' + ' | '.join(columns) + ' |', '|' + '---|' * len(columns)]
+        for row in rows:
+            cells = []
+            for column in columns:
+                value = row.get(column)
+                cells.append('-' if value is None else f'{value:.2f}' if isinstance(value, float) else str(value))
+            lines.append('| ' + ' | '.join(cells) + ' |')
+        return '\n'.join(lines) + '\n'
+
+
+def write_table(output_file, table):
+    tmp_path = output_file + f'.tmp{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        f.write(table)
+    os.replace(tmp_path, output_file)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--log_dir', type=str, default='logout')
+    parser.add_argument('--data_file', type=str, default='data.jsonl')
+    parser.add_argument('--k', type=str, default='1,3,5,10')
+    parser.add_argument('--completion_root', type=str, default='model_completion',
+                        help='where the completions evaluated in the logs are, see gen_config.py')
+    parser.add_argument('--output_file', type=str, default='logout/leaderboard.md')
+    parser.add_argument('--state_file', type=str, default=None)
+    parser.add_argument('--watch', type=float, default=0, help='refresh every this many seconds, 0 to refresh once')
+    args = parser.parse_args()
+    k_list = [int(k) for k in args.k.split(',')]
+
+    leaderboard = Leaderboard(args.log_dir, args.data_file, args.state_file, args.completion_root)
+    first = True
+    while True:
+        if leaderboard.refresh() or first:
+            table = leaderboard.markdown(k_list)
+            write_table(args.output_file, table)
+            leaderboard.save()
+            print(table)
+            first = False
+        if args.watch <= 0:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,20 +7,23 @@
 Text processing/xmnlp
 """
 
-import logging
+import gc
+import multiprocessing
 import os
+import select
+import signal
+import threading
+import time
+import traceback
+from collections import OrderedDict
 
 import dill as pickle
+import psutil
 from loguru import logger
 
 from pyan_zyf_v2.analyzer import CallGraphVisitor
 from pyan_zyf_v2.anutils import get_module_name
-from pyan_zyf_v2.call_analyzer import CallAnalyzer, FolderMaker
-
-logging.basicConfig(format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s: %(message)s',
-                    level=logging.INFO,
-                    filename='func_call.log',
-                    filemode='w')
+from pyan_zyf_v2.call_analyzer import CallAnalyzer, FolderMaker, dependencies_of
 
 
 def find_py_files(folder):
@@ -38,18 +41,27 @@ folder_path = "path/to/folder"
 py_files = find_py_files(folder_path)
 
 
-def process(target_object, func_object_root, func_path, analyzer_result, target_root):
+def load_visitor(analyzer_result) -> CallGraphVisitor:
+    with open(analyzer_result, 'rb') as analyzer:
+        data = analyzer.read()
+    # the collector would repeatedly traverse the young Nodes and AST objects while they are being restored
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(data)
+    finally:
+        if enabled:
+            gc.enable()
 
-    with open(func_path, 'r') as f:
-        func_content = f.read()
 
-    with open(analyzer_result, 'rb') as analyzer:
-        v: CallGraphVisitor = pickle.loads(analyzer.read())
+def analyze(v: CallGraphVisitor, target_object, func_object_root, func_path, target_root, func_content):
+    """Add the (patched) func_path to the project visitor v and dump the call information of its functions.
 
+    v is modified, pass a private copy.
+    """
     virtual_path = func_path.replace(func_object_root, target_object)
 
-    v.add_process_one(virtual_path, content=func_content)
-    v.postprocess()
+    v.replace_file(virtual_path, func_content)
 
     # 找到func_path对应的namespace
     namespace = get_module_name(virtual_path, root=None)
@@ -57,3 +69,226 @@ def process(target_object, func_object_root, func_path, analyzer_result, target_
     graph = CallAnalyzer.from_visitor(v, target_root, prefix=namespace, logger=logger)
     folder_maker = FolderMaker(target_root)
     folder_maker.process(graph, v, target_object)
+
+
+def analyze_dependencies(v: CallGraphVisitor, target_object, func_object_root, func_path, namespace, func_content):
+    """Add the (patched) func_path to the project visitor v and return the call information of namespace only.
+
+    Returns {"in_class": [...], "in_file": [...], "in_object": [...]}, or None if
+    namespace is not defined. v is modified, pass a private copy.
+    """
+    virtual_path = func_path.replace(func_object_root, target_object)
+    v.replace_file(virtual_path, func_content)
+    return dependencies_of(v, namespace)
+
+
+def process(target_object, func_object_root, func_path, analyzer_result, target_root, func_content=None):
+    # func_content: the (patched) source of func_path, read from disk when not given
+
+    if func_content is None:
+        with open(func_path, 'r') as f:
+            func_content = f.read()
+
+    v = load_visitor(analyzer_result)
+    analyze(v, target_object, func_object_root, func_path, target_root, func_content)
+
+
+def dependencies(target_object, func_object_root, func_path, analyzer_result, namespace, func_content=None):
+    """Like process(), but return the call information of namespace instead of dumping every function of the file."""
+    if func_content is None:
+        with open(func_path, 'r') as f:
+            func_content = f.read()
+
+    v = load_visitor(analyzer_result)
+    return analyze_dependencies(v, target_object, func_object_root, func_path, namespace, func_content)
+
+
+TASKS = {'process': analyze, 'dependencies': analyze_dependencies}
+
+
+def run_forked(v: CallGraphVisitor, task, request, timeout=None):
+    """Run TASKS[task] against v in a fork of this process, return (exit code, result).
+
+    The fork is a copy-on-write snapshot: replace_file only touches the pages it
+    changes, and v itself never sees the completion. A fork running longer than
+    timeout seconds is killed.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.close(read_fd)
+            result = pickle.dumps(TASKS[task](v, **request))
+            with os.fdopen(write_fd, 'wb') as f:
+                f.write(result)
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(code)
+    os.close(write_fd)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    chunks = []
+    with os.fdopen(read_fd, 'rb', buffering=0) as f:
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                os.kill(pid, signal.SIGKILL)
+                break
+            if not select.select([f], [], [], remaining)[0]:
+                continue
+            chunk = f.read(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    _, status = os.waitpid(pid, 0)
+    code = os.waitstatus_to_exitcode(status)
+    return code, pickle.loads(b''.join(chunks)) if code == 0 else None
+
+
+def zygote(conn, analyzer_result):
+    """Hold the pristine visitor of one project, analyze every request in a fork of it (see run_forked)."""
+    os.setsid()  # VisitorCache kills the zygote and a running analysis together
+    try:
+        v = load_visitor(analyzer_result)
+    except BaseException:
+        conn.send(traceback.format_exc())
+        return
+    gc.freeze()  # keep the collector of the forks from writing to every page of the visitor
+    conn.send(None)
+    while True:
+        try:
+            task, request = conn.recv()
+        except EOFError:
+            break
+        conn.send(run_forked(v, task, request))
+
+
+class VisitorCache:
+    """Resident analyzer results, one zygote process per project (see zygote).
+
+    Zygotes are evicted least recently used first when their RSS together exceeds
+    memory_limit bytes. They are started with fork from a single-threaded process,
+    and with spawn from a threaded one (the test server), where forking is unsafe.
+    """
+
+    def __init__(self, memory_limit: int = 16 * 1024 * 1024 * 1024, timeout: float = 600) -> None:
+        self.memory_limit = memory_limit
+        self.timeout = timeout
+        self.zygotes = OrderedDict()  # analyzer_result: (process, connection), least recently used first
+
+    def get(self, analyzer_result):
+        if analyzer_result in self.zygotes:
+            zygote_process, conn = self.zygotes[analyzer_result]
+            if zygote_process.is_alive():
+                self.zygotes.move_to_end(analyzer_result)
+                return zygote_process, conn
+            self.kill(*self.zygotes.pop(analyzer_result))
+        method = 'fork' if threading.active_count() == 1 else 'spawn'
+        ctx = multiprocessing.get_context(method)
+        conn, child_conn = ctx.Pipe()
+        zygote_process = ctx.Process(target=zygote, args=(child_conn, analyzer_result), daemon=True)
+        zygote_process.start()
+        child_conn.close()
+        error = conn.recv() if conn.poll(self.timeout) else f"loading {analyzer_result} timed out"
+        if error is not None:
+            self.kill(zygote_process, conn)
+            raise RuntimeError(error)
+        logger.info(f"visitor cache: loaded {analyzer_result} ({method})")
+        self.zygotes[analyzer_result] = (zygote_process, conn)
+        self.evict()
+        return zygote_process, conn
+
+    def evict(self):
+        sizes = {}
+        for key, (zygote_process, _) in self.zygotes.items():
+            try:
+                sizes[key] = psutil.Process(zygote_process.pid).memory_info().rss
+            except psutil.Error:
+                sizes[key] = 0
+        while len(self.zygotes) > 1 and sum(sizes.values()) > self.memory_limit:
+            key, (zygote_process, conn) = self.zygotes.popitem(last=False)
+            logger.info(f"visitor cache: evicting {key}")
+            self.kill(zygote_process, conn)
+            sizes.pop(key)
+
+    def kill(self, zygote_process, conn):
+        conn.close()
+        try:
+            os.killpg(zygote_process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        zygote_process.join()
+
+    def run(self, analyzer_result, task, **request):
+        """Run TASKS[task] in a fork of the zygote of analyzer_result, return its result."""
+        if request['func_content'] is None:
+            with open(request['func_path'], 'r') as f:
+                request['func_content'] = f.read()
+        zygote_process, conn = self.get(analyzer_result)
+        try:
+            conn.send((task, request))
+            if not conn.poll(self.timeout):
+                raise TimeoutError(f"analyzing {request['func_path']} timed out")
+            code, result = conn.recv()
+        except (OSError, EOFError):
+            # the zygote is stuck or gone, the next request starts a fresh one
+            self.kill(*self.zygotes.pop(analyzer_result))
+            raise
+        if code != 0:
+            raise RuntimeError(f"analyzing {request['func_path']} failed with exit code {code}")
+        return result
+
+    def process(self, target_object, func_object_root, func_path, analyzer_result, target_root, func_content=None):
+        """Same as process(), against the resident visitor of analyzer_result."""
+        self.run(analyzer_result, 'process', target_object=target_object, func_object_root=func_object_root,
+                 func_path=func_path, target_root=target_root, func_content=func_content)
+
+    def dependencies(self, target_object, func_object_root, func_path, analyzer_result, namespace, func_content=None):
+        """Same as dependencies(), against the resident visitor of analyzer_result."""
+        return self.run(analyzer_result, 'dependencies', target_object=target_object,
+                        func_object_root=func_object_root, func_path=func_path, namespace=namespace,
+                        func_content=func_content)
+
+    def close(self):
+        while self.zygotes:
+            _, (zygote_process, conn) = self.zygotes.popitem()
+            self.kill(zygote_process, conn)
+
+
+class ResidentVisitor(VisitorCache):
+    """The visitor of the last requested project, held by this process itself.
+
+    For processes that may not start a zygote, e.g. the workers of a
+    multiprocessing pool: requests fork this process instead (see run_forked).
+    Loading another project replaces the resident one.
+    """
+
+    def __init__(self, timeout: float = 600) -> None:
+        self.timeout = timeout
+        self.analyzer_result = None
+        self.visitor = None
+
+    def get(self, analyzer_result):
+        if analyzer_result != self.analyzer_result:
+            gc.unfreeze()
+            self.analyzer_result, self.visitor = None, None
+            gc.collect()
+            self.visitor = load_visitor(analyzer_result)
+            self.analyzer_result = analyzer_result
+            gc.freeze()  # see zygote
+        return self.visitor
+
+    def run(self, analyzer_result, task, **request):
+        if request['func_content'] is None:
+            with open(request['func_path'], 'r') as f:
+                request['func_content'] = f.read()
+        code, result = run_forked(self.get(analyzer_result), task, request, timeout=self.timeout)
+        if code != 0:
+            raise RuntimeError(f"analyzing {request['func_path']} failed with exit code {code}")
+        return result
+
+    def close(self):
+        gc.unfreeze()
+        self.analyzer_result, self.visitor = None, None
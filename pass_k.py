@@ -1,16 +1,21 @@
 import json
+import multiprocessing
 import os
-import subprocess
+import queue
+import shutil
 import textwrap
-from argparse import ArgumentParser
-from subprocess import run
+import types
+from argparse import ArgumentParser, BooleanOptionalAction
 
-import func_timeout
-import numpy as np
-import psutil
-from func_timeout import func_set_timeout
+from canonical import canonical_completion, is_empty_body
+from impact import FailureHistory, ImpactIndex, order_tests
+from injection import Overlay, preflight, render_completion
 from python_repo import PythonRepo
+from result_cache import ResultCache, pass_k_key
+from scoring import bootstrap, pass_k_scores, report_lines
+from supervisor import supervise
 from tqdm import tqdm
+from utils import link_tree
 
 
 def parse_args():
@@ -21,6 +26,18 @@ def parse_args():
     parser.add_argument('--source_code_root', type=str, default='Source_Code')
     parser.add_argument('--k', type=str, default='1,3,5,10')
     parser.add_argument('--n', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--worker_root', type=str, default='Source_Code_workers')
+    parser.add_argument('--injection', type=str, default='inplace', choices=['inplace', 'overlay'])
+    parser.add_argument('--fork_server', action='store_true')
+    parser.add_argument('--batch_tests', action='store_true')
+    parser.add_argument('--exitfirst', action=BooleanOptionalAction, default=True)
+    parser.add_argument('--cache_file', type=str, default=None)
+    parser.add_argument('--order_tests', action='store_true')
+    parser.add_argument('--test_history', type=str, nargs='*', default=None)
+    parser.add_argument('--test_impact_file', type=str, default=None)
+    parser.add_argument('--select_tests', action='store_true')
+    parser.add_argument('--bootstrap', type=int, default=0)
     return parser.parse_args()
 
 
@@ -46,49 +63,11 @@ def adjust_indent(code, new_indent):
     return indented_code
 
 
-@func_set_timeout(20)
 def execution_tests(test, project_path):
     command = "pytest " + test
     print(project_path)
-    process = subprocess.Popen(['bash', '-c', command], cwd=project_path,
-                               # stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                               )
-    try:
-        while True:
-            process_id = process.pid
-            process_memory = psutil.Process(process_id).memory_info().rss
-            if process_memory > 5 * 1024 * 1024 * 1024:  # 5GB memory usage per test
-                process.terminate()
-                process.wait()
-                return False  # Out of Memory
-            return_code = process.poll()
-            if return_code is not None:
-                if return_code != 0:
-                    process.terminate()
-                    process.wait()
-                    return False  # Execution Error
-                else:
-                    break
-    except Exception as e:
-        process.terminate()
-        process.wait()
-        return False  # Other Error
-    finally:
-        process.terminate()
-        process.wait()
-    return True  # Pass
-
-
-def compute_pass_at_k(n, c, k):
-    """
-    n: total number of completions per task
-    c: number of completions that pass all tests
-    k: k in pass_at_k
-    """
-    if n - c < k:
-        return 1
-    else:
-        return 1.0 - np.prod(1.0 - k / np.arange(n-c+1, n+1))
+    result = supervise(['bash', '-c', command], cwd=project_path, env=None, timeout=20)  # 5GB memory usage per test
+    return result.passed
 
 
 def SetUp_evaluation(args, data, completion):
@@ -96,92 +75,123 @@ def SetUp_evaluation(args, data, completion):
     head_tail = os.path.split(completion_path)
     completion_tmp_path = os.path.join(head_tail[0], 'tmp_' + head_tail[1])
 
-    # rename the original completion file as tmp_completion
-    run(['cp', completion_path, completion_tmp_path])
-
-    # write the new completion file
-    sos, eos = data['body_position'][0]-1, data['body_position'][1]
-    with open(completion_path, 'r') as f:
-        file_lines = f.readlines()
-    file_lines = file_lines[:sos] + ['\n', completion, '\n'] + file_lines[eos:]
+    # write the new completion file, keeping the original as tmp_completion
+    content = render_completion(completion_path, data, completion)
+    shutil.copyfile(completion_path, completion_tmp_path)
     with open(completion_path, 'w') as f:
-        f.write(''.join(file_lines))
+        f.write(content)
 
 
 def TearDown_evaluation(args, data):
     completion_path = os.path.join(args.source_code_root, data['completion_path'])
     head_tail = os.path.split(completion_path)
     completion_tmp_path = os.path.join(head_tail[0], 'tmp_' + head_tail[1])
-    run(['mv', completion_tmp_path, completion_path])
+    os.replace(completion_tmp_path, completion_path)
+
 
+def check_correctness(args, data, details=None):
+    """Return 'Pass' or 'Fail'.
 
-def check_correctness(args, data):
+    If a dict is given as details, it is filled with the per-test report under 'Tests',
+    or with the 'Reason' when the completion failed before any test ran.
+    """
+    details = {} if details is None else details
     completion = data['completion']
-    if completion == "    pass\n":
+    if is_empty_body(completion):
+        details['Reason'] = 'Empty body'
         return 'Fail'
     completion = adjust_indent(completion, data['indent'])
 
-    SetUp_evaluation(args, data, completion)
-    project_name = data['completion_path'].split('/')[0]
+    project_name, relative_path = data['completion_path'].split('/', 1)
     project_path = os.path.join(args.source_code_root, project_name)
-    flag = 'Pass'
-    python_repo = PythonRepo(project_path)
+    source_path = os.path.join(project_path, relative_path)
+    content = render_completion(source_path, data, completion)
+    reason = preflight(source_path, content)
+    if reason is not None:
+        details['Reason'] = reason
+        return 'Fail'
+
+    report = details.setdefault('Tests', {})
+    python_repo = PythonRepo(project_path, fork_server=getattr(args, 'fork_server', False))
+    if getattr(args, 'injection', 'inplace') == 'overlay':
+        # the patched file is only visible to the test interpreter, the project tree stays pristine
+        with Overlay(project_path, relative_path, content) as overlay:
+            python_repo.env_var = overlay.environ(python_repo.env_var)
+            return run_tests(args, python_repo, data, report)
+
+    SetUp_evaluation(args, data, completion)
+    try:
+        return run_tests(args, python_repo, data, report)
+    finally:
+        TearDown_evaluation(args, data)
+
+
+def run_tests(args, python_repo, data, report=None):
+    report = {} if report is None else report
     python_repo.prepare_env()
+    exitfirst = getattr(args, 'exitfirst', True)
+    if getattr(args, 'batch_tests', False):
+        # one pytest session for all tests, per-test outcomes come from its junit-xml report
+        passed, outcomes = python_repo.run_tests(data['tests'], exitfirst=exitfirst)
+        report.update(outcomes)
+        return 'Pass' if passed else 'Fail'
 
+    flag = 'Pass'
     for test in data['tests']:
-        try:
-            # result = execution_tests(test, project_path)
-            result = python_repo.run_test(test)
-            if not result:
-                flag = 'Fail'
-                break
-        except func_timeout.exceptions.FunctionTimedOut:
+        # result = execution_tests(test, project_path)
+        result = python_repo.run_test(test)
+        report[test] = {'passed': result.passed, 'wall_time': result.wall_time, 'peak_rss': result.peak_rss}
+        if not result:
             flag = 'Fail'
-            break
-    TearDown_evaluation(args, data)
+            if exitfirst:
+                break
     return flag
 
 
+worker_args = None
+
+
+def init_worker(args, slots):
+    # every pool process owns one private clone of the projects it evaluates,
+    # so completions spliced into the same file by different workers never collide
+    global worker_args
+    worker_args = types.SimpleNamespace(**vars(args))
+    worker_args.source_code_root = os.path.join(args.worker_root, f'worker_{slots.get()}')
+    os.makedirs(worker_args.source_code_root, exist_ok=True)
+
+
+def check_correctness_in_worker(task):
+    index, pristine_root, data = task
+    project_name = data['completion_path'].split('/')[0]
+    link_tree(os.path.join(pristine_root, project_name), os.path.join(worker_args.source_code_root, project_name))
+    details = {}
+    return index, check_correctness(worker_args, data, details), details
+
+
 def report_results(args, benchmark_data):
     if not os.path.exists(args.log_file):
         raise ValueError(f'{args.log_file} does not exist')
 
-    # Collect passed completions for each namespace
-    passed_completion = {}
-    with open(args.log_file, 'r') as f:
-        for line in f:
-            js = json.loads(line)
-            if js['Result'] == 'Pass':
-                namespace, completion = js['namespace'], js['completion']
-                if namespace not in passed_completion:
-                    passed_completion[namespace] = set()
-                passed_completion[namespace].add(completion)
-
-    # Iterate through all completions and count the number of passed completions for each namespace
-    results = {}
-    with open(args.output_file, 'r') as f:
-        for line in f:
-            js = json.loads(line)
-            namespace, completion = js['namespace'], js['completion']
-            if namespace in benchmark_data:
-                if namespace not in results:
-                    results[namespace] = 0
-                if namespace in passed_completion and completion in passed_completion[namespace]:
-                    results[namespace] += 1
-
-    # Compute Pass@k
-    k_list = [int(k) for k in args.k.split(',')]
-    writes = []
-    for k in k_list:
-        if k > args.n:
-            continue
-        pass_at_k = np.mean([compute_pass_at_k(args.n, pass_num, k) for namespace, pass_num in results.items()])
-        print(f'pass_at_{k}: {pass_at_k*100}%')
-        writes.append(f'pass_at_{k}: {pass_at_k*100}%\n')
+    # Compute Pass@k of every namespace for all k at once, see scoring.py
+    k_list = [k for k in (int(k) for k in args.k.split(',')) if k <= args.n]
+    scores = pass_k_scores(args.log_file, args.output_file, benchmark_data, args.n, k_list)
+    interval = bootstrap(scores, getattr(args, 'bootstrap', 0))
+    writes = report_lines('pass_at_{k}: {value}%', k_list, scores, interval)
+    for line in writes:
+        print(line, end='')
     with open(args.write_rst, "w") as f:
         f.writelines(writes)
 
 
+def write_result(f, output, result, details, cached=False):
+    output['Result'] = result
+    output.update((key, value) for key, value in details.items() if value)
+    if cached:
+        output['Cached'] = True
+    f.write(json.dumps(output) + '\n')
+    f.flush()
+
+
 def load_finished_data(args):
     finished_data = {}
     if os.path.exists(args.log_file):
@@ -224,17 +234,96 @@ def main():
             namespace = js['namespace']
             benchmark_data[namespace] = js
 
-    # iterate through the output data
+    # evaluate once per namespace and class of semantically identical completions, see canonical.py
+    todo_output_data = [output for output in todo_output_data if output['namespace'] in benchmark_data]
+    classes = {}
+    for output in todo_output_data:
+        classes.setdefault((output['namespace'], canonical_completion(output['completion'])), []).append(output)
+    todo_classes = list(classes.values())
+    print("Distinct Completions: ", len(todo_classes))
+
+    # run the tests most likely to fail first (or only those reaching the function), see impact.py
+    index = ImpactIndex.load(args.test_impact_file) if getattr(args, 'test_impact_file', None) else None
+    history = None
+    if getattr(args, 'order_tests', False):
+        history = FailureHistory.from_logs(getattr(args, 'test_history', None) or [args.log_file])
+    select = getattr(args, 'select_tests', False)
+
+    def sample(outputs):
+        data = benchmark_data[outputs[0]['namespace']]
+        tests = order_tests(data, index, history, select=select)
+        return dict(data, completion=outputs[0]['completion'], tests=tests)
+
+    # reuse results of identical completions evaluated before (by any model or run)
+    cache = ResultCache.open(args.cache_file) if getattr(args, 'cache_file', None) else None
+    cache_keys = {}
     with open(args.log_file, 'a') as f:
-        for output in tqdm(todo_output_data):
-            namespace = output['namespace']
-            if namespace in benchmark_data:
-                data = benchmark_data[namespace]
-                data['completion'] = output['completion']
-                result = check_correctness(args, data)
-                output['Result'] = result
-                f.write(json.dumps(output) + '\n')
-                f.flush()
+        if cache is not None:
+            uncached_classes = []
+            for outputs in todo_classes:
+                data = benchmark_data[outputs[0]['namespace']]
+                if select:
+                    # the result only covers the selected tests (their order does not change it)
+                    data = dict(data, tests=order_tests(data, index, select=True))
+                key = pass_k_key(args.source_code_root, data, outputs[0]['completion'])
+                cached = cache.get(key)
+                if cached is None:
+                    cache_keys[id(outputs)] = key
+                    uncached_classes.append(outputs)
+                else:
+                    for output in outputs:
+                        write_result(f, output, cached['Result'], cached, cached=True)
+            print("Cached Completions: ", len(todo_classes) - len(uncached_classes))
+            todo_classes = uncached_classes
+
+        # iterate through the output data, the result of a class is logged for each of its completions
+        workers = getattr(args, 'workers', 1)
+        if workers > 1:
+            slots = multiprocessing.Queue()
+            for i in range(workers):
+                slots.put(i)
+            args.worker_root = getattr(args, 'worker_root', 'Source_Code_workers')
+            finished = queue.SimpleQueue()
+            remaining = iter(range(len(todo_classes)))
+
+            def submit():
+                # a class is sampled only when a worker is about to be free, so its tests are
+                # ordered by the history of all classes finished before
+                for i in remaining:
+                    task = (i, args.source_code_root, sample(todo_classes[i]))
+                    pool.apply_async(check_correctness_in_worker, (task,), callback=finished.put,
+                                     error_callback=finished.put)
+                    return 1
+                return 0
+
+            with multiprocessing.Pool(workers, initializer=init_worker, initargs=(args, slots)) as pool, \
+                    tqdm(total=len(todo_classes)) as pbar:
+                running = sum(submit() for _ in range(2 * workers))
+                while running:
+                    finished_task = finished.get()
+                    if isinstance(finished_task, BaseException):
+                        raise finished_task
+                    running += submit() - 1
+                    pbar.update(1)
+                    i, result, details = finished_task
+                    outputs = todo_classes[i]
+                    if history is not None and details.get('Tests'):
+                        history.update(outputs[0]['namespace'], details['Tests'])
+                    for output in outputs:
+                        write_result(f, output, result, details)
+                    if cache is not None:
+                        cache.put(cache_keys[id(outputs)], dict(details, Result=result))
+        else:
+            for outputs in tqdm(todo_classes):
+                data = sample(outputs)
+                details = {}
+                result = check_correctness(args, data, details)
+                if history is not None and details.get('Tests'):
+                    history.update(data['namespace'], details['Tests'])
+                for output in outputs:
+                    write_result(f, output, result, details)
+                if cache is not None:
+                    cache.put(cache_keys[id(outputs)], dict(details, Result=result))
 
     report_results(args, benchmark_data)
 
@@ -4,13 +4,14 @@
 
 import ast
 import logging
-import symtable
+import multiprocessing
 from typing import List, Union
 from func_timeout import func_set_timeout
 import func_timeout
 
 from .anutils import (
     ExecuteInInnerScope,
+    ParseCache,
     Scope,
     UnresolvedSuperCallError,
     format_alias,
@@ -21,6 +22,7 @@ from .anutils import (
     tail,
 )
 from .node import Flavor, Node
+from .trace import Tracer
 
 import traceback
 
@@ -58,6 +60,20 @@ import traceback
 #
 
 
+def prepare_file(task):
+    """The file-local part of analyzing a file, run in the pool of CallGraphVisitor.process().
+
+    Return its source and lexical scopes, or None and the exception to raise when the file is visited.
+    """
+    filename, module_name, cache_dir = task
+    try:
+        with open(filename, "rt", encoding="utf-8") as f:
+            content = f.read()
+        return content, ParseCache(cache_dir).scopes(content, filename, module_name)
+    except Exception as e:
+        return None, e
+
+
 class CallGraphVisitor(ast.NodeVisitor):
     """A visitor that can be walked over a Python AST, and will derive
     information about the objects in the AST and how they use each other.
@@ -67,8 +83,12 @@ class CallGraphVisitor(ast.NodeVisitor):
     all files.  This way use information between objects in different files
     can be gathered."""
 
-    def __init__(self, filenames, root: str = None, logger=None):
+    def __init__(self, filenames, root: str = None, logger=None, workers: int = 1, cache_dir: str = None,
+                 trace: Tracer = None):
         self.logger = logger or logging.getLogger(__name__)
+        self.trace = trace or Tracer.from_env(self.logger)  # off unless categories are enabled, see trace.py
+        self.workers = workers  # processes reading files and extracting their scopes, see process()
+        self.parse_cache = ParseCache(cache_dir)  # trees and scopes of the files, scopes also kept in cache_dir
 
         # full module names for all given files
         self.module_to_filename = {}  # inverse mapping for recording which file each AST node came from
@@ -87,6 +107,7 @@ class CallGraphVisitor(ast.NodeVisitor):
         self.virtual_uses_edges = {}  # 对于找不到具体定义位置的名称，将其作为虚拟节点，用于记录其使用关系
         self.relevant_edges = {}
         self.nodes = {}  # Node name: list of Node objects (in possibly different namespaces)
+        self.node_index = {}  # (namespace, name): the first Node of self.nodes[name] in that namespace
         self.scopes = {}  # fully qualified name of namespace: Scope object
 
         self.class_base_ast_nodes = {}  # pass 1: class Node: list of AST nodes
@@ -117,48 +138,89 @@ class CallGraphVisitor(ast.NodeVisitor):
         # Analyze.
         self.process()
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "node_index" not in state:  # pickled before the index existed
+            self.reindex_nodes()
+        if "parse_cache" not in state:
+            self.parse_cache = ParseCache()
+        if "trace" not in state:  # pickled when the analyzer logged everything
+            self.trace = Tracer.from_env(self.logger)
+
     def process(self):
-        """Analyze the set of files, twice so that any forward-references are picked up."""
+        """Analyze the set of files, twice so that any forward-references are picked up.
+
+        With several workers, files are read and their scopes extracted in a process
+        pool (see prepare_file()), while the first pass visits the files already prepared.
+        The result of a file is used by both passes.
+        """
+        pool = None
+        results = None  # prepare_file() of self.filenames, in order
+        if self.workers > 1 and len(self.filenames) > 1:
+            pool = multiprocessing.Pool(min(self.workers, len(self.filenames)))
+            tasks = [(filename, get_module_name(filename, root=self.root), self.parse_cache.cache_dir)
+                     for filename in self.filenames]
+            results = pool.imap(prepare_file, tasks, chunksize=max(1, len(tasks) // (self.workers * 8)))
+        try:
+            self.process_files(results)
+        finally:
+            if pool is not None:
+                pool.terminate()
+            self.parse_cache.clear()
+
+    def process_files(self, results=None):
+        prepared = {}
         for pas in range(2):
             self.pas_time = pas
             from tqdm import tqdm
             pbar = tqdm(self.filenames)
             for filename in pbar:
+                if results is not None and pas == 0:
+                    prepared[filename] = next(results)
                 pbar.set_description('analyze '+filename)
-                self.logger.info("========== pass %d, file '%s' ==========" % (pas + 1, filename))
+                if self.trace.files:
+                    self.trace.files("========== pass %d, file '%s' ==========", pas + 1, filename)
                 try:
-                    self.process_one(filename)
+                    self.process_one(filename, prepared.get(filename))
                 except func_timeout.exceptions.FunctionTimedOut:
                     print('time out '+filename)
-                    self.name_stack = []
-                    self.class_stack = []
-                    self.scope_stack = []
-                    self.context_stack = []
+                    self.reset_context()
                 except Exception as e:
                     print(traceback.format_exc())
                     print("error "+filename)
-                    self.name_stack = []
-                    self.class_stack = []
-                    self.scope_stack = []
-                    self.context_stack = []
+                    self.reset_context()
             if pas == 0:
                 self.resolve_base_classes()  # must be done only after all files seen
         self.postprocess()
 
+    def reset_context(self):
+        """Leave the file being visited, after an error."""
+        self.name_stack = []
+        self.class_stack = []
+        self.scope_stack = []
+        self.context_stack = []
+
     # @func_set_timeout(30)
-    def process_one(self, filename):
-        """Analyze the specified Python source file."""
+    def process_one(self, filename, prepared=None):
+        """Analyze the specified Python source file, optionally with the result of prepare_file()."""
         if filename not in self.filenames:
             raise ValueError(
                 "Filename '%s' has not been preprocessed (was not given to __init__, which got %s)"
                 % (filename, self.filenames)
             )
-        with open(filename, "rt", encoding="utf-8") as f:
-            content = f.read()
+        if prepared is None:
+            with open(filename, "rt", encoding="utf-8") as f:
+                content = f.read()
+            scopes = None
+        else:
+            content, scopes = prepared
+            if content is None:
+                raise scopes
         self.filename = filename
         self.module_name = get_module_name(filename, root=self.root)
-        self.analyze_scopes(content, filename)  # add to the currently known scopes
-        self.visit(ast.parse(content, filename))
+        key = self.parse_cache.key(content)
+        self.analyze_scopes(content, filename, scopes, key=key)  # add to the currently known scopes
+        self.visit(self.parse_cache.parse(content, filename, key))  # parsed once for both passes
         self.module_name = None
         self.filename = None
 
@@ -166,20 +228,108 @@ class CallGraphVisitor(ast.NodeVisitor):
     def add_process_one(self, filename, content):
         self.filename = filename
         self.module_name = get_module_name(filename, root=self.root)
-        self.analyze_scopes(content, filename)  # add to the currently known scopes
-        self.visit(ast.parse(content, filename))
+        key = self.parse_cache.key(content)
+        try:
+            self.analyze_scopes(content, filename, key=key)  # add to the currently known scopes
+            self.visit(self.parse_cache.parse(content, filename, key))
+        finally:
+            self.parse_cache.clear()  # the visitor outlives this content
         self.module_name = None
         self.filename = None
 
-    def resolve_base_classes(self):
+    def in_namespaces(self, name, namespaces):
+        """Whether the fully qualified name lies in (or is) one of namespaces."""
+        return any(name == ns or name.startswith(ns + ".") for ns in namespaces)
+
+    def retract_file(self, filename):
+        """Forget what the analysis of filename contributed, return the Nodes it owned.
+
+        Scopes, outgoing edges and functional info of the module and everything
+        inside it, but not of its submodules, are dropped. Its Nodes stay in
+        self.nodes, so that edges from other files keep pointing to them, but
+        lose their analysis state until the file is visited again.
+        """
+        module_name = get_module_name(filename, root=self.root)
+        # the package of an __init__.py contains the modules of the other files in it
+        # (module_to_filename is keyed by the names without a root, no need to infer them again)
+        module_names = self.module_to_filename if self.root is None else \
+            (get_module_name(f, root=self.root) for f in self.filenames)
+        submodules = [name for name in module_names if name != module_name and self.in_namespaces(name, [module_name])]
+
+        def is_owned(name):
+            return self.in_namespaces(name, [module_name]) and not self.in_namespaces(name, submodules)
+
+        for table in (self.scopes, self.defines_edges, self.uses_edges, self.import_uses_edges,
+                      self.virtual_uses_edges, self.functional_info):
+            for name in [name for name in table if is_owned(name)]:
+                del table[name]
+
+        owned = []
+        for nodes in self.nodes.values():
+            for n in nodes:
+                if n.namespace is not None and is_owned(n.get_name()):
+                    n.defined = False
+                    n.value = None
+                    n.actual_path = None
+                    n.defined_path = None
+                    owned.append(n)
+        for n in owned:
+            self.class_base_ast_nodes.pop(n, None)
+            self.class_base_nodes.pop(n, None)
+            self.mro.pop(n, None)
+        return owned
+
+    def replace_file(self, filename, content):
+        """Analyze content as the new source of filename, in time proportional to the file.
+
+        Unlike add_process_one(), which visits the new source on top of the old
+        one, the old analysis of the file is retracted first, and the file is
+        visited twice like process() does for the whole project. Files that
+        import it are not re-analyzed: their edges into it are kept as they were.
+        """
+        self.replace_files({filename: content}, strict=True)
+
+    def replace_files(self, contents, strict=False):
+        """Analyze several files anew (contents: filename -> new source) in one run of both passes.
+
+        Like replace_file(), but forward references between the given files are
+        picked up. A file that fails is reported and skipped like process() does,
+        or with strict, the error is raised.
+        """
+        for filename in contents:
+            self.retract_file(filename)
+        module_names = [get_module_name(filename, root=self.root) for filename in contents]
+        pas_time = self.pas_time
+        for pas in range(2):
+            self.pas_time = pas
+            for filename, content in contents.items():
+                try:
+                    self.add_process_one(filename, content)
+                except Exception:
+                    if strict:
+                        raise
+                    print(traceback.format_exc())
+                    print("error "+filename)
+                    self.reset_context()
+            if pas == 0:
+                classes = [n for n in self.class_base_ast_nodes if self.in_namespaces(n.get_name(), module_names)]
+                self.resolve_base_classes(classes)
+        self.pas_time = max(pas_time, 1)
+        self.postprocess(namespaces=module_names)
+
+    def resolve_base_classes(self, classes=None):
         """Resolve base classes from AST nodes to Nodes.
 
         Run this between pass 1 and pass 2 to pick up inherited methods.
         Currently, this can parse ast.Names and ast.Attributes as bases.
+
+        With classes, only those are resolved (see replace_file()); the MRO of
+        classes elsewhere that derive from them is not recomputed.
         """
-        self.logger.debug("Resolving base classes")
+        if self.trace.mro:
+            self.trace.mro("Resolving base classes")
         assert len(self.scope_stack) == 0  # only allowed between passes
-        for node in self.class_base_ast_nodes:  # Node: list of AST nodes
+        for node in (self.class_base_ast_nodes if classes is None else classes):  # Node: list of AST nodes
             self.class_base_nodes[node] = []
             for ast_node in self.class_base_ast_nodes[node]:
                 # perform the lookup in the scope enclosing the class definition
@@ -197,14 +347,30 @@ class CallGraphVisitor(ast.NodeVisitor):
                 if isinstance(baseclass_node, Node) and baseclass_node.namespace is not None:
                     self.class_base_nodes[node].append(baseclass_node)
 
-        self.logger.debug("All base classes (non-recursive, local level only): %s" % self.class_base_nodes)
+        if classes is not None:
+            # linearize the given classes only, over their ancestors
+            class_base_nodes = {}
+            stack = list(classes)
+            while stack:
+                node = stack.pop()
+                if node not in class_base_nodes and node in self.class_base_nodes:
+                    class_base_nodes[node] = self.class_base_nodes[node]
+                    stack.extend(class_base_nodes[node])
+            mro = resolve_method_resolution_order(class_base_nodes, self.trace)
+            self.mro.update((node, mro[node]) for node in classes if node in mro)
+            return
 
-        self.logger.debug("Resolving method resolution order (MRO) for all analyzed classes")
-        self.mro = resolve_method_resolution_order(self.class_base_nodes, self.logger)
-        self.logger.debug("Method resolution order (MRO) for all analyzed classes: %s" % self.mro)
+        if self.trace.mro:
+            self.trace.mro("All base classes (non-recursive, local level only): %s", self.class_base_nodes)
 
-    def postprocess(self):
-        """Finalize the analysis."""
+        if self.trace.mro:
+            self.trace.mro("Resolving method resolution order (MRO) for all analyzed classes")
+        self.mro = resolve_method_resolution_order(self.class_base_nodes, self.trace)
+        if self.trace.mro:
+            self.trace.mro("Method resolution order (MRO) for all analyzed classes: %s", self.mro)
+
+    def postprocess(self, namespaces=None):
+        """Finalize the analysis, of the given namespaces only if given (see replace_file())."""
 
         # Compared to the original Pyan, the ordering of expand_unknowns() and
         # contract_nonexistents() has been switched.
@@ -224,7 +390,7 @@ class CallGraphVisitor(ast.NodeVisitor):
         # self.resolve_imports()
         # self.contract_nonexistents()
         # self.cull_inherited()
-        self.collapse_inner()
+        self.collapse_inner(namespaces)
 
     ###########################################################################
     # visitor methods
@@ -290,6 +456,7 @@ class CallGraphVisitor(ast.NodeVisitor):
 
         # remap nodes based on import mapping
         self.nodes = {name: [import_mapping.get(n, n) for n in items] for name, items in self.nodes.items()}
+        self.reindex_nodes()
         self.uses_edges = {
             import_mapping.get(from_node, from_node): {import_mapping.get(to_node, to_node) for to_node in to_nodes}
             for from_node, to_nodes in self.uses_edges.items()
@@ -318,6 +485,7 @@ class CallGraphVisitor(ast.NodeVisitor):
         filtered_nodes = self.get_related_nodes(node, namespace=namespace, max_iter=max_iter)
 
         self.nodes = {name: [node for node in nodes if node in filtered_nodes] for name, nodes in self.nodes.items()}
+        self.reindex_nodes()
         self.uses_edges = {
             node: {n for n in nodes if n in filtered_nodes}
             for node, nodes in self.uses_edges.items()
@@ -392,7 +560,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         return new_nodes
 
     def visit_Module(self, node):
-        self.logger.debug("Module %s, %s" % (self.module_name, self.filename))
+        if self.trace.files:
+            self.trace.files("Module %s, %s", self.module_name, self.filename)
 
         # Modules live in the top-level namespace, ''.
         module_ns, module_name = self.split(self.module_name)
@@ -415,7 +584,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         self.last_value = None
 
         if self.add_defines_edge(module_node, None):
-            self.logger.info("Def Module %s" % node)
+            if self.trace.defs:
+                self.trace.defs("Def Module %s", node)
 
         if module_node.get_name() not in self.uses_edges:
             self.uses_edges[module_node.get_name()] = set()
@@ -423,7 +593,8 @@ class CallGraphVisitor(ast.NodeVisitor):
             self.virtual_uses_edges[module_node.get_name()] = {}
 
     def visit_ClassDef(self, node):
-        self.logger.debug("ClassDef %s, %s:%s" % (node.name, self.filename, node.lineno))
+        if self.trace.defs:
+            self.trace.defs("ClassDef %s, %s:%s", node.name, self.filename, node.lineno)
 
         if node.name == "CallbackAuthenticationPolicy":
             self.qika_effective_principals = 1
@@ -435,7 +606,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         class_node.set_type(class_node.get_name())
         class_node.set_defined_path(class_node.get_name())
         if self.add_defines_edge(from_node, class_node):
-            self.logger.info("Def from %s to Class %s" % (from_node, class_node))
+            if self.trace.defs:
+                self.trace.defs("Def from %s to Class %s", from_node, class_node)
 
         if class_node.get_name() not in self.uses_edges:
             self.uses_edges[class_node.get_name()] = set()
@@ -480,7 +652,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         self.class_stack.pop()
 
     def visit_FunctionDef(self, node):
-        self.logger.debug("FunctionDef %s, %s:%s" % (node.name, self.filename, node.lineno))
+        if self.trace.defs:
+            self.trace.defs("FunctionDef %s, %s:%s", node.name, self.filename, node.lineno)
 
         # To begin with:
         #
@@ -504,7 +677,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         func_node.set_type(func_node.get_name())
         func_node.set_value(func_node)
         if self.add_defines_edge(from_node, func_node):
-            self.logger.info("Def from %s to Function %s" % (from_node, func_node))
+            if self.trace.defs:
+                self.trace.defs("Def from %s to Function %s", from_node, func_node)
 
         self.uses_edges[func_node.get_name()] = set()
 
@@ -544,7 +718,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         if self_name is not None:
             class_node = self.get_current_class()
             self.scopes[inner_ns].defs[self_name] = class_node
-            self.logger.info('Method def: setting self name "%s" to %s' % (self_name, class_node))
+            if self.trace.defs:
+                self.trace.defs('Method def: setting self name "%s" to %s', self_name, class_node)
 
         # record bindings of args to the given default values, if present
         self.analyze_arguments(node.args)
@@ -594,12 +769,14 @@ class CallGraphVisitor(ast.NodeVisitor):
                 if candidate_type is not None:
                     return_type = candidate_type
                     self.scopes[inner_ns].set_Return(return_type)
-                    self.logger.debug("Set Return of %s as %s" % (inner_ns, return_type))
+                    if self.trace.defs:
+                        self.trace.defs("Set Return of %s as %s", inner_ns, return_type)
                 elif candidate_name is not None:
                     return_type = candidate_name
                     if self.scopes[inner_ns].Return is None:
                         self.scopes[inner_ns].set_Return(return_type)
-                        self.logger.debug("Set Return of %s as %s" % (inner_ns, return_type))
+                        if self.trace.defs:
+                            self.trace.defs("Set Return of %s as %s", inner_ns, return_type)
 
         # Exit the function scope
         #
@@ -612,7 +789,8 @@ class CallGraphVisitor(ast.NodeVisitor):
 
     def visit_Lambda(self, node):
         # TODO: avoid lumping together all lambdas in the same namespace.
-        self.logger.debug("Lambda, %s:%s" % (self.filename, node.lineno))
+        if self.trace.defs:
+            self.trace.defs("Lambda, %s:%s", self.filename, node.lineno)
         with ExecuteInInnerScope(self, "lambda"):
             inner_ns = self.get_node_of_current_namespace().get_name()
             self.generate_args_nodes(node.args, inner_ns)
@@ -687,7 +865,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                     self.analyze_binding(targets, values)
 
     def visit_Import(self, node):
-        self.logger.debug("Import %s, %s:%s" % ([format_alias(x) for x in node.names], self.filename, node.lineno))
+        if self.trace.imports:
+            self.trace.imports("Import %s, %s:%s", [format_alias(x) for x in node.names], self.filename, node.lineno)
 
         # TODO: add support for relative imports (path may be like "....something.something")
         # https://www.python.org/dev/peps/pep-0328/#id10
@@ -698,10 +877,11 @@ class CallGraphVisitor(ast.NodeVisitor):
         pass
 
     def visit_ImportFrom(self, node):
-        self.logger.debug(
-            "ImportFrom: from %s import %s, %s:%s"
-            % (node.module, [format_alias(x) for x in node.names], self.filename, node.lineno)
-        )
+        if self.trace.imports:
+            self.trace.imports(
+                "ImportFrom: from %s import %s, %s:%s",
+                node.module, [format_alias(x) for x in node.names], self.filename, node.lineno
+            )
         # Pyan needs to know the package structure, and how the program
         # being analyzed is actually going to be invoked (!), to be able to
         # resolve relative imports correctly.
@@ -709,29 +889,33 @@ class CallGraphVisitor(ast.NodeVisitor):
         # As a solution, we register imports here and later, when all files have been parsed, resolve them.
         from_node = self.get_node_of_current_namespace()
         if node.module is None:  # resolve relative imports 'None' such as "from . import foo"
-            self.logger.debug(
-                "ImportFrom (original) from %s import %s, %s:%s"
-                % ("." * node.level, [format_alias(x) for x in node.names], self.filename, node.lineno)
-            )
+            if self.trace.imports:
+                self.trace.imports(
+                    "ImportFrom (original) from %s import %s, %s:%s",
+                    "." * node.level, [format_alias(x) for x in node.names], self.filename, node.lineno
+                )
             tgt_level = node.level
             current_module_namespace = self.module_name.rsplit(".", tgt_level)[0]
             tgt_name = current_module_namespace
-            self.logger.debug(
-                "ImportFrom (resolved): from %s import %s, %s:%s"
-                % (tgt_name, [format_alias(x) for x in node.names], self.filename, node.lineno)
-            )
+            if self.trace.imports:
+                self.trace.imports(
+                    "ImportFrom (resolved): from %s import %s, %s:%s",
+                    tgt_name, [format_alias(x) for x in node.names], self.filename, node.lineno
+                )
         elif node.level != 0:  # resolve from ..module import foo
-            self.logger.debug(
-                "ImportFrom (original): from %s import %s, %s:%s"
-                % (node.module, [format_alias(x) for x in node.names], self.filename, node.lineno)
-            )
+            if self.trace.imports:
+                self.trace.imports(
+                    "ImportFrom (original): from %s import %s, %s:%s",
+                    node.module, [format_alias(x) for x in node.names], self.filename, node.lineno
+                )
             tgt_level = node.level
             current_module_namespace = self.module_name.rsplit(".", tgt_level)[0]
             tgt_name = current_module_namespace + "." + node.module
-            self.logger.debug(
-                "ImportFrom (resolved): from %s import %s, %s:%s"
-                % (tgt_name, [format_alias(x) for x in node.names], self.filename, node.lineno)
-            )
+            if self.trace.imports:
+                self.trace.imports(
+                    "ImportFrom (resolved): from %s import %s, %s:%s",
+                    tgt_name, [format_alias(x) for x in node.names], self.filename, node.lineno
+                )
         else:
             if node.module == "asciimatics.constants":
                 qika = 1
@@ -773,7 +957,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                 mod_node = self.get_node(tgt_name, alias.name, flavor=Flavor.IMPORTEDITEM)
                 if mod_node.defined:
                     # 将import_node的类型设置为真实类节点路径，并且将其的值设置为真实类节点
-                    self.logger.debug("Set type of %s to %s" % (import_node, mod_node))
+                    if self.trace.imports:
+                        self.trace.imports("Set type of %s to %s", import_node, mod_node)
                     import_node.set_value(mod_node)
                     import_node.set_type(mod_node.get_type())
 
@@ -781,7 +966,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                 mod_node = self.find_scope_def_node(tgt_name, alias.name)
                 if mod_node and mod_node.defined:
                     # 将import_node的类型设置为真实类节点路径，并且将其的值设置为真实类节点
-                    self.logger.debug("Set type of %s to %s" % (import_node, mod_node))
+                    if self.trace.imports:
+                        self.trace.imports("Set type of %s to %s", import_node, mod_node)
                     import_node.set_value(mod_node)
                     import_node.set_type(mod_node.get_type())
                 else:
@@ -789,7 +975,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                     mod_node = self.find_scope_def_node(candidate_path, alias.name)
                     if mod_node and mod_node.defined:
                         # 将import_node的类型设置为真实类节点路径，并且将其的值设置为真实类节点
-                        self.logger.debug("Set type of %s to %s" % (import_node, mod_node))
+                        if self.trace.imports:
+                            self.trace.imports("Set type of %s to %s", import_node, mod_node)
                         import_node.set_value(mod_node)
                         import_node.set_type(mod_node.get_type())
 
@@ -798,12 +985,15 @@ class CallGraphVisitor(ast.NodeVisitor):
             self.import_uses_edges[from_node.get_name()][alias_name] = mod_node if isinstance(
                 mod_node, Node) and mod_node.defined else self.get_node(tgt_name, alias.name, flavor=Flavor.IMPORTEDITEM)
 
-            self.logger.debug("Use as ImportFrom from %s to %s" % (from_node, import_node))
+            if self.trace.uses:
+                self.trace.uses("Use as ImportFrom from %s to %s", from_node, import_node)
             if self.add_uses_edge(from_node, import_node):
 
-                self.logger.info("New edge added for Use from %s to %s" % (from_node, import_node))
+                if self.trace.uses:
+                    self.trace.uses("New edge added for Use from %s to %s", from_node, import_node)
 
-            self.logger.info("From setting name %s to %s" % (alias_name, import_node.get_value()))
+            if self.trace.imports:
+                self.trace.imports("From setting name %s to %s", alias_name, import_node.get_value())
             self.set_value(alias_name, new_value=import_node.get_value(),
                            defined=False)  # set node to be discoverable in module
 
@@ -838,14 +1028,16 @@ class CallGraphVisitor(ast.NodeVisitor):
             self.import_uses_edges[from_node.get_name()] = {}
         self.import_uses_edges[from_node.get_name()][alias_name] = mod_node
         if self.add_uses_edge(from_node, mod_node):
-            self.logger.info("New edge added for Use import %s in %s" % (mod_node, from_node))
+            if self.trace.uses:
+                self.trace.uses("New edge added for Use import %s in %s", mod_node, from_node)
 
         import_node = self.get_node(current_namespace, alias_name, flavor=Flavor.IMPORTEDITEM)
         import_node.set_value(mod_node)
         import_node.set_type(mod_node.get_name())
 
         self.set_value(alias_name, new_value=import_node, defined=False)  # set node to be discoverable in module
-        self.logger.info("From setting name %s to %s" % (alias_name, mod_node))
+        if self.trace.imports:
+            self.trace.imports("From setting name %s to %s", alias_name, mod_node)
 
         pass
 
@@ -859,7 +1051,8 @@ class CallGraphVisitor(ast.NodeVisitor):
     # TODO: actually test this with Python 3.6 or later.
     #
     def visit_Constant(self, node):
-        self.logger.debug("Constant %s, %s:%s" % (node.value, self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("Constant %s, %s:%s", node.value, self.filename, node.lineno)
         t = type(node.value)
         ns = self.get_node_of_current_namespace().get_name()
         tn = t.__name__
@@ -873,16 +1066,19 @@ class CallGraphVisitor(ast.NodeVisitor):
         objname = get_ast_node_name(node.value)
         if objname == "bz2.BZ2File":
             qika = 1
-        self.logger.debug(
-            "Attribute %s of %s in context %s, %s:%s" % (node.attr, objname, type(node.ctx), self.filename, node.lineno)
-        )
+        if self.trace.attrs:
+            self.trace.attrs(
+                "Attribute %s of %s in context %s, %s:%s",
+                node.attr, objname, type(node.ctx), self.filename, node.lineno
+            )
 
         if isinstance(node.ctx, ast.Store):
             new_value = self.last_value
             new_type = self.last_type
             try:
                 if self.set_attribute(node, new_value, new_type):
-                    self.logger.info("setattr %s on %s to %s" % (node.attr, objname, new_value))
+                    if self.trace.bindings:
+                        self.trace.bindings("setattr %s on %s to %s", node.attr, objname, new_value)
             except UnresolvedSuperCallError:
                 # Trying to set something belonging to an unresolved super()
                 # of something; just ignore this attempt to setattr.
@@ -916,7 +1112,8 @@ class CallGraphVisitor(ast.NodeVisitor):
 
     # name access (node.ctx determines whether set (ast.Store) or get (ast.Load))
     def visit_arg(self, node):
-        self.logger.debug("arg %s, %s:%s" % (node.arg, self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("arg %s, %s:%s", node.arg, self.filename, node.lineno)
 
         # 获取参数类型标注
         arg_type = None
@@ -944,7 +1141,8 @@ class CallGraphVisitor(ast.NodeVisitor):
 
     # name access (node.ctx determines whether set (ast.Store) or get (ast.Load))
     def visit_Name(self, node):
-        self.logger.debug("Name %s in context %s, %s:%s" % (node.id, type(node.ctx), self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("Name %s in context %s, %s:%s", node.id, type(node.ctx), self.filename, node.lineno)
 
         if isinstance(node.ctx, ast.Store):
             # when we get here, self.last_value has been set by visit_Assign()
@@ -990,18 +1188,23 @@ class CallGraphVisitor(ast.NodeVisitor):
 
                 # 如果name在name_ns下是一个被defined的节点，则认为其是引用了一个变量而非类型，添加true_type=False的use边
                 if name_node.defined:
-                    self.logger.debug("Use name from %s to %s (use as a variable)" % (from_node, name_node))
+                    if self.trace.uses:
+                        self.trace.uses("Use name from %s to %s (use as a variable)", from_node, name_node)
                     if self.add_uses_edge(from_node, name_node, true_type=False):
-                        self.logger.info(
-                            "New edge added for Use from %s to %s (use a variable)" % (from_node, name_node)
-                        )
+                        if self.trace.uses:
+                            self.trace.uses(
+                                "New edge added for Use from %s to %s (use a variable)", from_node, name_node
+                            )
                 # 不然，认为name不是在name_ns下定义的，而是引入的一个外部类名称或函数名称，即使用了一个真实类或函数类型，添加true_type=True的use边
                 else:
-                    self.logger.debug("Use name from %s to %s (use as a type)" % (from_node, name_node))
+                    if self.trace.uses:
+                        self.trace.uses("Use name from %s to %s (use as a type)", from_node, name_node)
                     if self.add_uses_edge(from_node, name_node):
-                        self.logger.info(
-                            "New edge added for Use from %s to %s (use a type name)" % (from_node, name_node.get_type())
-                        )
+                        if self.trace.uses:
+                            self.trace.uses(
+                                "New edge added for Use from %s to %s (use a type name)",
+                                from_node, name_node.get_type()
+                            )
 
             # 如果name是list或dict，则考虑“列表的类型是其中元素的类型”，不赋值
             if name_node is not None and name_node.get_type() in ['list', 'dict', 'tuple']:
@@ -1015,7 +1218,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         # - tuple unpacking works as a separate mechanism on top of that (see analyze_binding())
         #
         if len(node.targets) > 1:
-            self.logger.debug("Assign (chained with %d outputs)" % (len(node.targets)))
+            if self.trace.bindings:
+                self.trace.bindings("Assign (chained with %d outputs)", len(node.targets))
 
         # TODO: support lists, dicts, sets (so that we can recognize calls to their methods)
         # TODO: begin with supporting empty lists, dicts, sets
@@ -1026,15 +1230,14 @@ class CallGraphVisitor(ast.NodeVisitor):
         # qika: 如果是将一个列表整体赋值给一个变量，则将列表中的元素类型作为变量类型
         for targets in node.targets:
             targets = sanitize_exprs(targets)
-            self.logger.debug(
-                "Assign %s %s, %s:%s"
-                % (
+            if self.trace.bindings:
+                self.trace.bindings(
+                    "Assign %s %s, %s:%s",
                     [get_ast_node_name(x) for x in targets],
                     [get_ast_node_name(x) for x in values],
                     self.filename,
                     node.lineno,
                 )
-            )
             self.analyze_binding(targets, values)
 
         pass
@@ -1047,16 +1250,18 @@ class CallGraphVisitor(ast.NodeVisitor):
             value = sanitize_exprs(node.value)
             if len(value) == 0:
                 value = [node.value]
-            self.logger.debug(
-                "AnnAssign %s %s, %s:%s"
-                % (get_ast_node_name(target[0]), get_ast_node_name(value), self.filename, node.lineno)
-            )
+            if self.trace.bindings:
+                self.trace.bindings(
+                    "AnnAssign %s %s, %s:%s",
+                    get_ast_node_name(target[0]), get_ast_node_name(value), self.filename, node.lineno
+                )
             self.analyze_binding(target, value)
 
         else:  # just a type declaration
-            self.logger.debug(
-                "AnnAssign %s <no value>, %s:%s" % (get_ast_node_name(target[0]), self.filename, node.lineno)
-            )
+            if self.trace.bindings:
+                self.trace.bindings(
+                    "AnnAssign %s <no value>, %s:%s", get_ast_node_name(target[0]), self.filename, node.lineno
+                )
             self.last_value = None
             self.visit(target[0])
 
@@ -1070,10 +1275,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                 self.visit(tgt_type)
                 var_type = self.last_type
 
-            self.logger.debug(
-                "AnnAssign %s type %s"
-                % (get_ast_node_name(target[0]), var_type)
-            )
+            if self.trace.bindings:
+                self.trace.bindings("AnnAssign %s type %s", get_ast_node_name(target[0]), var_type)
 
             for tgt in target:
                 self.last_type = var_type
@@ -1084,16 +1287,15 @@ class CallGraphVisitor(ast.NodeVisitor):
         targets = sanitize_exprs(node.target)
         values = sanitize_exprs(node.value)  # values is the same for each set of targets
 
-        self.logger.debug(
-            "AugAssign %s %s %s, %s:%s"
-            % (
+        if self.trace.bindings:
+            self.trace.bindings(
+                "AugAssign %s %s %s, %s:%s",
                 [get_ast_node_name(x) for x in targets],
                 type(node.op),
                 [get_ast_node_name(x) for x in values],
                 self.filename,
                 node.lineno,
             )
-        )
 
         # TODO: maybe no need to handle tuple unpacking in AugAssign? (but simpler to use the same implementation)
         self.analyze_binding(targets, values)
@@ -1106,7 +1308,8 @@ class CallGraphVisitor(ast.NodeVisitor):
     #  in use elsewhere.)
     #
     def visit_For(self, node):
-        self.logger.debug("For-loop, %s:%s" % (self.filename, node.lineno))
+        if self.trace.bindings:
+            self.trace.bindings("For-loop, %s:%s", self.filename, node.lineno)
 
         targets = sanitize_exprs(node.target)
         values = sanitize_exprs(node.iter)
@@ -1118,7 +1321,8 @@ class CallGraphVisitor(ast.NodeVisitor):
             self.visit(stmt)
 
     def visit_Subscript(self, node):
-        self.logger.debug("Subscript, %s:%s" % (self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("Subscript, %s:%s", self.filename, node.lineno)
 
         self.visit(node.slice)
         # 如果列表名为Optional，则将slice的类型作为列表的类型
@@ -1130,7 +1334,8 @@ class CallGraphVisitor(ast.NodeVisitor):
 
     def visit_List(self, node):
         # 此为“[1,2,3]”等形式的无名列表，只需visit其中元素
-        self.logger.debug("List, %s:%s" % (self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("List, %s:%s", self.filename, node.lineno)
         for elt in node.elts:
             self.visit(elt)
 
@@ -1138,19 +1343,23 @@ class CallGraphVisitor(ast.NodeVisitor):
         self.visit_For(node)  # TODO: alias for now; tag async for in output in a future version?
 
     def visit_ListComp(self, node):
-        self.logger.debug("ListComp, %s:%s" % (self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("ListComp, %s:%s", self.filename, node.lineno)
         self.analyze_comprehension(node, "listcomp")
 
     def visit_SetComp(self, node):
-        self.logger.debug("SetComp, %s:%s" % (self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("SetComp, %s:%s", self.filename, node.lineno)
         self.analyze_comprehension(node, "setcomp")
 
     def visit_DictComp(self, node):
-        self.logger.debug("DictComp, %s:%s" % (self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("DictComp, %s:%s", self.filename, node.lineno)
         self.analyze_comprehension(node, "dictcomp", field1="key", field2="value")
 
     def visit_GeneratorExp(self, node):
-        self.logger.debug("GeneratorExp, %s:%s" % (self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("GeneratorExp, %s:%s", self.filename, node.lineno)
         self.analyze_comprehension(node, "genexpr")
 
     def analyze_comprehension(self, node, label, field1="elt", field2=None):
@@ -1204,7 +1413,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                     return sc.defs[attr_name]
             return None
 
-        self.logger.debug("Call %s, %s:%s" % (get_ast_node_name(node.func), self.filename, node.lineno))
+        if self.trace.calls:
+            self.trace.calls("Call %s, %s:%s", get_ast_node_name(node.func), self.filename, node.lineno)
 
         # visit args to detect uses
         for arg in node.args:
@@ -1224,11 +1434,13 @@ class CallGraphVisitor(ast.NodeVisitor):
 
             from_node = self.get_node_of_current_namespace()
             to_node = result_node
-            self.logger.debug("Use from %s to %s (via resolved call to built-ins)" % (from_node, to_node))
+            if self.trace.uses:
+                self.trace.uses("Use from %s to %s (via resolved call to built-ins)", from_node, to_node)
             if self.add_uses_edge(from_node, to_node):
-                self.logger.info(
-                    "New edge added for Use from %s to %s (via resolved call to built-ins)" % (from_node, to_node)
-                )
+                if self.trace.uses:
+                    self.trace.uses(
+                        "New edge added for Use from %s to %s (via resolved call to built-ins)", from_node, to_node
+                    )
 
         else:  # generic function call
             # Visit the function name part last, so that inside a binding form,
@@ -1283,11 +1495,13 @@ class CallGraphVisitor(ast.NodeVisitor):
                 # qika: 这里会导致第三方引入类的构造函数被认为是虚拟节点（未在项目中被定义），连virtual_use边
                 to_node = self.get_node(class_node.get_name(), "__init__", None, flavor=Flavor.METHOD)
                 to_node.set_type(to_node.get_name())
-                self.logger.debug("Use from %s to %s (call creates an instance)" % (from_node, to_node))
+                if self.trace.uses:
+                    self.trace.uses("Use from %s to %s (call creates an instance)", from_node, to_node)
                 if self.add_uses_edge(from_node, to_node):
-                    self.logger.info(
-                        "New edge added for Use from %s to %s (call creates an instance)" % (from_node, to_node)
-                    )
+                    if self.trace.uses:
+                        self.trace.uses(
+                            "New edge added for Use from %s to %s (call creates an instance)", from_node, to_node
+                        )
 
             # qika: 增加对Call的返回类型的猜测，使last_value为返回类型
             # qika TODO: 无法用于猜测super(), 因为super()不需声明,因此self.last_value为None
@@ -1327,14 +1541,17 @@ class CallGraphVisitor(ast.NodeVisitor):
                             call_node.set_type(attr_node.get_type())
                             if attr_node.defined:
                                 if self.add_uses_edge(from_node, attr_node, true_type=False):
-                                    self.logger.info(
-                                        "New edge added for Use from %s to %s (use as a attribute)" % (from_node, attr_node)
-                                    )
+                                    if self.trace.uses:
+                                        self.trace.uses(
+                                            "New edge added for Use from %s to %s (use as a attribute)",
+                                            from_node, attr_node
+                                        )
                             else:
                                 if self.add_uses_edge(from_node, attr_node):
-                                    self.logger.info(
-                                        "New edge added for Use from %s to %s (use as a type)" % (from_node, attr_node)
-                                    )
+                                    if self.trace.uses:
+                                        self.trace.uses(
+                                            "New edge added for Use from %s to %s (use as a type)", from_node, attr_node
+                                        )
 
             # 如果针对函数f()无法获得返回类型
             if call_node.get_type() is None:
@@ -1346,7 +1563,8 @@ class CallGraphVisitor(ast.NodeVisitor):
             self.last_value = call_node
 
     def visit_With(self, node):
-        self.logger.debug("With (context manager), %s:%s" % (self.filename, node.lineno))
+        if self.trace.visits:
+            self.trace.visits("With (context manager), %s:%s", self.filename, node.lineno)
 
         def add_uses_enter_exit_of(graph_node):
             # add uses edges to __enter__ and __exit__ methods of given Node
@@ -1354,7 +1572,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                 from_node = self.get_node_of_current_namespace()
                 withed_obj_node = graph_node
 
-                self.logger.debug("Use from %s to With %s" % (from_node, withed_obj_node))
+                if self.trace.uses:
+                    self.trace.uses("Use from %s to With %s", from_node, withed_obj_node)
                 """ for methodname in ("__enter__", "__exit__"):
                     to_node = self.get_node(withed_obj_node.get_name(), methodname, None, flavor=Flavor.METHOD)
                     to_node.set_type(to_node.get_name())
@@ -1524,7 +1743,8 @@ class CallGraphVisitor(ast.NodeVisitor):
             funcname = func_ast_node.id
             if funcname == "super":
                 class_node = self.get_current_class()
-                self.logger.debug("Resolving super() of %s" % (class_node))
+                if self.trace.calls:
+                    self.trace.calls("Resolving super() of %s", class_node)
                 if class_node in self.mro:
                     # Our super() class is the next one in the MRO.
                     #
@@ -1540,31 +1760,36 @@ class CallGraphVisitor(ast.NodeVisitor):
                     #
                     if len(self.mro[class_node]) > 1:
                         result = self.mro[class_node][1]
-                        self.logger.debug("super of %s is %s" % (class_node, result))
+                        if self.trace.calls:
+                            self.trace.calls("super of %s is %s", class_node, result)
                         return result
                     else:
                         msg = "super called for %s, but no known bases" % (class_node)
-                        self.logger.info(msg)
+                        if self.trace.calls:
+                            self.trace.calls(msg)
                         raise UnresolvedSuperCallError(msg)
                 else:
                     msg = "super called for %s, but MRO not determined for it (maybe still in pass 1?)" % (class_node)
-                    self.logger.info(msg)
+                    if self.trace.calls:
+                        self.trace.calls(msg)
                     raise UnresolvedSuperCallError(msg)
 
             if funcname in ("str", "repr"):
                 if len(ast_node.args) == 1:  # these take only one argument
                     obj_astnode = ast_node.args[0]
                     if isinstance(obj_astnode, (ast.Name, ast.Attribute)):
-                        self.logger.debug("Resolving %s() of %s" % (funcname, get_ast_node_name(obj_astnode)))
+                        if self.trace.calls:
+                            self.trace.calls("Resolving %s() of %s", funcname, get_ast_node_name(obj_astnode))
                         attrname = "__%s__" % (funcname)
                         # build a temporary ast.Attribute AST node so that we can use get_attribute()
                         tmp_astnode = ast.Attribute(value=obj_astnode, attr=attrname, ctx=obj_astnode.ctx)
                         obj_node, attr_node = self.get_attribute(tmp_astnode)
                         attr_node.set_type("str")
-                        self.logger.debug(
-                            "Resolve %s() of %s: returning attr node %s"
-                            % (funcname, get_ast_node_name(obj_astnode), attr_node)
-                        )
+                        if self.trace.calls:
+                            self.trace.calls(
+                                "Resolve %s() of %s: returning attr node %s",
+                                funcname, get_ast_node_name(obj_astnode), attr_node
+                            )
                         return attr_node
 
             # add implementations for other built-in funcnames here if needed
@@ -1581,9 +1806,10 @@ class CallGraphVisitor(ast.NodeVisitor):
         if not isinstance(ast_node, ast.Attribute):
             raise TypeError("Expected ast.Attribute; got %s" % (type(ast_node)))
 
-        self.logger.debug(
-            "Resolve %s.%s in context %s" % (get_ast_node_name(ast_node.value), ast_node.attr, type(ast_node.ctx))
-        )
+        if self.trace.attrs:
+            self.trace.attrs(
+                "Resolve %s.%s in context %s", get_ast_node_name(ast_node.value), ast_node.attr, type(ast_node.ctx)
+            )
 
         # look up attr_name in the given namespace, return Node or None
         def lookup(ns, attr_name):
@@ -1667,7 +1893,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         if obj_node is None:
             qika = 1
 
-        self.logger.debug("Attr %s from %s" % (ast_node.attr, obj_node.get_type()))
+        if self.trace.attrs:
+            self.trace.attrs("Attr %s from %s", ast_node.attr, obj_node.get_type())
 
         # 如果obj_node是func，并且其中恰好定义了和attr同名的变量，则会错误链接到那个变量，因此如果obj_node是func，则直接断开链接并返回
         if obj_node and obj_node.flavor in [Flavor.CLASSMETHOD, Flavor.FUNCTION, Flavor.METHOD, Flavor.PROPERTYMETHOD, Flavor.STATICMETHOD]:
@@ -1679,11 +1906,11 @@ class CallGraphVisitor(ast.NodeVisitor):
         used_node.set_type(used_node.get_name()) if used_node.get_type() is None else None
 
         from_node = self.get_node_of_current_namespace()
-        self.logger.debug("Use from %s to %s (use as a attribute)" % (from_node, used_node))
+        if self.trace.uses:
+            self.trace.uses("Use from %s to %s (use as a attribute)", from_node, used_node)
         if self.add_uses_edge(from_node, used_node, true_type=False):
-            self.logger.info(
-                "New edge added for Use from %s to %s (use as a attribute)" % (from_node, used_node)
-            )
+            if self.trace.uses:
+                self.trace.uses("New edge added for Use from %s to %s (use as a attribute)", from_node, used_node)
         if used_node.get_type() is None:
             attr_node.set_type(used_node.get_name())
         else:
@@ -1697,7 +1924,8 @@ class CallGraphVisitor(ast.NodeVisitor):
             if return_sc.Return is not None:
                 namespace, name = self.split(return_sc.Return)
                 return_node = self.get_node(namespace, name)
-                self.logger.debug("Replace call %s as it return %s" % (attr_node, return_node))
+                if self.trace.attrs:
+                    self.trace.attrs("Replace call %s as it return %s", attr_node, return_node)
                 attr_node.set_value(return_node)
                 attr_node.set_type(return_node.get_type())
 
@@ -1706,8 +1934,8 @@ class CallGraphVisitor(ast.NodeVisitor):
     ###########################################################################
     # Scope analysis
 
-    def analyze_scopes(self, code, filename):
-        """Gather lexical scope information."""
+    def analyze_scopes(self, code, filename, symbols=None, key=None):
+        """Gather lexical scope information (symbols: scope_symbols() of the code, if already known)."""
 
         # Below, ns is the fully qualified ("dotted") name of sc.
         #
@@ -1717,16 +1945,12 @@ class CallGraphVisitor(ast.NodeVisitor):
         # in different scopes, as we should).
         #
         scopes = {}
-
-        def process(parent_ns, table):
-            sc = Scope(table)
-            ns = "%s.%s" % (parent_ns, sc.name) if len(sc.name) else parent_ns
+        if symbols is None:
+            symbols = self.parse_cache.scopes(code, filename, self.module_name, key)
+        for ns, name, type, identifiers in symbols:
+            sc = Scope.from_symbols(name, type, identifiers)
             sc.path = ns
             scopes[ns] = sc
-            for t in table.get_children():
-                process(ns, t)
-
-        process(self.module_name, symtable.symtable(code, filename, compile_type="exec"))
 
         # add to existing scopes (while not overwriting any existing definitions with None)
         for ns in scopes:
@@ -1739,7 +1963,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                     if name not in oldsc.defs:
                         oldsc.defs[name] = sc.defs[name]
 
-        self.logger.debug("Scopes now: %s" % (self.scopes))
+        if self.trace.scopes:
+            self.trace.scopes("Scopes now: %s", self.scopes)
 
     def get_current_class(self):
         """Return the node representing the current class, or None if not inside a class definition."""
@@ -1778,16 +2003,19 @@ class CallGraphVisitor(ast.NodeVisitor):
         if sc is not None:
             name_node = sc.defs[name]
             if isinstance(name_node, Node):
-                self.logger.info("Get %s in %s, found in %s, type %s" % (name, self.scope_stack[-1], sc, name_node.get_type()))
+                if self.trace.scopes:
+                    self.trace.scopes(
+                        "Get %s in %s, found in %s, type %s", name, self.scope_stack[-1], sc, name_node.get_type()
+                    )
                 return name_node, sc.path
             else:
                 # TODO: should always be a Node or None
-                self.logger.debug(
-                    "Get %s in %s, found in %s: not define" % (name, self.scope_stack[-1], sc)
-                )
+                if self.trace.scopes:
+                    self.trace.scopes("Get %s in %s, found in %s: not define", name, self.scope_stack[-1], sc)
                 return None, sc.path
         else:
-            self.logger.debug("Get %s in %s: no Node value (or name not in scope)" % (name, self.scope_stack[-1]))
+            if self.trace.scopes:
+                self.trace.scopes("Get %s in %s: no Node value (or name not in scope)", name, self.scope_stack[-1])
         return None, None
 
     def set_value(self, name, new_value=None, new_type=None, defined=True, node=None):
@@ -1807,20 +2035,24 @@ class CallGraphVisitor(ast.NodeVisitor):
             if isinstance(new_value, Node):
                 sc.defs[name].set_type(new_value.get_type())
                 sc.defs[name].set_value(new_value)
-                self.logger.info("Set %s in %s to %s" % (name, sc, new_value.get_type()))
+                if self.trace.scopes:
+                    self.trace.scopes("Set %s in %s to %s", name, sc, new_value.get_type())
             elif new_type is not None:
                 sc.defs[name].set_type(new_type)
                 old_value = sc.defs[name].get_value()
                 if isinstance(old_value, Node) and old_value.get_type() != new_type:
                     sc.defs[name].set_value(None)
 
-                self.logger.debug("Set %s in %s to %s:%s" % (name, sc, sc.defs[name], new_type))
+                if self.trace.scopes:
+                    self.trace.scopes("Set %s in %s to %s:%s", name, sc, sc.defs[name], new_type)
             else:
                 # TODO: should always be a Node or None
-                self.logger.debug("Set %s in %s false: type is None" % (name, sc))
+                if self.trace.scopes:
+                    self.trace.scopes("Set %s in %s false: type is None", name, sc)
 
         else:
-            self.logger.debug("Set: name %s not in scope" % (name))
+            if self.trace.scopes:
+                self.trace.scopes("Set: name %s not in scope", name)
 
     # get_attribute
     # Attribute getter and setter
@@ -1889,7 +2121,8 @@ class CallGraphVisitor(ast.NodeVisitor):
 
                         sc.defs[attr_name].set_value(attr_node.get_value())
                         sc.defs[attr_name].set_type(new_type)
-                        self.logger.info("Set %s in %s to %s:%s" % (attr_name, sc, new_value, new_type))
+                        if self.trace.attrs:
+                            self.trace.attrs("Set %s in %s to %s:%s", attr_name, sc, new_value, new_type)
                         return True
                     if new_type is not None:
                         new_value_ns, new_value_name = self.split(new_type)
@@ -1900,12 +2133,15 @@ class CallGraphVisitor(ast.NodeVisitor):
                         sc.defs[attr_name].defined = True
 
                         sc.defs[attr_name].set_type(new_type)
-                        self.logger.info("Set %s in %s to Unknown:%s" % (attr_name, sc, new_type))
+                        if self.trace.attrs:
+                            self.trace.attrs("Set %s in %s to Unknown:%s", attr_name, sc, new_type)
                     else:
                         # TODO: should always be a Node or None
-                        self.logger.debug("Set %s in %s false: type is None" % (attr_name, sc))
+                        if self.trace.attrs:
+                            self.trace.attrs("Set %s in %s false: type is None", attr_name, sc)
                 else:
-                    self.logger.debug("Set: namespace %s not in scope" % (ns))
+                    if self.trace.attrs:
+                        self.trace.attrs("Set: namespace %s not in scope", ns)
         return False
 
     ###########################################################################
@@ -1938,14 +2174,13 @@ class CallGraphVisitor(ast.NodeVisitor):
         if name == None:
             return None
 
-        if name in self.nodes:
-            for n in self.nodes[name]:
-                if n.namespace == namespace:
-                    if Flavor.specificity(flavor) > Flavor.specificity(n.flavor):
-                        n.flavor = flavor
-                    if n.ast_node is None and ast_node is not None:
-                        n.ast_node = ast_node
-                    return n
+        n = self.node_index.get((namespace, name))
+        if n is not None:
+            if Flavor.specificity(flavor) > Flavor.specificity(n.flavor):
+                n.flavor = flavor
+            if n.ast_node is None and ast_node is not None:
+                n.ast_node = ast_node
+            return n
 
         # Try to figure out which source file this Node belongs to
         # (for annotated output).
@@ -1972,6 +2207,7 @@ class CallGraphVisitor(ast.NodeVisitor):
             self.nodes[name].append(n)
         else:
             self.nodes[name] = [n]
+        self.node_index.setdefault((namespace, name), n)
 
         return n
 
@@ -1990,11 +2226,24 @@ class CallGraphVisitor(ast.NodeVisitor):
         """Return the unique node matching the namespace and name.
         Return None if not found.
         """
-        if name in self.nodes:
-            for n in self.nodes[name]:
-                if n.namespace == namespace:
-                    return n
-        return None
+        return self.node_index.get((namespace, name))
+
+    def reindex_nodes(self):
+        """Rebuild node_index after self.nodes was replaced."""
+        self.node_index = {}
+        for name, nodes in self.nodes.items():
+            for n in nodes:
+                self.node_index.setdefault((n.namespace, name), n)
+
+    def set_node_namespace(self, n, namespace):
+        """Move a Node to another namespace, keeping node_index in sync with self.nodes."""
+        old_namespace, n.namespace = n.namespace, namespace
+        for ns in (old_namespace, namespace):
+            self.node_index.pop((ns, n.name), None)
+            for m in self.nodes.get(n.name, ()):
+                if m.namespace == ns:
+                    self.node_index[(ns, n.name)] = m
+                    break
 
     def find_scope_def_node(self, namespace, name):
         """Return the def value of name in scope namespce
@@ -2024,6 +2273,7 @@ class CallGraphVisitor(ast.NodeVisitor):
             self.nodes[name].append(n)
         else:
             self.nodes[name] = [n]
+        self.node_index.setdefault((namespace, name), n)
 
         return n
 
@@ -2083,9 +2333,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         from_scope = self.scopes[from_node.get_name()] if from_node.get_name() in self.scopes else None
         if from_scope is not None and to_node.name in from_scope.defs and from_scope.defs[to_node.name] is not None:
             if from_scope.defs[to_node.name].get_name() == to_node.get_name():
-                self.logger.debug(
-                    "%s is defined by %s, so skip" % (to_node, from_node)
-                )
+                if self.trace.uses:
+                    self.trace.uses("%s is defined by %s, so skip", to_node, from_node)
                 return False
 
         from_node_name = from_node.get_name()
@@ -2130,9 +2379,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                 if to_node in self.uses_edges[from_node_name]:
                     return False
                 self.uses_edges[from_node_name].add(to_node)
-                self.logger.debug(
-                    "Added Use-Edge from %s to %s" % (from_node, to_node)
-                )
+                if self.trace.uses:
+                    self.trace.uses("Added Use-Edge from %s to %s", from_node, to_node)
 
             # 当to_node_type_path和to_node_path不一致时，to_node为虚拟节点
             elif self.pas_time > 0 and not add_flag:
@@ -2140,7 +2388,7 @@ class CallGraphVisitor(ast.NodeVisitor):
                 if from_node_name not in self.virtual_uses_edges:
                     self.virtual_uses_edges[from_node_name] = {}
                 if to_node.namespace is None or (len(to_node.namespace) and '*' == to_node.namespace[0]) or '^^^argument^^^' in to_node.get_name():
-                    to_node.namespace = 'UNKNOWN'
+                    self.set_node_namespace(to_node, 'UNKNOWN')
                 if to_node in self.virtual_uses_edges[from_node_name]:
                     return False
                 to_name = to_node.name
@@ -2169,9 +2417,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                         if n.defined:
                             self.virtual_uses_edges[from_node_name][to_node.get_name()].add(n)
 
-                self.logger.debug(
-                    "Added Virtual-Use-Edge from %s to %s" % (from_node, to_node)
-                )
+                if self.trace.uses:
+                    self.trace.uses("Added Virtual-Use-Edge from %s to %s", from_node, to_node)
             else:
                 return False
         # true type为False时，表示use了某一个具体实例，如外部自定义的变量a
@@ -2190,16 +2437,15 @@ class CallGraphVisitor(ast.NodeVisitor):
                 if to_node in self.uses_edges[from_node_name]:
                     return False
                 self.uses_edges[from_node_name].add(to_node)
-                self.logger.debug(
-                    "Added Use-Edge from %s to %s" % (from_node_name, to_node)
-                )
+                if self.trace.uses:
+                    self.trace.uses("Added Use-Edge from %s to %s", from_node_name, to_node)
             # 当to_node_type_path和to_node_path不一致时，to_node为虚拟节点
             elif self.pas_time > 0:
                 # 当已经解析过一遍完整项目之后，进入虚拟uses_edge添加逻辑
                 if from_node_name not in self.virtual_uses_edges:
                     self.virtual_uses_edges[from_node_name] = {}
                 if to_node.namespace is None or (len(to_node.namespace) and '*' == to_node.namespace[0]) or '^^^argument^^^' in to_node.get_name():
-                    to_node.namespace = 'UNKNOWN'
+                    self.set_node_namespace(to_node, 'UNKNOWN')
                 if to_node in self.virtual_uses_edges[from_node_name]:
                     return False
                 to_name = to_node.name
@@ -2229,9 +2475,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                         if n.defined:
                             self.virtual_uses_edges[from_node_name][to_node.get_name()].add(n)
 
-                self.logger.debug(
-                    "Added Virtual-Use-Edge from %s to %s" % (from_node, to_node)
-                )
+                if self.trace.uses:
+                    self.trace.uses("Added Virtual-Use-Edge from %s to %s", from_node, to_node)
             else:
                 return False
 
@@ -2306,7 +2551,10 @@ class CallGraphVisitor(ast.NodeVisitor):
         assert len(matching_wilds) < 2  # the set can have only one wild of matching name
         if len(matching_wilds):
             wild_node = matching_wilds[0]
-            self.logger.info("Use from %s to %s resolves %s; removing wildcard" % (from_node, to_node, wild_node))
+            if self.trace.postprocess:
+                self.trace.postprocess(
+                    "Use from %s to %s resolves %s; removing wildcard", from_node, to_node, wild_node
+                )
             self.remove_uses_edge(from_node, wild_node)
 
     ###########################################################################
@@ -2324,7 +2572,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                     n3.defined = False
                     new_uses_edges.append((n, n3))
                     removed_uses_edges.append((n, n2))
-                    self.logger.info("Contracting non-existent from %s to %s as %s" % (n, n2, n3))
+                    if self.trace.postprocess:
+                        self.trace.postprocess("Contracting non-existent from %s to %s as %s", n, n2, n3)
 
         for from_node, to_node in new_uses_edges:
             self.add_uses_edge(from_node, to_node)
@@ -2347,7 +2596,8 @@ class CallGraphVisitor(ast.NodeVisitor):
 
         for from_node, to_node in new_defines_edges:
             self.add_defines_edge(from_node, to_node)
-            self.logger.info("Expanding unknowns: new defines edge from %s to %s" % (from_node, to_node))
+            if self.trace.postprocess:
+                self.trace.postprocess("Expanding unknowns: new defines edge from %s to %s", from_node, to_node)
 
         new_uses_edges = []
         for n in self.uses_edges:
@@ -2359,7 +2609,8 @@ class CallGraphVisitor(ast.NodeVisitor):
 
         for from_node, to_node in new_uses_edges:
             self.add_uses_edge(from_node, to_node)
-            self.logger.info("Expanding unknowns: new uses edge from %s to %s" % (from_node, to_node))
+            if self.trace.postprocess:
+                self.trace.postprocess("Expanding unknowns: new uses edge from %s to %s", from_node, to_node)
 
         for name in self.nodes:
             for n in self.nodes[name]:
@@ -2392,31 +2643,37 @@ class CallGraphVisitor(ast.NodeVisitor):
 
                 if inherited and n in self.uses_edges:
                     removed_uses_edges.append((n, n2))
-                    self.logger.info("Removing inherited edge from %s to %s" % (n, n2))
+                    if self.trace.postprocess:
+                        self.trace.postprocess("Removing inherited edge from %s to %s", n, n2)
 
         for from_node, to_node in removed_uses_edges:
             self.remove_uses_edge(from_node, to_node)
 
-    def collapse_inner(self):
+    def collapse_inner(self, namespaces=None):
         """Combine lambda and comprehension Nodes with their parent Nodes to reduce visual noise.
-        Also mark those original nodes as undefined, so that they won't be visualized."""
+        Also mark those original nodes as undefined, so that they won't be visualized.
+
+        With namespaces, only the Nodes inside them are collapsed."""
 
         # Lambdas and comprehensions do not define any names in the enclosing
         # scope, so we only need to treat the uses edges.
 
         # BUG: resolve relative imports causes (RuntimeError: dictionary changed size during iteration)
         # temporary solution is adding list to force a copy of 'self.nodes'
-        for name in list(self.nodes):
-            if name in ("lambda", "listcomp", "setcomp", "dictcomp", "genexpr"):
+        for name in ("lambda", "listcomp", "setcomp", "dictcomp", "genexpr"):
+            if name in self.nodes:
                 if name in ["listcomp"]:
                     qika = 1
                 for n in self.nodes[name]:
+                    if namespaces is not None and not (n.namespace is not None and self.in_namespaces(n.namespace, namespaces)):
+                        continue
                     pn = self.get_parent_node(n)
                     if n.get_name() in self.uses_edges:
                         if n.get_name() == "asciimatics.effects.Matrix.reset.listcomp":
                             qika = 1
                         for n2 in self.uses_edges[n.get_name()]:  # outgoing uses edges
-                            self.logger.info("Collapsing inner from %s to %s, uses %s" % (n, pn, n2))
+                            if self.trace.postprocess:
+                                self.trace.postprocess("Collapsing inner from %s to %s, uses %s", n, pn, n2)
                             if n2.defined:
                                 self.add_uses_edge(pn, n2, true_type=False)
                             else:
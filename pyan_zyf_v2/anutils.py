@@ -3,7 +3,11 @@
 """Utilities for analyzer."""
 
 import ast
+import hashlib
 import os.path
+import pickle
+import symtable
+import sys
 
 from .node import Flavor
 
@@ -53,6 +57,90 @@ def get_module_name(filename, root: str = None):
     return mod_name
 
 
+def scope_symbols(code, filename, module_name):
+    """Lexical scopes of a source file, outermost first, as (fully qualified name, name, type, identifiers).
+
+    Plain data, so that it can be computed in another process (see CallGraphVisitor.process()).
+    """
+    scopes = []
+
+    def process(parent_ns, table):
+        name = table.get_name()
+        if name == "top":
+            name = ""  # Pyan defines the top level as anonymous
+        ns = "%s.%s" % (parent_ns, name) if len(name) else parent_ns
+        scopes.append((ns, name, table.get_type(), tuple(table.get_identifiers())))
+        for t in table.get_children():
+            process(ns, t)
+
+    process(module_name, symtable.symtable(code, filename, compile_type="exec"))
+    return scopes
+
+
+class ParseCache:
+    """Parsed modules and scope_symbols() of source files, keyed by content hash and Python version.
+
+    Trees are only kept in memory, for the second pass over the same files: unpickling
+    a tree takes longer than parsing its source again. Scopes are also stored under
+    cache_dir (if given), one file per content, so that unchanged files never go
+    through symtable again when a project is analyzed anew.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.trees = {}  # key: ast.Module
+        self.symbols = {}  # key: scope_symbols() relative to the module
+
+    def __getstate__(self):
+        return {"cache_dir": self.cache_dir, "trees": {}, "symbols": {}}  # memory is for one analysis only
+
+    @staticmethod
+    def key(content):
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, sys.implementation.cache_tag, key + ".pkl")
+
+    def parse(self, content, filename, key=None):
+        key = key or self.key(content)
+        tree = self.trees.get(key)
+        if tree is None:
+            tree = self.trees[key] = ast.parse(content, filename)
+        return tree
+
+    def scopes(self, content, filename, module_name, key=None):
+        """scope_symbols() of content as the module module_name."""
+        key = key or self.key(content)
+        symbols = self.symbols.get(key)
+        if symbols is None and self.cache_dir is not None:
+            try:
+                with open(self.path(key), "rb") as f:
+                    symbols = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+        if symbols is None:
+            symbols = scope_symbols(content, filename, "")
+            if self.cache_dir is not None:
+                self.store(key, symbols)
+        self.symbols[key] = symbols
+        return [(module_name + ns, name, type, identifiers) for ns, name, type, identifiers in symbols]
+
+    def store(self, key, symbols):
+        path = self.path(key)
+        tmp_path = path + ".tmp%d" % os.getpid()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                pickle.dump(symbols, f)
+            os.replace(tmp_path, path)  # concurrent analyses may write the same entry
+        except OSError:
+            pass  # an unwritable cache_dir is only read from
+
+    def clear(self):
+        self.trees.clear()
+        self.symbols.clear()
+
+
 def format_alias(x):
     """Return human-readable description of an ast.alias (used in Import and ImportFrom nodes)."""
     if not isinstance(x, ast.alias):
@@ -91,11 +179,12 @@ def sanitize_exprs(exprs):
         return process(exprs)
 
 
-def resolve_method_resolution_order(class_base_nodes, logger):
+def resolve_method_resolution_order(class_base_nodes, trace):
     """Compute the method resolution order (MRO) for each of the analyzed classes.
 
     class_base_nodes: dict cls: [base1, base2, ..., baseN]
                       where dict and basej are all Node objects.
+    trace: the Tracer of the analyzer (see trace.py)
     """
 
     # https://en.wikipedia.org/wiki/C3_linearization#Description
@@ -126,14 +215,17 @@ def resolve_method_resolution_order(class_base_nodes, logger):
     def C3_merge(lists):
         out = []
         while True:
-            logger.debug("MRO: C3 merge: out: %s, lists: %s" % (out, lists))
+            if trace.mro:
+                trace.mro("MRO: C3 merge: out: %s, lists: %s", out, lists)
             heads = [head(lst) for lst in lists if head(lst) is not None]
             if not len(heads):
                 break
             tails = [tail(lst) for lst in lists]
-            logger.debug("MRO: C3 merge: heads: %s, tails: %s" % (heads, tails))
+            if trace.mro:
+                trace.mro("MRO: C3 merge: heads: %s, tails: %s", heads, tails)
             hd = C3_find_good_head(heads, tails)
-            logger.debug("MRO: C3 merge: chose head %s" % (hd))
+            if trace.mro:
+                trace.mro("MRO: C3 merge: chose head %s", hd)
             out.append(hd)
             lists = remove_all_in(hd, lists)
         return out
@@ -143,7 +235,8 @@ def resolve_method_resolution_order(class_base_nodes, logger):
         memo = {}  # caching/memoization
 
         def C3_linearize(node):
-            logger.debug("MRO: C3 linearizing %s" % (node))
+            if trace.mro:
+                trace.mro("MRO: C3 linearizing %s", node)
             seen.add(node)
             if node not in memo:
                 #  unknown class                     or no ancestors
@@ -156,19 +249,23 @@ def resolve_method_resolution_order(class_base_nodes, logger):
                         if baseclass_node not in seen:
                             lists.append(C3_linearize(baseclass_node))
                     # ...and the parents themselves (in the order they appear in the ClassDef)
-                    logger.debug("MRO: parents of %s: %s" % (node, class_base_nodes[node]))
+                    if trace.mro:
+                        trace.mro("MRO: parents of %s: %s", node, class_base_nodes[node])
                     lists.append(class_base_nodes[node])
-                    logger.debug("MRO: C3 merging %s" % (lists))
+                    if trace.mro:
+                        trace.mro("MRO: C3 merging %s", lists)
                     memo[node] = [node] + C3_merge(lists)
-            logger.debug("MRO: C3 linearized %s, result %s" % (node, memo[node]))
+            if trace.mro:
+                trace.mro("MRO: C3 linearized %s, result %s", node, memo[node])
             return memo[node]
 
         for node in class_base_nodes:
-            logger.debug("MRO: analyzing class %s" % (node))
+            if trace.mro:
+                trace.mro("MRO: analyzing class %s", node)
             seen = set()  # break cycles (separately for each class we start from)
             mro[node] = C3_linearize(node)
     except LinearizationImpossible as e:
-        logger.error(e)
+        trace.logger.error(e)
 
         # generic fallback: depth-first search of lists of ancestors
         #
@@ -191,7 +288,8 @@ def resolve_method_resolution_order(class_base_nodes, logger):
 
         mro = {}
         for node in class_base_nodes:
-            logger.debug("MRO: generic fallback: analyzing class %s" % (node))
+            if trace.mro:
+                trace.mro("MRO: generic fallback: analyzing class %s", node)
             seen = set()  # break cycles (separately for each class we start from)
             mro[node] = lookup_bases_recursive(node)
 
@@ -226,6 +324,15 @@ class Scope:
             self.Return = None
             self.path = "None"
 
+    @classmethod
+    def from_symbols(cls, name, type, identifiers):
+        """A Scope from an entry of scope_symbols()."""
+        sc = cls()
+        sc.name = name
+        sc.type = type
+        sc.defs = {iden: None for iden in identifiers}
+        return sc
+
     def set_Return(self, value):
         """qika: set the Return value of the scope"""
         self.Return = value
@@ -277,7 +384,8 @@ class ExecuteInInnerScope:
                 lambda_scope = Scope()
                 lambda_scope.reset(scopename, "lambda")
                 analyzer.scopes[inner_ns] = lambda_scope
-                analyzer.logger.info("Get a lambda in '%s'" % (inner_ns))
+                if analyzer.trace.scopes:
+                    analyzer.trace.scopes("Get a lambda in '%s'", inner_ns)
             else:
                 raise ValueError("Unknown scope '%s'" % (inner_ns))
         analyzer.scope_stack.append(analyzer.scopes[inner_ns])
@@ -306,5 +414,6 @@ class ExecuteInInnerScope:
         ns = from_node.get_name()
         to_node = analyzer.get_node(ns, scopename, None, flavor=Flavor.NAMESPACE)
         if analyzer.add_defines_edge(from_node, to_node):
-            analyzer.logger.info("Def from %s to %s %s" % (from_node, scopename, to_node))
+            if analyzer.trace.defs:
+                analyzer.trace.defs("Def from %s to %s %s", from_node, scopename, to_node)
         analyzer.last_value = to_node  # Make this inner scope node assignable to track its uses.
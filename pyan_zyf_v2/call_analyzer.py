@@ -27,6 +27,73 @@ def get_file_name(path, object_path):
     return file_path
         
 
+def classify_uses(caller, callees):
+    """
+    将caller调用的节点callees按 In-Class，In-File，In-Object 三个层级分组
+    """
+    caller_name = caller.get_name()
+    caller_file = caller.filename
+    caller_type = caller.flavor.value
+    uses = {"in_class": [], "in_file": [], "in_object": []}
+
+    if caller_type in ["method","staticmethod","classmethod","propertymethod"]:
+        caller_class = caller.namespace.split(".")[-1]
+    elif caller_type == "function":
+        caller_class = None
+    elif caller_type == "class":
+        caller_class = caller.name
+    elif caller_type == "module":
+        caller_class = None
+    else:
+        caller_class = caller.namespace.split(".")[-1]
+        #raise Exception("Unknown caller type: %s" % caller_type)
+
+    for n2 in callees:
+        if n2.namespace is not None and n2.namespace != "*":
+            callee_file = n2.filename
+            callee_type = n2.flavor.value
+            if callee_type in ["method","staticmethod","classmethod","propertymethod","attribute"]:
+                callee_class = n2.namespace.split(".")[-1]
+            elif callee_type == "function":
+                callee_class = None
+            elif callee_type == "class":
+                callee_class = n2.name
+            elif callee_type == "module":
+                callee_class = None
+            else:
+                callee_class = n2.namespace.split(".")[-1]
+                # raise Exception("Unknown callee type: %s" % callee_type)
+
+            if callee_file == caller_file and caller_name in n2.namespace:
+                pass
+            elif callee_class == caller_class and callee_class is not None:
+                uses["in_class"].append(n2)
+            elif callee_file == caller_file:
+                uses["in_file"].append(n2)
+            else:
+                uses["in_object"].append(n2)
+    return uses
+
+
+def dependencies_of(visitor, namespace):
+    """
+    直接返回namespace（形如 "A.B.C.func"）对应函数的调用信息，不经过 from_visitor 和 FolderMaker 的全量分析与落盘
+    返回 {"in_class": [...], "in_file": [...], "in_object": [...]}，每组为按名称排序的节点全名；namespace未被定义时返回None
+    """
+    if namespace not in visitor.uses_edges:
+        return None
+    caller = None
+    for node in visitor.nodes.get(namespace.rsplit(".", 1)[-1], []):
+        # same choice as from_visitor: the last defined node of that name
+        if node.defined and node.namespace is not None and node.get_name() == namespace:
+            caller = node
+    if caller is None:
+        return None
+    uses = classify_uses(caller, visitor.uses_edges[namespace])
+    return {level: sorted(n.namespace + '.' + n.name if n.namespace else n.name for n in nodes)
+            for level, nodes in uses.items()}
+
+
 class CallAnalyzer(object):
     def __init__(self, nodes=None, define_edges=None, used_edges=None, virtual_used_edges=None, import_used_edges=None):
         self.nodes = nodes or []
@@ -65,51 +132,7 @@ class CallAnalyzer(object):
             if n == 'asyncssh.sftp.SFTPClientHandler.statvfs':
                 qika = 1
             if user_node and user_node.defined and user_node.namespace is not None:
-                caller_file = user_node.filename
-                caller_type = user_node.flavor.value
-                caller_flag = False
-                used_edges[user_node] = {"in_class": [], "in_file": [], "in_object": []}
-                
-                if caller_type in ["method","staticmethod","classmethod","propertymethod"]:
-                    caller_class = user_node.namespace.split(".")[-1]
-                elif caller_type == "function":
-                    caller_class = None
-                elif caller_type == "class":
-                    caller_class = user_node.name
-                elif caller_type == "module":
-                    caller_class = None
-                else:
-                    caller_class = user_node.namespace.split(".")[-1]
-                    #raise Exception("Unknown caller type: %s" % caller_type)
-                    
-                for n2 in visitor.uses_edges[n]:
-                    if n2.namespace is not None and n2.namespace != "*":
-                        caller_flag = True
-                        callee_file = n2.filename
-                        callee_type = n2.flavor.value
-                        if callee_type in ["method","staticmethod","classmethod","propertymethod","attribute"]:
-                            callee_class = n2.namespace.split(".")[-1]
-                        elif callee_type == "function":
-                            callee_class = None
-                        elif callee_type == "class":
-                            callee_class = n2.name
-                        elif callee_type == "module":
-                            callee_class = None
-                        else:
-                            callee_class = n2.namespace.split(".")[-1]
-                            # raise Exception("Unknown callee type: %s" % callee_type)
-                        
-                        if callee_file == caller_file and n in n2.namespace:
-                            pass
-                        elif callee_class == caller_class and callee_class is not None:
-                            used_edges[user_node]["in_class"].append(n2)
-                        elif callee_file == caller_file:
-                            if len(callee_file.split('.')) > 2:
-                                qika = 1
-                            used_edges[user_node]["in_file"].append(n2)
-                        else:
-                            used_edges[user_node]["in_object"].append(n2)
-                            
+                used_edges[user_node] = classify_uses(user_node, visitor.uses_edges[n])
                 
                 """if not caller_flag:
                     used_edges.pop(n)"""
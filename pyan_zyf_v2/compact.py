@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compact, memory-mapped call graphs.
+
+`analyzer_result.pkl` pickles the whole CallGraphVisitor (AST nodes, scopes,
+analysis state), which takes seconds to load. Reading dependencies off an
+analyzed project only needs the nodes and edges, so `CompactCallGraph` keeps
+just those:
+
+    strings   every name and filename once, sorted, as one UTF-8 blob + offsets
+    nodes     per node: ids of its full name, namespace, short name, filename,
+              and its flavor and defined flag
+    edges     uses, defines and virtual uses edges in CSR form, keyed by the
+              string id of the source name
+
+All arrays are written 64-byte aligned into one file and loaded with numpy
+views over an mmap of it, so loading costs a few page faults, whatever the
+size of the project. Strings are decoded lazily.
+
+The graph is read-only and cannot re-analyze a patched file; that still needs
+the pickled visitor (see CallGraphVisitor.replace_file).
+
+Convert the pickles of a dependency data root with
+    python -m pyan_zyf_v2.compact Dependency_Data
+"""
+
+import glob
+import json
+import mmap
+import os
+import tempfile
+from argparse import ArgumentParser
+
+import numpy as np
+
+from .call_analyzer import classify_uses
+from .node import Flavor
+
+MAGIC = b"PYANCG1\n"
+ALIGN = 64
+COMPACT_NAME = "analyzer_result.cg"  # written next to analyzer_result.pkl
+FLAVORS = list(Flavor)
+
+
+class StringTable:
+    """Sorted strings in one blob; lookups by binary search, no dict built at load."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+        return None if i < 0 else self.raw(i).decode("utf-8")
+
+    def find(self, s):
+        """Id of s, or -1."""
+        target = s.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self.raw(lo) == target else -1
+
+
+class CompactNode:
+    """Read-only view of one node, with the attributes of node.Node that classify_uses needs."""
+
+    __slots__ = ("graph", "index")
+
+    def __init__(self, graph, index):
+        self.graph = graph
+        self.index = index
+
+    @property
+    def namespace(self):
+        return self.graph.strings[int(self.graph.arrays["node_namespace"][self.index])]
+
+    @property
+    def name(self):
+        return self.graph.strings[int(self.graph.arrays["node_short"][self.index])]
+
+    @property
+    def filename(self):
+        return self.graph.strings[int(self.graph.arrays["node_file"][self.index])]
+
+    @property
+    def flavor(self):
+        return FLAVORS[self.graph.arrays["node_flavor"][self.index]]
+
+    @property
+    def defined(self):
+        return bool(self.graph.arrays["node_defined"][self.index])
+
+    def get_name(self):
+        return self.graph.strings[int(self.graph.arrays["node_name"][self.index])]
+
+    def __repr__(self):
+        return "<CompactNode %s:%s>" % (repr(self.flavor), self.get_name())
+
+
+class CompactCallGraph:
+    """Nodes and edges of an analyzed project, see the module docstring."""
+
+    def __init__(self, meta, arrays, buffer=None):
+        self.meta = meta
+        self.arrays = arrays
+        self.buffer = buffer  # the mmap the arrays are views of, if loaded from a file
+        self.strings = StringTable(arrays["string_blob"], arrays["string_offsets"])
+        self.root = meta["root"]
+        self._filenames = None
+
+    @property
+    def filenames(self):
+        if self._filenames is None:
+            self._filenames = [self.strings[int(i)] for i in self.arrays["filenames"]]
+        return self._filenames
+
+    ###########################################################################
+    # Conversion
+
+    @classmethod
+    def from_visitor(cls, visitor):
+        node_index = {}  # id(Node): index
+        nodes = []
+
+        def add_node(node):
+            if id(node) not in node_index:
+                node_index[id(node)] = len(nodes)
+                nodes.append(node)
+            return node_index[id(node)]
+
+        # the caller of a uses edge is chosen like CallAnalyzer.from_visitor does:
+        # the last defined node of that full name
+        callers = {}
+        for name in visitor.nodes:
+            for node in visitor.nodes[name]:
+                if node.defined and node.namespace is not None:
+                    callers[node.get_name()] = node
+
+        uses = {name: [add_node(n) for n in targets] for name, targets in visitor.uses_edges.items()}
+        uses_caller = {name: add_node(callers[name]) if name in callers else -1 for name in uses}
+        defines = {name: [add_node(n) for n in targets] for name, targets in visitor.defines_edges.items()}
+        definitions = {}  # full name: first node defined under it, like impact.reachable looks it up
+        for targets in visitor.defines_edges.values():
+            for n in targets:
+                definitions.setdefault(n.get_name(), add_node(n))
+        virtual = {name: {to_name: [add_node(n) for n in candidates] for to_name, candidates in entries.items()}
+                   for name, entries in visitor.virtual_uses_edges.items()}
+
+        strings = set(visitor.filenames) | set(uses) | set(defines) | set(definitions) | set(virtual)
+        for entries in virtual.values():
+            strings.update(entries)
+        for node in nodes:
+            strings.add(node.get_name())
+            strings.add(node.name)
+            if node.namespace is not None:
+                strings.add(node.namespace)
+            if node.filename is not None:
+                strings.add(node.filename)
+        strings = sorted(strings, key=lambda s: s.encode("utf-8"))
+        string_id = {s: i for i, s in enumerate(strings)}
+        encoded = [s.encode("utf-8") for s in strings]
+
+        def sid(s):
+            return -1 if s is None else string_id[s]
+
+        def csr(keys, rows):
+            indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(rows[k]) for k in keys])
+            indices = [i for k in keys for i in rows[k]]
+            return indptr, np.array(indices, dtype=np.int32)
+
+        arrays = {
+            "string_blob": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "string_offsets": np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.int64),
+            "filenames": np.array([sid(f) for f in visitor.filenames], dtype=np.int32),
+            "node_name": np.array([sid(n.get_name()) for n in nodes], dtype=np.int32),
+            "node_namespace": np.array([sid(n.namespace) for n in nodes], dtype=np.int32),
+            "node_short": np.array([sid(n.name) for n in nodes], dtype=np.int32),
+            "node_file": np.array([sid(n.filename) for n in nodes], dtype=np.int32),
+            "node_flavor": np.array([FLAVORS.index(n.flavor) for n in nodes], dtype=np.int8),
+            "node_defined": np.array([bool(n.defined) for n in nodes], dtype=np.uint8),
+        }
+
+        keys = sorted(uses, key=sid)
+        arrays["uses_keys"] = np.array([sid(k) for k in keys], dtype=np.int32)
+        arrays["uses_caller"] = np.array([uses_caller[k] for k in keys], dtype=np.int32)
+        arrays["uses_indptr"], arrays["uses_indices"] = csr(keys, uses)
+
+        keys = sorted(defines, key=sid)
+        arrays["defines_keys"] = np.array([sid(k) for k in keys], dtype=np.int32)
+        arrays["defines_indptr"], arrays["defines_indices"] = csr(keys, defines)
+
+        keys = sorted(definitions, key=sid)
+        arrays["definition_keys"] = np.array([sid(k) for k in keys], dtype=np.int32)
+        arrays["definition_nodes"] = np.array([definitions[k] for k in keys], dtype=np.int32)
+
+        keys = sorted(virtual, key=sid)
+        arrays["virtual_keys"] = np.array([sid(k) for k in keys], dtype=np.int32)
+        entries = {k: sorted(virtual[k], key=sid) for k in keys}
+        arrays["virtual_indptr"] = np.zeros(len(keys) + 1, dtype=np.int64)
+        arrays["virtual_indptr"][1:] = np.cumsum([len(entries[k]) for k in keys])
+        flat = [(k, to_name) for k in keys for to_name in entries[k]]
+        arrays["virtual_to"] = np.array([sid(to_name) for _, to_name in flat], dtype=np.int32)
+        arrays["virtual_candidate_indptr"], arrays["virtual_candidate_indices"] = csr(
+            range(len(flat)), [virtual[k][to_name] for k, to_name in flat])
+
+        return cls({"root": visitor.root}, arrays)
+
+    def dump(self, path):
+        """Write the graph to path atomically."""
+        specs = []
+        offset = 0
+        for name, array in self.arrays.items():
+            specs.append({"name": name, "dtype": array.dtype.str, "shape": list(array.shape), "offset": offset})
+            offset += -(-array.nbytes // ALIGN) * ALIGN
+        header = json.dumps({"root": self.meta["root"], "arrays": specs}).encode("utf-8")
+        start = -(-(len(MAGIC) + 8 + len(header)) // ALIGN) * ALIGN
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".cg_", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+                for spec, array in zip(specs, self.arrays.values()):
+                    f.seek(start + spec["offset"])
+                    f.write(np.ascontiguousarray(array).tobytes())
+                f.truncate(start + offset)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Map the graph written by dump(); the arrays are zero-copy views of the file."""
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a compact call graph" % path)
+        size = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], "little")
+        header = json.loads(buffer[len(MAGIC) + 8:len(MAGIC) + 8 + size])
+        start = -(-(len(MAGIC) + 8 + size) // ALIGN) * ALIGN
+        arrays = {}
+        for spec in header["arrays"]:
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            if count == 0:
+                arrays[spec["name"]] = np.empty(spec["shape"], dtype=dtype)
+                continue
+            arrays[spec["name"]] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                                 offset=start + spec["offset"]).reshape(spec["shape"])
+        return cls({"root": header["root"]}, arrays, buffer)
+
+    ###########################################################################
+    # Queries
+
+    def node(self, index):
+        return CompactNode(self, index)
+
+    def row(self, keys, name):
+        """Row of name in a sorted keys array, or -1."""
+        i = self.strings.find(name)
+        if i < 0:
+            return -1
+        keys = self.arrays[keys]
+        row = int(np.searchsorted(keys, i))
+        return row if row < len(keys) and keys[row] == i else -1
+
+    def targets(self, prefix, row):
+        indptr, indices = self.arrays[prefix + "_indptr"], self.arrays[prefix + "_indices"]
+        return [CompactNode(self, int(i)) for i in indices[indptr[row]:indptr[row + 1]]]
+
+    def uses(self, name):
+        """Nodes used by the node of full name, like visitor.uses_edges.get(name, ())."""
+        row = self.row("uses_keys", name)
+        return [] if row < 0 else self.targets("uses", row)
+
+    def defines(self, name):
+        row = self.row("defines_keys", name)
+        return [] if row < 0 else self.targets("defines", row)
+
+    def definition(self, name):
+        """The (first) node defined under full name, or None."""
+        row = self.row("definition_keys", name)
+        return None if row < 0 else CompactNode(self, int(self.arrays["definition_nodes"][row]))
+
+    def virtual_uses(self, name):
+        """{to_name: [candidate nodes]}, like visitor.virtual_uses_edges.get(name, {})."""
+        row = self.row("virtual_keys", name)
+        if row < 0:
+            return {}
+        indptr = self.arrays["virtual_indptr"]
+        return {self.strings[int(self.arrays["virtual_to"][entry])]: self.targets("virtual_candidate", entry)
+                for entry in range(indptr[row], indptr[row + 1])}
+
+    def dependencies_of(self, namespace):
+        """Same as call_analyzer.dependencies_of on the visitor this graph was made from."""
+        row = self.row("uses_keys", namespace)
+        if row < 0 or self.arrays["uses_caller"][row] < 0:
+            return None
+        caller = CompactNode(self, int(self.arrays["uses_caller"][row]))
+        uses = classify_uses(caller, self.targets("uses", row))
+        return {level: sorted(n.namespace + "." + n.name if n.namespace else n.name for n in nodes)
+                for level, nodes in uses.items()}
+
+
+def convert(analyzer_result, path=None):
+    """Write the compact graph of a pickled visitor next to it (or to path), return its path."""
+    import dill as pickle
+    with open(analyzer_result, "rb") as f:
+        visitor = pickle.loads(f.read())
+    path = path or os.path.join(os.path.dirname(analyzer_result), COMPACT_NAME)
+    CompactCallGraph.from_visitor(visitor).dump(path)
+    return path
+
+
+def main(cli_args=None):
+    parser = ArgumentParser(description="Convert <root>/*/analyzer_result.pkl into compact call graphs.")
+    parser.add_argument("dependency_data_root", type=str)
+    parser.add_argument("--force", action="store_true", help="also convert pickles whose graph is up to date")
+    args = parser.parse_args(cli_args)
+    for analyzer_result in sorted(glob.glob(os.path.join(args.dependency_data_root, "*", "analyzer_result.pkl"))):
+        path = os.path.join(os.path.dirname(analyzer_result), COMPACT_NAME)
+        if not args.force and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(analyzer_result):
+            continue
+        print("%s -> %s" % (analyzer_result, convert(analyzer_result, path)))
+
+
+if __name__ == "__main__":
+    main()
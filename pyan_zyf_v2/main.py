@@ -15,6 +15,7 @@ import logging
 import os
 
 from .analyzer import CallGraphVisitor
+from .trace import CATEGORIES, Tracer
 from .visgraph import VisualGraph
 from .writers import DotWriter, HTMLWriter, SVGWriter, TgfWriter, YedWriter
 
@@ -182,6 +183,29 @@ def main(cli_args=None):
         help="Package root directory. Is inferred by default.",
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        dest="workers",
+        help="number of processes preparing the files",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        dest="cache_dir",
+        help="directory keeping the scopes of analyzed files between runs",
+    )
+
+    parser.add_argument(
+        "--trace",
+        default=None,
+        dest="trace",
+        help="comma separated categories of the analysis to log, or 'all' (implied by -v and -V); "
+        "categories: %s" % ", ".join(CATEGORIES),
+    )
+
     known_args, unknown_args = parser.parse_known_args(cli_args)
 
     filenames = []
@@ -237,7 +261,18 @@ def main(cli_args=None):
     if root:
         root = os.path.abspath(root)
 
-    v = CallGraphVisitor(filenames, logger=logger, root=root)
+    if known_args.trace:
+        try:
+            trace = Tracer(known_args.trace.split(","), logger=logger)
+        except ValueError as e:
+            parser.error(str(e))
+    elif known_args.verbose or known_args.very_verbose:
+        trace = Tracer(["all"], logger=logger)
+    else:
+        trace = Tracer.from_env(logger)
+
+    v = CallGraphVisitor(filenames, logger=logger, root=root, workers=known_args.workers,
+                         cache_dir=known_args.cache_dir, trace=trace)
 
     if known_args.function or known_args.namespace:
 
@@ -3,6 +3,7 @@
 
 """Abstract node representing data gathered from the analysis."""
 
+import sys
 from enum import Enum
 
 
@@ -44,19 +45,21 @@ class Flavor(Enum):
     #
     @staticmethod
     def specificity(flavor):
-        if flavor in (Flavor.UNSPECIFIED, Flavor.UNKNOWN):
-            return 0
-        elif flavor in (Flavor.NAMESPACE, Flavor.ATTRIBUTE):
-            return 1
-        elif flavor == Flavor.IMPORTEDITEM:
-            return 2
-        else:
-            return 3
+        return _SPECIFICITY.get(flavor, 3)
 
     def __repr__(self):
         return self.value
 
 
+_SPECIFICITY = {
+    Flavor.UNSPECIFIED: 0,
+    Flavor.UNKNOWN: 0,
+    Flavor.NAMESPACE: 1,
+    Flavor.ATTRIBUTE: 1,
+    Flavor.IMPORTEDITEM: 2,
+}
+
+
 class Node:
     """A node is an object in the call graph.
 
@@ -88,11 +91,18 @@ class Node:
 
     Flavor describes the kind of object the node represents.
     See the Flavor enum for currently supported values.
+
+    Projects have hundreds of thousands of Nodes, so they are slotted, and the
+    full name is built once (interned) until namespace or name change.
     """
 
+    __slots__ = ("_namespace", "_name", "_full_name", "ast_node", "actual_path", "value", "defined_path",
+                 "filename", "flavor", "defined")
+
     def __init__(self, namespace, name, ast_node, filename, flavor, actual_path = None, value = None, defined_path = None, defined = False):
-        self.namespace = namespace
-        self.name = name
+        self._namespace = namespace
+        self._name = name
+        self._full_name = None
         self.ast_node = ast_node
         # actual_path: Record the actual type path of the token corresponding to the current node. For example, qikafolder.qikamodule.QikaClass
         # If it is a third-party reference, use the path information in import: from os.path import join -> os.path.join
@@ -118,6 +128,36 @@ class Node:
         self.flavor = flavor
         self.defined = defined  # assume that unknown nodes are defined
 
+    @property
+    def namespace(self):
+        return self._namespace
+
+    @namespace.setter
+    def namespace(self, namespace):
+        self._namespace = namespace
+        self._full_name = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self._full_name = None
+
+    def __getstate__(self):
+        return (self._namespace, self._name, self.ast_node, self.actual_path, self.value, self.defined_path,
+                self.filename, self.flavor, self.defined)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # pickled before Nodes were slotted
+            state = tuple(state.get(key) for key in ("namespace", "name", "ast_node", "actual_path", "value",
+                                                     "defined_path", "filename", "flavor", "defined"))
+        (self._namespace, self._name, self.ast_node, self.actual_path, self.value, self.defined_path,
+         self.filename, self.flavor, self.defined) = state
+        self._full_name = None
+
     def get_short_name(self):
         """Return the short name (i.e. excluding the namespace), of this Node.
         Names of unknown nodes will include the *. prefix."""
@@ -160,13 +200,16 @@ class Node:
 
     def get_name(self):
         """Return the full name of this node."""
-
-        if self.namespace == "":
-            return self.name
-        elif self.namespace is None:
-            return "*." + self.name
-        else:
-            return self.namespace + "." + self.name
+        full_name = self._full_name
+        if full_name is None:
+            if self._namespace == "":
+                full_name = self._name
+            elif self._namespace is None:
+                full_name = "*." + self._name
+            else:
+                full_name = self._namespace + "." + self._name
+            full_name = self._full_name = sys.intern(full_name)
+        return full_name
     
     def get_type(self):
         """Return the node path representing the current node type"""
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Opt-in tracing of the analyzer, by category.
+
+Nothing is traced unless categories are enabled: with CallGraphVisitor(trace=...),
+pyan --trace, or the PYAN_TRACE environment variable (comma separated categories,
+or "all"). Records go to the analyzer's logger (at INFO level), or with
+PYAN_TRACE_FILE to a JSON lines file, one object per record.
+
+Each category is an attribute of the Tracer, None when disabled, so call sites
+test it before anything is formatted or even packed into arguments:
+
+    if self.trace.uses:
+        self.trace.uses("Use from %s to %s", from_node, to_node)
+
+A disabled category costs two attribute lookups.
+"""
+
+import json
+import logging
+import os
+import time
+import warnings
+
+CATEGORIES = (
+    "files",  # passes over the files
+    "defs",  # modules, classes and functions, defines edges
+    "uses",  # uses edges
+    "imports",  # import statements
+    "bindings",  # assignments and loop targets
+    "calls",  # calls, super() and other built-ins
+    "attrs",  # attribute resolution
+    "scopes",  # lookups and bindings of names in scopes
+    "visits",  # other visited AST nodes
+    "mro",  # base classes and method resolution order
+    "postprocess",  # cleanup of the graph after the passes
+)
+
+
+class Channel:
+    """The emitter of one enabled category; the message is formatted only here."""
+
+    __slots__ = ("tracer", "category")
+
+    def __init__(self, tracer, category):
+        self.tracer = tracer
+        self.category = category
+
+    def __call__(self, template, *args):
+        self.tracer.emit(self.category, template, args)
+
+
+class LoggerSink:
+    def __init__(self, logger):
+        self.logger = logger
+
+    def __call__(self, record):
+        self.logger.info("[%s] %s", record["category"], record["message"])
+
+
+class JsonlSink:
+    """Structured records: time, category, template, its arguments and the message."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+
+class Tracer:
+    """Channels of the enabled categories, and where their records go."""
+
+    def __init__(self, categories=(), sink=None, logger=None):
+        self.logger = logger or logging.getLogger("pyan_zyf_v2.analyzer")
+        categories = set(CATEGORIES) if "all" in categories else set(categories)
+        unknown = categories - set(CATEGORIES)
+        if unknown:
+            raise ValueError("Unknown trace categories %s, expected some of %s" % (sorted(unknown), CATEGORIES))
+        self.categories = frozenset(categories)
+        self.sink = (sink or LoggerSink(self.logger)) if categories else None
+        for category in CATEGORIES:
+            setattr(self, category, Channel(self, category) if category in categories else None)
+
+    @classmethod
+    def from_env(cls, logger=None):
+        """The tracer configured by PYAN_TRACE and PYAN_TRACE_FILE, disabled if they are not set.
+
+        Unknown categories are ignored with a warning: this also runs when a
+        pickled analyzer is loaded, which a typo must not break.
+        """
+        categories = [c.strip() for c in os.environ.get("PYAN_TRACE", "").split(",") if c.strip()]
+        unknown = [c for c in categories if c != "all" and c not in CATEGORIES]
+        if unknown:
+            warnings.warn("PYAN_TRACE: ignoring unknown trace categories %s, expected some of %s"
+                          % (unknown, CATEGORIES), stacklevel=2)
+            categories = [c for c in categories if c not in unknown]
+        path = os.environ.get("PYAN_TRACE_FILE")
+        sink = JsonlSink(path) if categories and path else None
+        return cls(categories, sink=sink, logger=logger)
+
+    def __reduce__(self):
+        # a sink is not picklable; an unpickled analyzer traces as its new environment says
+        return (Tracer.from_env, ())
+
+    def emit(self, category, template, args):
+        self.sink({
+            "time": time.time(),
+            "category": category,
+            "template": template,
+            "args": [str(arg) for arg in args],
+            "message": template % args if args else template,
+        })
@@ -0,0 +1,131 @@
+"""
+A long-lived pytest runner for one project, started by python_repo.PytestForkServer.
+
+It runs under the project's own interpreter (`.venv/bin/python pytest_forkserver.py`)
+with the project root as working directory, so it must only use the standard
+library. At start-up it imports pytest and the third-party modules the project's
+tests import; every run request then forks a child that starts from this warm
+state, imports the project's own modules fresh and calls `pytest.main`.
+
+Protocol: one JSON object per line on stdin/stdout.
+    -> {"warm": [test_file, ...]}                 <- {"warmed": [module, ...]}
+    -> {"args": [...], "log": path, "env": {...}}  <- {"pid": pid}
+                                                   <- {"returncode": code, "maxrss": bytes}
+"""
+
+import ast
+import importlib.util
+import json
+import os
+import runpy
+import signal
+import sys
+import traceback
+
+
+def project_owns(repo_path, name):
+    """Whether a top-level module name belongs to the project itself (never warmed, it may be patched)."""
+    for root in (repo_path, os.path.join(repo_path, 'src')):
+        if os.path.exists(os.path.join(root, name)) or os.path.exists(os.path.join(root, name + '.py')):
+            return True
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return True
+    if spec is None:
+        return True
+    # only modules at the top of the project or of its src/ count: the project's .venv, and with it every
+    # installed package, is under repo_path too
+    origin = spec.origin or (list(spec.submodule_search_locations or []) or [''])[0]
+    origin = os.path.realpath(origin)
+    if os.path.basename(origin) == '__init__.py':
+        origin = os.path.dirname(origin)
+    return os.path.dirname(origin) in (repo_path, os.path.join(repo_path, 'src'))
+
+
+def imported_names(test_file):
+    with open(test_file, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), test_file)
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.append(node.module.split('.')[0])
+    return names
+
+
+def warm(repo_path, test_files):
+    warmed = []
+    for test_file in test_files:
+        try:
+            names = imported_names(test_file)
+        except Exception:
+            continue
+        for name in names:
+            if name in sys.modules or project_owns(repo_path, name):
+                continue
+            try:
+                __import__(name)
+                warmed.append(name)
+            except BaseException:
+                pass
+    return warmed
+
+
+def run_child(request):
+    code = 1
+    try:
+        os.setsid()  # own process group, so the client can kill the whole test tree
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        log_fd = os.open(request['log'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.environ.clear()
+        os.environ.update(request.get('env', {}))
+        extra_paths = [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]
+        sys.path[0:0] = [p for p in extra_paths if p not in sys.path]
+        for path in extra_paths:  # e.g. the import hook of an injection.Overlay
+            if os.path.isfile(os.path.join(path, 'sitecustomize.py')):
+                runpy.run_path(os.path.join(path, 'sitecustomize.py'))
+        import pytest
+        code = pytest.main(request['args'])
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(int(code))
+
+
+def main():
+    repo_path = os.path.realpath(os.getcwd())
+    # behave like `python -m pytest`: the project root, not this script's directory, leads sys.path
+    sys.path[0] = repo_path
+    protocol = os.fdopen(os.dup(1), 'w', buffering=1)
+    os.dup2(2, 1)  # stray prints of warmed modules must not corrupt the protocol
+
+    import pytest  # noqa: F401
+    protocol.write(json.dumps({"warmed": warm(repo_path, sys.argv[1:])}) + '\n')
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        if 'warm' in request:
+            protocol.write(json.dumps({"warmed": warm(repo_path, request['warm'])}) + '\n')
+            continue
+        pid = os.fork()
+        if pid == 0:
+            run_child(request)
+        protocol.write(json.dumps({"pid": pid}) + '\n')
+        _, status, rusage = os.wait4(pid, 0)
+        try:
+            os.killpg(pid, signal.SIGKILL)  # whatever the test left running in its session
+        except (ProcessLookupError, PermissionError):
+            pass
+        protocol.write(json.dumps({"returncode": os.waitstatus_to_exitcode(status),
+                                   "maxrss": rusage.ru_maxrss * 1024}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,18 @@
+import json
 import os
 import re
+import select
 import subprocess
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
 from pathlib import Path
 
 import chardet
-import psutil
 import toml
-from func_timeout import func_set_timeout
 from loguru import logger
+from supervisor import MEMORY_LIMIT, RunResult, confine, kill_tree, monitor, supervise
 
 
 def remove_ansi_escape_sequences(text):
@@ -48,8 +53,131 @@ def find_project_name(setup_filepath: str) -> str:
             logger.error("Project name not found in `setup.py`")
 
 
+def junit_address(test: str) -> str:
+    """The dotted `classname.name` pytest's junit-xml report uses for a test id."""
+    path, bracket, params = test.partition("[")
+    names = path.split("::")
+    names[0] = re.sub(r"\.py$", "", names[0].replace("/", "."))
+    return ".".join(names) + bracket + params
+
+
+def junit_outcomes(xml_file: str, tests: list[str]) -> dict:
+    """Map every test id to {"passed", "wall_time"} according to a junit-xml report.
+
+    A test id may select several testcases (parametrized functions, whole classes),
+    it passes only if all of them pass. Tests missing from the report did not run.
+    """
+    cases = {}
+    if os.path.exists(xml_file):
+        try:
+            for case in ET.parse(xml_file).iter("testcase"):
+                address = f"{case.get('classname')}.{case.get('name')}"
+                failed = case.find("failure") is not None or case.find("error") is not None
+                passed, wall_time = cases.get(address, (True, 0.0))
+                cases[address] = (passed and not failed, wall_time + float(case.get("time") or 0))
+        except ET.ParseError:
+            pass
+    outcomes = {}
+    for test in tests:
+        address = junit_address(test)
+        matched = [case for key, case in cases.items()
+                   if key == address or key.startswith(address + ".") or key.startswith(address + "[")]
+        outcomes[test] = {"passed": bool(matched) and all(passed for passed, _ in matched),
+                          "wall_time": sum(wall_time for _, wall_time in matched)}
+    return outcomes
+
+
+FORKSERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pytest_forkserver.py")
+
+
+class PytestForkServer:
+    """Client of a `pytest_forkserver.py` process running in the venv of one project.
+
+    Servers are started lazily, one per project path and evaluation process, and
+    live until the process exits.
+    """
+    _servers: dict = {}
+
+    def __init__(self, repo: "PythonRepo") -> None:
+        self.repo_path = repo.repo_path
+        self.lock = threading.Lock()
+        self.warmed_files = set()
+        self.process = subprocess.Popen([str(repo.relate_exec_path), FORKSERVER_SCRIPT],
+                                        cwd=str(repo.repo_path),
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL,
+                                        env=repo.env_var)
+        self.buffer = b""
+        self.read()
+
+    @classmethod
+    def for_repo(cls, repo: "PythonRepo") -> "PytestForkServer":
+        key = str(repo.repo_path.resolve())
+        server = cls._servers.get(key)
+        if server is None or server.process.poll() is not None:
+            logger.info(f"starting pytest fork server for {repo.repo_path}")
+            server = cls._servers[key] = cls(repo)
+        return server
+
+    def send(self, request: dict):
+        self.process.stdin.write(json.dumps(request).encode() + b"\n")
+        self.process.stdin.flush()
+
+    def read(self, timeout: float = None) -> dict | None:
+        """Read one reply, or return None if none arrived within timeout seconds."""
+        fd = self.process.stdout.fileno()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b"\n" not in self.buffer:
+            ready, _, _ = select.select([fd], [], [], None if deadline is None else max(0, deadline - time.monotonic()))
+            if not ready:
+                return None
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise RuntimeError(f"pytest fork server of {self.repo_path} exited")
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def warm(self, test_files: list[str]):
+        test_files = [f for f in test_files if f not in self.warmed_files]
+        if test_files:
+            self.send({"warm": test_files})
+            logger.info(f"warmed {self.read()['warmed']} for {self.repo_path}")
+            self.warmed_files.update(test_files)
+
+    def run(self, args: list[str], log_file: str, env: dict, timeout: float = None,
+            memory_limit: int = MEMORY_LIMIT) -> RunResult:
+        """Run pytest with args in a forked child under a wall-clock and memory limit."""
+        with self.lock:
+            self.warm([a.split("::")[0] for a in args if not a.startswith("-")])
+            start = time.monotonic()
+            self.send({"args": args, "log": os.path.abspath(log_file), "env": env})
+            pid = self.read()["pid"]
+            cgroup = confine(pid, memory_limit) if memory_limit else None
+            try:
+                exited, over_memory, sampled = monitor(pid, timeout, memory_limit if cgroup is None else None)
+                if not exited:
+                    kill_tree(pid, cgroup)
+                result = self.read()  # the server has reaped the child and killed what it left behind
+            except BaseException:
+                # kill the test, keep the protocol in sync
+                kill_tree(pid, cgroup)
+                self.read()
+                raise
+            finally:
+                peak, oom = (cgroup.peak(), cgroup.oom_killed()) if cgroup is not None else (None, False)
+                if cgroup is not None:
+                    cgroup.remove()
+            return RunResult(returncode=result["returncode"],
+                             wall_time=time.monotonic() - start,
+                             peak_rss=peak if peak is not None else max(result["maxrss"], sampled),
+                             timed_out=not exited and not over_memory,
+                             out_of_memory=oom or over_memory)
+
+
 class PythonRepo:
-    def __init__(self, repo_path: str | Path) -> None:
+    def __init__(self, repo_path: str | Path, fork_server: bool = False) -> None:
         self.repo_path = Path(repo_path)
         self.venv_path = self.repo_path / ".venv"
         self.exec_path = self.venv_path / "bin" / "python"
@@ -60,6 +188,7 @@ class PythonRepo:
         self.env_var = os.environ.copy()
         self.env_var['PYDEVD_DISABLE_FILE_VALIDATION'] = '1'
         self.env_var['PWD'] = str(self.repo_path)
+        self.fork_server = fork_server  # run tests in forks of a warm PytestForkServer
 
     def load_environments_cfg(self):
         requirements_txt = self.repo_path / "requirements.txt"
@@ -160,47 +289,49 @@ class PythonRepo:
         # # self.install_pytest()
         # self.build_and_install()
 
-    @func_set_timeout(30)
-    def run_test(self, test: str):
+    def run_test(self, test: str) -> RunResult:
+        """Run one test, the result is truthy if it passed."""
         logger.info(f"running {self.repo_path} | {test}")
 
         log_dir = os.path.join("log", self.repo_path.stem)
         os.makedirs(log_dir, exist_ok=True)
         log_file = os.path.join(log_dir, f"{test.split("::")[-1]}.log")
+        return self.run_pytest(["--color=no", test], log_file, timeout=30)
 
-        with open(log_file, "w") as log_fh:
-            process = subprocess.Popen([str(self.relate_exec_path), "-m", "pytest", "--color=no", test],
-                                       cwd=str(self.repo_path),
-                                       stdout=log_fh,
-                                       stderr=log_fh,
-                                       env=self.env_var)
-            try:
-                while True:
-                    process_id = process.pid
-                    process_memory = psutil.Process(process_id).memory_info().rss
-
-                    # Check if memory usage exceeds 5GB (5 * 1024 * 1024 * 1024 bytes)
-                    if process_memory > 5 * 1024 * 1024 * 1024:
-                        process.terminate()
-                        process.wait()
-                        return False  # Out of Memory
-
-                    return_code = process.poll()
-                    if return_code is not None:
-                        # If process finished and return code is not 0, it means test failed
-                        if return_code != 0:
-                            process.terminate()
-                            process.wait()
-                            return False  # Execution Error
-                        else:
-                            break  # Test passed, exit loop
-            except Exception as e:
-                process.terminate()
-                process.wait()
-                logger.exception(f"Error occurred: {e}")
-                return False  # Other Error
-            finally:
-                process.terminate()
-                process.wait()
+    def run_tests(self, tests: list[str], exitfirst: bool = True) -> tuple[bool, dict]:
+        """Run all tests in one pytest session, return (passed, {test: {"passed", "wall_time"}}).
 
-        return True  # Test passed
+        Collection and conftest setup are paid once instead of once per test. With
+        exitfirst the session stops at the first failure (`-x`) like a loop over
+        run_test would, tests that did not run are reported as failed.
+        """
+        logger.info(f"running {self.repo_path} | {len(tests)} tests")
+
+        log_dir = os.path.join("log", self.repo_path.stem)
+        os.makedirs(log_dir, exist_ok=True)
+        # worker clones share the project name and the test server runs in threads, so name files by run
+        run_id = f"{os.getpid()}-{threading.get_ident()}"
+        log_file = os.path.join(log_dir, f"{tests[0].split("::")[-1]}.{run_id}.batch.log")
+        fd, xml_file = tempfile.mkstemp(prefix="pytest-", suffix=".xml")
+        os.close(fd)
+        try:
+            args = ["--color=no", f"--junitxml={xml_file}"]
+            args += ["-x"] if exitfirst else ["--continue-on-collection-errors"]
+            result = self.run_pytest(args + tests, log_file, timeout=30 * len(tests))
+            outcomes = junit_outcomes(xml_file, tests)
+        finally:
+            os.unlink(xml_file)
+        return result.passed and all(outcome["passed"] for outcome in outcomes.values()), outcomes
+
+    def run_pytest(self, args: list[str], log_file: str, timeout: float) -> RunResult:
+        """Run pytest with args in the venv of the project under a wall-clock and 5GB memory limit."""
+        if self.fork_server:
+            server = PytestForkServer.for_repo(self)
+            result = server.run(args, log_file, self.env_var, timeout=timeout)
+        else:
+            result = supervise([str(self.relate_exec_path), "-m", "pytest", *args],
+                               cwd=str(self.repo_path), env=self.env_var, log_file=log_file, timeout=timeout)
+        logger.info(f"{self.repo_path} | exit {result.returncode} in {result.wall_time:.2f}s, "
+                    f"peak rss {result.peak_rss / 1024 / 1024:.0f}MB"
+                    f"{', timed out' if result.timed_out else ''}{', out of memory' if result.out_of_memory else ''}")
+        return result
@@ -1,10 +1,15 @@
+import itertools
 import json
+import multiprocessing
 import os
 import textwrap
 from argparse import ArgumentParser
-from subprocess import run
 
-from parser.add_func_call import process
+from canonical import canonical_completion, is_empty_body
+from injection import render_completion
+from parser.add_func_call import ResidentVisitor, VisitorCache, dependencies
+from result_cache import ResultCache, recall_k_key
+from scoring import dependency_report_lines, dependency_scores
 from tqdm import tqdm
 
 
@@ -16,7 +21,11 @@ def get_parser():
     parser.add_argument('--source_code_root', type=str)
     parser.add_argument('--dependency_data_root', type=str)
     parser.add_argument('--data_file', type=str)
-    parser.add_argument('--dependency_tmp_dir', type=str, default='dependency_data_tmp')
+    parser.add_argument('--visitor_cache', action='store_true')
+    parser.add_argument('--visitor_cache_memory', type=float, default=16)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--cache_file', type=str, default=None)
+    parser.add_argument('--bootstrap', type=int, default=0)
     return parser.parse_args()
 
 
@@ -42,118 +51,90 @@ def adjust_indent(code, new_indent):
     return indented_code
 
 
-def compute_recall(generated_dependency, reference_dependency):
-    reference = []
-    for _type, _list in reference_dependency.items():
-        reference.extend(_list)
-    if generated_dependency is None:
-        return 0
-    prediction = []
-    for _type, _list in generated_dependency.items():
-        prediction.extend(_list)
-    reference = set(reference)
-    prediction = set(prediction)
-    recall = len(reference.intersection(prediction)) / len(reference)
-    return recall
-
-
 def report_results(args, k_list, output_data, benchmark_data):
     if not os.path.exists(args.log_file):
         raise ValueError("Output file not found")
 
-    parse_results = dict()
-    with open(args.log_file, 'r') as f:
-        for line in f:
-            js = json.loads(line)
-            namespace, completion = js['namespace'], js['completion']
-            if namespace not in parse_results:
-                parse_results[namespace] = dict()
-            parse_results[namespace][completion] = js['generated_dependency']
-
-    results = {}
-    for namespace, outputs in output_data.items():
-        for output in outputs:
-            completion = output['completion']
-            if namespace in parse_results:
-                generated_dependency = parse_results[namespace][completion]
-                data = benchmark_data[namespace]
-                reference_dependency = data['dependency']
-                recall = compute_recall(generated_dependency, reference_dependency)
-                if namespace not in results:
-                    results[namespace] = []
-                results[namespace].append(recall)
-    writes = []
-    for k in k_list:
-        recall = 0
-        for namespace, recall_list in results.items():
-            recall += max(recall_list[:k])
-        recall /= len(results)  # average the accuracy of samples
-        print(f"Recall@{k}: {recall*100}%\n")
-        writes.append(f"Recall@{k}: {recall*100}%\n")
+    # Compute Recall@k, Precision@k and F1@k, overall and per dependency type, for all k at once, see scoring.py
+    scores = dependency_scores(args.log_file, output_data, benchmark_data, k_list)
+    writes = dependency_report_lines(k_list, scores, getattr(args, 'bootstrap', 0))
+    for line in writes:
+        print(line)
     with open(args.write_rst, "w") as f:
         f.writelines(writes)
 
 
 def SetUp_evaluation(args, data):
+    # render the completion in memory, the analyzer reads the patched source from the string
     completion = adjust_indent(data['completion'], data['indent'])
     completion_path = os.path.join(args.source_code_root, data['completion_path'])
-    head_tail = os.path.split(completion_path)
-    completion_tmp_path = os.path.join(head_tail[0], 'tmp_' + head_tail[1])
+    return render_completion(completion_path, data, completion)
 
-    # rename the original completion file as tmp_completion
-    run(['cp', completion_path, completion_tmp_path])
 
-    # write the new completion file
-    sos, eos = data['body_position'][0]-1, data['body_position'][1]
-    with open(completion_path, 'r') as f:
-        file_lines = f.readlines()
-    file_lines = file_lines[:sos] + ['\n', completion, '\n'] + file_lines[eos:]
-    with open(completion_path, 'w') as f:
-        f.write(''.join(file_lines))
+class ParseFailed:
+    """The result of a completion whose parsing raised: logged as None, but not cached, it may work next run."""
 
+    def __reduce__(self):
+        return 'PARSE_FAILED'  # the one instance, also when it comes back from a pool worker
 
-def parse_dependency(args, data):
+
+PARSE_FAILED = ParseFailed()
+
+
+def parse_dependency(args, data, content, visitor_cache=None):
+    """Return the generated dependency of data['namespace'] in the patched content, None if it is not
+    found there, or PARSE_FAILED if parsing raised."""
     project_name = data['completion_path'].split('/')[0]
     project_root = os.path.join(args.source_code_root, project_name)
     file_to_parse = os.path.join(args.source_code_root, data['completion_path'])
-    output_path = os.path.join(args.dependency_tmp_dir, project_name)
     analyzer_result_path = os.path.join(args.dependency_data_root, project_name, 'analyzer_result.pkl')
     try:
-        process(target_object=project_root, func_object_root=project_root, func_path=file_to_parse,
-                analyzer_result=analyzer_result_path, target_root=output_path)
+        attributes = (visitor_cache.dependencies if visitor_cache is not None else dependencies)(
+            target_object=project_root, func_object_root=project_root, func_path=file_to_parse,
+            analyzer_result=analyzer_result_path, namespace=data['namespace'], func_content=content)
     except Exception as e:
-        return False
-    return True
+        return PARSE_FAILED
+    return to_generated_dependency(attributes)
 
 
-def extract_dependency(args, data):
-    dependency_path = os.path.join(args.dependency_tmp_dir, data['completion_path'].replace('.py', '.json'))
-    if not os.path.exists(dependency_path):
+def to_generated_dependency(attributes):
+    if attributes is None:
         return None
-    with open(dependency_path, 'r') as f:
-        dependency_data = json.load(f)
-    if data['namespace'] not in dependency_data:
-        return None
-    attributes = dependency_data[data['namespace']]
-    generated_dependency = {'intra_class': [], 'intra_file': [], 'cross_file': []}
-    for _item in attributes['in_class']:
-        generated_dependency['intra_class'].append(_item['name'])
-    for _item in attributes['in_file']:
-        generated_dependency['intra_file'].append(_item['name'])
-    for _item in attributes['in_object']:
-        generated_dependency['cross_file'].append(_item['name'])
-    return generated_dependency
-
-
-def TearDown_evaluation(args, data):
-    project_name = data['completion_path'].split('/')[0]
-    completion_path = os.path.join(args.source_code_root, data['completion_path'])
-    head_tail = os.path.split(completion_path)
-    completion_tmp_path = os.path.join(head_tail[0], 'tmp_' + head_tail[1])
-    dependency_tmp_path = os.path.join(args.dependency_tmp_dir, project_name)
+    return {'intra_class': attributes['in_class'],
+            'intra_file': attributes['in_file'],
+            'cross_file': attributes['in_object']}
 
-    run(['mv', completion_tmp_path, completion_path])
-    run(['rm', '-rf', dependency_tmp_path])
+
+SHARD_SIZE = 16  # completions of one project handed to a worker at once
+
+worker_args = None
+worker_visitor = None
+
+
+def init_worker(args):
+    global worker_args, worker_visitor
+    worker_args = args
+    worker_visitor = ResidentVisitor()
+
+
+def parse_shard(shard):
+    """Parse a few completions of one project in a pool worker, return [(index, generated_dependency)]."""
+    results = []
+    for index, data in shard:
+        content = SetUp_evaluation(worker_args, data)
+        results.append((index, parse_dependency(worker_args, data, content, worker_visitor)))
+    return results
+
+
+def make_shards(tasks):
+    """Split [(index, data)] sorted by project into shards of at most SHARD_SIZE completions of one project."""
+    shards = []
+    for index, data in tasks:
+        project_name = data['completion_path'].split('/')[0]
+        if not shards or shards[-1][0] != project_name or len(shards[-1][1]) == SHARD_SIZE:
+            shards.append((project_name, []))
+        shards[-1][1].append((index, data))
+    return [shard for _, shard in shards]
 
 
 def is_standalone(data):
@@ -224,23 +205,81 @@ def main():
     # release memory
     del finished_data
 
+    # parse once per namespace and class of semantically identical completions, see canonical.py
+    classes = {}
+    for output in todo_output_data:
+        classes.setdefault((output['namespace'], canonical_completion(output['completion'])), []).append(output)
+    print(f"Distinct Completions: {len(classes)}\n")
+
+    # keep each project's analyzer result resident instead of unpickling it per completion
+    workers = getattr(args, 'workers', 1)
+    visitor_cache = None
+    if getattr(args, 'visitor_cache', False) and workers <= 1:
+        visitor_cache = VisitorCache(memory_limit=getattr(args, 'visitor_cache_memory', 16) * 1024 * 1024 * 1024)
+    if visitor_cache is not None or workers > 1:
+        # completions of one project in a row, so that evicted projects are not loaded again
+        classes = dict(sorted(classes.items(), key=lambda item: benchmark_data[item[0][0]]['completion_path'].split('/')[0]))
+    todo_classes = list(classes.items())
+
+    def sample(outputs):
+        return dict(benchmark_data[outputs[0]['namespace']], completion=outputs[0]['completion'])
+
+    # reuse dependencies of identical completions parsed before (by any model or run)
+    cache = ResultCache.open(args.cache_file, table='recall_k') if getattr(args, 'cache_file', None) else None
+    cache_keys = {}
+    done = {i: None for i, (_, outputs) in enumerate(todo_classes) if is_empty_body(outputs[0]['completion'])}
+    cached = set()
+    if cache is not None:
+        for i, ((_, canonical), outputs) in enumerate(todo_classes):
+            if i not in done:
+                cache_keys[i] = recall_k_key(args.source_code_root, args.dependency_data_root,
+                                             sample(outputs), outputs[0]['completion'])
+                value = cache.get(cache_keys[i])
+                if value is not None:
+                    done[i] = value['generated_dependency']
+                    cached.add(i)
+        print(f"Cached Completions: {len(cached)}\n")
+
     with open(args.log_file, 'a') as f:
-        for output in tqdm(todo_output_data):
-            if output['completion'] == "    pass\n":
-                output['generated_dependency'] = None
-            else:
-                data = benchmark_data[output['namespace']]
-                data['completion'] = output['completion']
-                SetUp_evaluation(args, data)
-                if parse_dependency(args, data) == True:
-                    generated_dependency = extract_dependency(args, data)
-                    output['generated_dependency'] = generated_dependency
-                else:
-                    output['generated_dependency'] = None
-                TearDown_evaluation(args, data)
-            f.write(json.dumps(output) + '\n')
+        def write(i, generated_dependency):
+            failed = generated_dependency is PARSE_FAILED
+            if failed:
+                generated_dependency = None
+            for output in todo_classes[i][1]:
+                output['generated_dependency'] = generated_dependency
+                if i in cached:
+                    output['Cached'] = True
+                f.write(json.dumps(output) + '\n')
             f.flush()
+            if cache is not None and i in cache_keys and i not in cached and not failed:
+                cache.put(cache_keys[i], {'generated_dependency': generated_dependency})
+
+        if workers > 1:
+            # each worker keeps the visitor of the project it parses resident, see parse_shard;
+            # results are logged in the order of todo_classes as they come in ([] flushes leading done classes)
+            tasks = [(i, sample(outputs)) for i, (_, outputs) in enumerate(todo_classes) if i not in done]
+            pending = dict(done)
+            next_index = 0
+            with multiprocessing.Pool(workers, initializer=init_worker, initargs=(args,)) as pool, \
+                    tqdm(total=len(todo_classes), initial=len(pending)) as pbar:
+                for results in itertools.chain([[]], pool.imap_unordered(parse_shard, make_shards(tasks))):
+                    pending.update(results)
+                    pbar.update(len(results))
+                    while next_index in pending:
+                        write(next_index, pending.pop(next_index))
+                        next_index += 1
+        else:
+            for i, (_, outputs) in enumerate(tqdm(todo_classes)):
+                if i in done:
+                    generated_dependency = done[i]
+                else:
+                    data = sample(outputs)
+                    content = SetUp_evaluation(args, data)
+                    generated_dependency = parse_dependency(args, data, content, visitor_cache)
+                write(i, generated_dependency)
 
+    if visitor_cache is not None:
+        visitor_cache.close()
     report_results(args, k_list, output_data, benchmark_data)
 
 
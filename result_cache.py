@@ -0,0 +1,114 @@
+"""
+A persistent, content-addressed cache of evaluation results (pass@k results and
+recall@k dependencies, in one table each).
+
+Results are keyed by what actually decides them rather than by model or run: the
+canonical form of the completion (see canonical.py), the pristine content of the
+project and of the completion file, where the completion goes and which tests
+judge it. Identical completions from different models, runs and configs are
+evaluated once. Several evaluation processes may share one cache file.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+
+from canonical import canonical_completion
+
+
+def file_digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def project_digest(project_path: str) -> str:
+    """Hash of every python source of a project, computed once per process (the pristine tree does not change)."""
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(project_path):
+        dirs[:] = sorted(d for d in dirs if d not in ('.venv', '.git', '__pycache__', '.pytest_cache'))
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                sha.update(os.path.relpath(path, project_path).encode() + b'\0')
+                sha.update(file_digest(path).encode())
+    return sha.hexdigest()
+
+
+def pass_k_key(source_code_root: str, data: dict, completion: str) -> str:
+    """Cache key of one completion of a benchmark sample; compute it before the file is patched."""
+    project_name = data['completion_path'].split('/')[0]
+    key = {
+        'completion': canonical_completion(completion),
+        'project': project_digest(os.path.join(source_code_root, project_name)),
+        'file': file_digest(os.path.join(source_code_root, data['completion_path'])),
+        'completion_path': data['completion_path'],
+        'body_position': data['body_position'],
+        'indent': data['indent'],
+        'tests': data['tests'],
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def artifact_digest(path: str, mtime_ns: int, size: int) -> str:
+    """Hash of a (large) derived file, computed once per version of it; call with its stat."""
+    return file_digest(path)
+
+
+def recall_k_key(source_code_root: str, dependency_data_root: str, data: dict, completion: str) -> str:
+    """Cache key of the generated dependency of one completion; the analysis of the project is part of the snapshot."""
+    project_name = data['completion_path'].split('/')[0]
+    analyzer_result = os.path.join(dependency_data_root, project_name, 'analyzer_result.pkl')
+    try:
+        stat = os.stat(analyzer_result)
+        analysis = artifact_digest(analyzer_result, stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        analysis = None
+    key = {
+        'completion': canonical_completion(completion),
+        'project': project_digest(os.path.join(source_code_root, project_name)),
+        'analysis': analysis,
+        'completion_path': data['completion_path'],
+        'namespace': data['namespace'],
+        'body_position': data['body_position'],
+        'indent': data['indent'],
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """JSON results in one table of a SQLite file, safe to share between threads."""
+    _caches: dict = {}
+
+    def __init__(self, path: str, table: str = 'pass_k') -> None:
+        self.path = path
+        self.table = table
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.conn.commit()
+
+    @classmethod
+    def open(cls, path: str, table: str = 'pass_k') -> "ResultCache":
+        """One shared instance per file and table in this process."""
+        key = (os.path.abspath(path), table)
+        if key not in cls._caches:
+            cls._caches[key] = cls(path, table)
+        return cls._caches[key]
+
+    def get(self, key: str) -> dict | None:
+        with self.lock:
+            row = self.conn.execute(f'SELECT value FROM {self.table} WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, value: dict):
+        with self.lock:
+            self.conn.execute(f'INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)',
+                              (key, json.dumps(value)))
+            self.conn.commit()
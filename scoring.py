@@ -0,0 +1,312 @@
+"""
+Pass@k and Recall@k of evaluation logs, computed on columns instead of nested dicts.
+
+A log is read once into a few NumPy columns: namespace codes, int64 hashes of
+(namespace, completion) to join completions with their results, and flattened
+dependency names. Pass@k and Recall@k are then computed for every k at once, and
+a bootstrap over benchmark samples (namespaces) gives their confidence intervals.
+
+pass_k.py and recall_k.py report through this module. It can also score many
+evaluations in one go, taking their configs (see gen_config.py):
+    python scoring.py --pass_k config.local_completion.yaml \
+        --recall_k recall_config.local_completion.yaml::gpt-4 --bootstrap 1000
+"""
+
+import json
+import os
+from argparse import ArgumentParser
+from functools import lru_cache
+
+import numpy as np
+
+
+def compute_pass_at_k(n, c, k):
+    """
+    n: total number of completions per task
+    c: number of completions that pass all tests
+    k: k in pass_at_k
+    """
+    if n - c < k:
+        return 1
+    else:
+        return 1.0 - np.prod(1.0 - k / np.arange(n-c+1, n+1))
+
+
+def read_columns(path: str, columns: list[str]) -> dict[str, list]:
+    """The given fields of every line of a JSONL file, one list per field."""
+    table = {column: [] for column in columns}
+    with open(path, 'r') as f:
+        for line in f:
+            js = json.loads(line)
+            for column in columns:
+                table[column].append(js.get(column))
+    return table
+
+
+def row_keys(namespaces, completions) -> np.ndarray:
+    """int64 join keys of (namespace, completion) pairs, valid within this process."""
+    return np.fromiter((hash(pair) for pair in zip(namespaces, completions)), dtype=np.int64, count=len(namespaces))
+
+
+def encode(values):
+    """Codes of values numbered in order of first appearance, and the distinct values."""
+    uniques, first, inverse = np.unique(np.asarray(values, dtype=object), return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[inverse.reshape(-1)], uniques[order]
+
+
+def lookup(keys, table_keys) -> np.ndarray:
+    """Row of table_keys holding each key (the last one if repeated), -1 if missing."""
+    if len(table_keys) == 0:
+        return np.full(len(keys), -1)
+    # a stable sort keeps repeated keys in log order, searching from the right then finds the last one
+    order = np.argsort(table_keys, kind='stable')
+    position = np.searchsorted(table_keys[order], keys, side='right') - 1
+    position = np.clip(position, 0, None)
+    rows = order[position]
+    return np.where(table_keys[rows] == keys, rows, -1)
+
+
+def pass_at_k(n, c, k_list) -> np.ndarray:
+    """Pass@k of every sample (rows) for every k (columns), from n completions of which c pass."""
+    n, c = np.broadcast_arrays(np.asarray(n), np.asarray(c))
+    pairs, inverse = np.unique(np.stack([n.ravel(), c.ravel()], axis=1), axis=0, return_inverse=True)
+    # at most one evaluation per distinct (n, c) and k, gathered back to the samples
+    values = np.array([[compute_pass_at_k(int(_n), int(_c), k) for k in k_list] for _n, _c in pairs], dtype=float)
+    return values.reshape(-1, len(k_list))[inverse.reshape(-1)]
+
+
+def best_of_k(values: np.ndarray, k_list) -> np.ndarray:
+    """Best score of the first k completions of every sample (rows) for every k (columns), from the score of its
+    completions in order (NaN padded, counting as 0)."""
+    best = np.fmax.accumulate(values, axis=1)
+    columns = np.minimum(np.asarray(k_list), values.shape[1]) - 1
+    return np.nan_to_num(best[:, columns])
+
+
+def bootstrap(scores: np.ndarray, samples: int = 1000, confidence: float = 0.95, seed: int = 0):
+    """Confidence interval (low, high) of the mean of each column of scores, resampling its rows."""
+    if samples <= 0 or len(scores) == 0:
+        return None
+    rng = np.random.default_rng(seed)
+    means = np.empty((samples, scores.shape[1]))
+    # in chunks, the resampled rows of all samples at once may not fit in memory
+    chunk = max(1, (1 << 24) // max(1, scores.size))
+    for start in range(0, samples, chunk):
+        stop = min(samples, start + chunk)
+        means[start:stop] = scores[rng.integers(0, len(scores), size=(stop - start, len(scores)))].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    return np.quantile(means, alpha, axis=0), np.quantile(means, 1 - alpha, axis=0)
+
+
+def pass_k_scores(log_file, output_file, benchmark_data, n, k_list) -> np.ndarray:
+    """Pass@k per namespace of output_file found in benchmark_data, in order of appearance."""
+    log = read_columns(log_file, ['namespace', 'completion', 'Result'])
+    passed = np.array([result == 'Pass' for result in log['Result']], dtype=bool)
+    passed_keys = row_keys(log['namespace'], log['completion'])[passed]
+
+    outputs = read_columns(output_file, ['namespace', 'completion'])
+    keep = [i for i, namespace in enumerate(outputs['namespace']) if namespace in benchmark_data]
+    namespaces = [outputs['namespace'][i] for i in keep]
+    completions = [outputs['completion'][i] for i in keep]
+    codes, _ = encode(namespaces)
+    is_passed = np.isin(row_keys(namespaces, completions), passed_keys)
+    c = np.bincount(codes, weights=is_passed, minlength=codes.max(initial=-1) + 1).astype(int)
+    return pass_at_k(n, c, k_list)
+
+
+DEPENDENCY_TYPES = ('intra_class', 'intra_file', 'cross_file')
+
+
+def dependency_recalls(generated_dependency, reference_dependency) -> dict:
+    """Recall of all reference dependencies and of each type of them, None where there is no reference."""
+    prediction = set()
+    for names in (generated_dependency or {}).values():
+        prediction.update(names)
+    recalls = {}
+    references = set()
+    for _type in DEPENDENCY_TYPES:
+        reference = set(reference_dependency.get(_type, []))
+        references |= reference
+        recalls[_type] = len(reference & prediction) / len(reference) if reference else None
+    recalls['all'] = len(references & prediction) / len(references) if references else None
+    return recalls
+
+
+def flatten_dependencies(namespaces, dependencies):
+    """Row index, type (index in DEPENDENCY_TYPES) and (namespace, name) key of every name in a list of
+    dependency dicts (None counts as empty)."""
+    rows, types, keys = [], [], []
+    for row, (namespace, dependency) in enumerate(zip(namespaces, dependencies)):
+        for _type, names in (dependency or {}).items():
+            rows.extend([row] * len(names))
+            types.extend([DEPENDENCY_TYPES.index(_type)] * len(names))
+            keys.extend(hash((namespace, name)) for name in names)
+    return np.array(rows, dtype=np.int64), np.array(types, dtype=np.int64), np.array(keys, dtype=np.int64)
+
+
+def count_by(shape, rows, columns):
+    counts = np.zeros(shape)
+    np.add.at(counts, (rows, columns), 1)
+    return counts
+
+
+def dependency_scores(log_file, output_data, benchmark_data, k_list) -> dict[str, np.ndarray]:
+    """Recall@k, Precision@k and F1@k, overall and per dependency type, of the namespaces of output_data
+    parsed in log_file (standalone ones are not); each metric@k is the best of the first k completions.
+
+    Per type, recall is the share of the reference dependencies of the type that were generated (as any type),
+    precision the share of the dependencies generated as the type that are references (of any type). Both are
+    only scored over the namespaces that have reference dependencies of the type.
+    """
+    log = read_columns(log_file, ['namespace', 'completion', 'generated_dependency'])
+    parsed = set(log['namespace'])
+
+    namespaces, completions, positions = [], [], []
+    for namespace, outputs in output_data.items():
+        if namespace in parsed:
+            for position, output in enumerate(outputs):
+                namespaces.append(namespace)
+                completions.append(output['completion'])
+                positions.append(position)
+    metrics = ['Recall', 'Precision', 'F1']
+    names = metrics + [f'{metric} {_type}' for _type in DEPENDENCY_TYPES for metric in metrics]
+    if not namespaces:
+        return {name: np.zeros((0, len(k_list))) for name in names}
+    codes, distinct = encode(namespaces)
+    ALL = len(DEPENDENCY_TYPES)  # the column of the counts over all types
+
+    # reference names per namespace and type
+    ref_rows, ref_types, ref_keys = flatten_dependencies(
+        distinct, [benchmark_data[namespace]['dependency'] for namespace in distinct])
+    if len(ref_keys):
+        ref_rows, ref_types, ref_keys = np.unique(np.stack([ref_rows, ref_types, ref_keys], axis=1), axis=0).T
+    ref_size = count_by((len(distinct), ALL + 1), ref_rows, ref_types)
+    ref_size[:, ALL] = np.bincount(ref_rows[np.unique(ref_keys, return_index=True)[1]], minlength=len(distinct))
+
+    # per logged completion and type: names generated, those of them that are references, references hit
+    shape = (len(log['namespace']), ALL + 1)
+    generated, correct, hits = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    gen_rows, gen_types, gen_keys = flatten_dependencies(log['namespace'], log['generated_dependency'])
+    if len(gen_keys):
+        gen_rows, gen_types, gen_keys = np.unique(np.stack([gen_rows, gen_types, gen_keys], axis=1), axis=0).T
+        found = np.isin(gen_keys, ref_keys)
+        generated = count_by(shape, gen_rows, gen_types)
+        correct = count_by(shape, gen_rows[found], gen_types[found])
+        rows, keys = np.unique(np.stack([gen_rows, gen_keys], axis=1), axis=0).T
+        for i in range(ALL):
+            hits[:, i] = np.bincount(rows[np.isin(keys, ref_keys[ref_types == i])], minlength=shape[0])
+        generated[:, ALL] = np.bincount(rows, minlength=shape[0])
+        correct[:, ALL] = hits[:, ALL] = np.bincount(rows[np.isin(keys, ref_keys)], minlength=shape[0])
+
+    rows = lookup(row_keys(namespaces, completions), row_keys(log['namespace'], log['completion']))
+    logged = rows >= 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = hits[rows] / np.maximum(ref_size[codes], 1)
+        precision = np.where(generated[rows] > 0, correct[rows] / generated[rows], 0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0)
+
+    scores = {}
+    for column, suffix in [(ALL, '')] + [(i, f' {_type}') for i, _type in enumerate(DEPENDENCY_TYPES)]:
+        scored = ref_size[:, column] > 0 if column != ALL else np.ones(len(distinct), dtype=bool)
+        for metric, values in zip(metrics, (recall, precision, f1)):
+            table = np.full((len(distinct), max(positions) + 1), np.nan)
+            table[codes, positions] = np.where(logged, values[:, column], np.nan)
+            scores[metric + suffix] = best_of_k(table, k_list)[scored]
+    return scores
+
+
+def recall_k_scores(log_file, output_data, benchmark_data, k_list) -> np.ndarray:
+    """Recall@k per namespace of output_data that was parsed in log_file (standalone ones are not)."""
+    return dependency_scores(log_file, output_data, benchmark_data, k_list)['Recall']
+
+
+def report_lines(metric, k_list, scores, interval=None) -> list[str]:
+    lines = []
+    for i, k in enumerate(k_list):
+        line = metric.format(k=k, value=np.ascontiguousarray(scores[:, i]).mean() * 100)  # pairwise summation
+        if interval is not None:
+            line += f' ({interval[0][i]*100:.2f}% - {interval[1][i]*100:.2f}%)'
+        lines.append(line + '\n')
+    return lines
+
+
+def dependency_report_lines(k_list, scores, samples=0, confidence=0.95) -> list[str]:
+    """Report lines of dependency_scores, `Recall@k` first, then precision, F1 and every metric per type."""
+    lines = []
+    for name, values in scores.items():
+        metric, _, _type = name.partition(' ')
+        if _type and len(values) == 0:
+            continue  # no reference dependency of the type
+        template = f'{metric}@{{k}}' + (f' {_type}' if _type else '') + ': {value}%'
+        lines.extend(report_lines(template, k_list, values, bootstrap(values, samples, confidence)))
+    return lines
+
+
+@lru_cache(maxsize=None)
+def load_benchmark_data(data_file):
+    benchmark_data = {}
+    with open(data_file, 'r') as f:
+        for line in f:
+            js = json.loads(line)
+            benchmark_data[js['namespace']] = js
+    return benchmark_data
+
+
+def load_output_data(output_file, max_k):
+    """The first max_k completions of each namespace, like recall_k.py evaluates them."""
+    output_data = {}
+    outputs = read_columns(output_file, ['namespace', 'completion'])
+    for namespace, completion in zip(outputs['namespace'], outputs['completion']):
+        completions = output_data.setdefault(namespace, [])
+        if len(completions) < max_k:
+            completions.append({'namespace': namespace, 'completion': completion})
+    return output_data
+
+
+def load_configs(config):
+    """`file.yaml::key` names one evaluation of a config file, `file.yaml` all of them."""
+    import yaml
+    config_file, _, config_key = config.partition('::')
+    with open(config_file, 'r') as f:
+        config_all = yaml.safe_load(f)
+    keys = [config_key] if config_key else list(config_all)
+    return [(f'{config_file}::{key}', config_all[key]) for key in keys]
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--pass_k', type=str, nargs='*', default=[])
+    parser.add_argument('--recall_k', type=str, nargs='*', default=[])
+    parser.add_argument('--k', type=str, default=None)
+    parser.add_argument('--bootstrap', type=int, default=1000)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    args = parser.parse_args()
+
+    for metric, configs in (('pass_k', args.pass_k), ('recall_k', args.recall_k)):
+        for config in configs:
+            for name, evaluation in load_configs(config):
+                if not os.path.exists(evaluation['log_file']):
+                    print(f'{name}: {evaluation["log_file"]} does not exist')
+                    continue
+                k_list = [int(k) for k in str(args.k or evaluation.get('k', '1')).split(',')]
+                benchmark_data = load_benchmark_data(evaluation.get('data_file', 'data.jsonl'))
+                if metric == 'pass_k':
+                    n = evaluation.get('n', 1)
+                    k_list = [k for k in k_list if k <= n]
+                    scores = pass_k_scores(evaluation['log_file'], evaluation['output_file'], benchmark_data, n, k_list)
+                    lines = report_lines('pass_at_{k}: {value}%', k_list, scores,
+                                         bootstrap(scores, args.bootstrap, args.confidence))
+                else:
+                    output_data = load_output_data(evaluation['output_file'], max(k_list))
+                    scores = dependency_scores(evaluation['log_file'], output_data, benchmark_data, k_list)
+                    lines = dependency_report_lines(k_list, scores, args.bootstrap, args.confidence)
+                print(name)
+                for line in lines:
+                    print('    ' + line, end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""
+Supervise one test process without watching it in a busy loop.
+
+The caller blocks on a pidfd (or checks `waitid` every 50ms on kernels without
+pidfd) until the process exits or its wall-clock budget runs out. Memory of the
+whole process tree is capped by the kernel with a cgroup v2 leaf and `memory.max`
+when a cgroup with the memory controller is delegated to us (`EVOCODEBENCH_CGROUP`,
+or our own cgroup). Otherwise the RSS of the tree is sampled once a second; there
+is no RLIMIT_AS, which would turn large address-space reservations (thread
+stacks, arenas, mmapped files) into MemoryError well below the RSS limit.
+
+Every run is its own session. When it ends, for whatever reason, its process
+group (and its cgroup, which also holds processes that left the group) is
+killed, so tests cannot leave servers or workers running behind them.
+"""
+
+import os
+import select
+import signal
+import subprocess
+import time
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+
+import psutil
+
+MEMORY_LIMIT = 5 * 1024 * 1024 * 1024  # 5GB per test
+SAMPLE_INTERVAL = 1.0  # seconds between RSS samples of a process tree without cgroup
+
+
+@dataclass
+class RunResult:
+    returncode: int | None
+    wall_time: float  # seconds
+    peak_rss: int  # bytes
+    timed_out: bool = False
+    out_of_memory: bool = False
+
+    @property
+    def passed(self) -> bool:
+        return self.returncode == 0 and not self.timed_out and not self.out_of_memory
+
+    def __bool__(self) -> bool:
+        return self.passed
+
+
+@lru_cache(maxsize=None)
+def cgroup_root() -> str | None:
+    """The cgroup v2 directory run cgroups are created in, or None if there is none we may use."""
+    root = os.environ.get("EVOCODEBENCH_CGROUP")
+    if root is None:
+        if not os.path.exists("/sys/fs/cgroup/cgroup.controllers"):
+            return None  # cgroup v1 or no cgroup fs
+        with open("/proc/self/cgroup", "r") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    root = "/sys/fs/cgroup" + line[3:].strip()
+    if root is None:
+        return None
+    try:
+        with open(os.path.join(root, "cgroup.subtree_control"), "r") as f:
+            if "memory" not in f.read().split():
+                return None
+    except OSError:
+        return None
+    return root if os.access(root, os.W_OK) else None
+
+
+class MemoryCgroup:
+    """A cgroup v2 leaf with `memory.max`, created for one run and removed after it."""
+
+    def __init__(self, root: str, limit: int) -> None:
+        self.path = os.path.join(root, f"evo_{os.getpid()}_{uuid.uuid4().hex[:8]}")
+        os.mkdir(self.path)
+        self.write("memory.max", str(limit))
+        try:
+            self.write("memory.swap.max", "0")
+        except OSError:
+            pass
+
+    @classmethod
+    def create(cls, limit: int) -> "MemoryCgroup | None":
+        root = cgroup_root()
+        if root is None:
+            return None
+        try:
+            return cls(root, limit)
+        except OSError:
+            return None
+
+    def write(self, name: str, value: str):
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(value)
+
+    def read(self, name: str) -> str | None:
+        try:
+            with open(os.path.join(self.path, name), "r") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def attach(self, pid: int):
+        self.write("cgroup.procs", str(pid))
+
+    def peak(self) -> int | None:
+        peak = self.read("memory.peak")  # linux >= 5.19
+        return int(peak) if peak else None
+
+    def oom_killed(self) -> bool:
+        for line in (self.read("memory.events") or "").splitlines():
+            key, _, value = line.partition(" ")
+            if key == "oom_kill":
+                return int(value) > 0
+        return False
+
+    def kill(self):
+        try:
+            self.write("cgroup.kill", "1")  # linux >= 5.14
+        except OSError:
+            for pid in (self.read("cgroup.procs") or "").split():
+                try:
+                    os.kill(int(pid), signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def remove(self):
+        # a killed cgroup can only be removed once its processes are gone
+        for _ in range(100):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                self.kill()
+                time.sleep(0.01)
+
+
+def confine(pid: int, memory_limit: int) -> MemoryCgroup | None:
+    """Move a just started process into a memory cgroup, return the cgroup or None if there is none;
+    without one, monitor samples the RSS of the tree.
+
+    This happens right after the spawn rather than in a preexec_fn, which is not
+    safe in the threaded test server; only the first few allocations of the
+    interpreter escape the limit.
+    """
+    cgroup = MemoryCgroup.create(memory_limit)
+    if cgroup is not None:
+        try:
+            cgroup.attach(pid)
+        except OSError:
+            cgroup.remove()
+            return None
+    return cgroup
+
+
+def kill_tree(pid: int, cgroup: MemoryCgroup | None = None):
+    """SIGKILL every process of the run started as session leader pid."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    if cgroup is not None:
+        cgroup.kill()
+
+
+def tree_rss(pid: int) -> int:
+    try:
+        root = psutil.Process(pid)
+        processes = [root] + root.children(recursive=True)
+    except psutil.Error:
+        return 0
+    rss = 0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+        except psutil.Error:
+            pass
+    return rss
+
+
+def wait_for_exit(pid: int, timeout: float | None) -> bool:
+    """Block until pid exits (True) or timeout seconds pass (False), without reaping it."""
+    try:
+        pidfd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return True  # already reaped, e.g. by the fork server
+    except (AttributeError, OSError):
+        return wait_with_sleep(pid, timeout)
+    try:
+        poller = select.poll()
+        poller.register(pidfd, select.POLLIN)
+        return bool(poller.poll(None if timeout is None else timeout * 1000))
+    finally:
+        os.close(pidfd)
+
+
+def wait_with_sleep(pid: int, timeout: float | None) -> bool:
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            if os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT | os.WNOHANG) is not None:
+                return True
+        except ChildProcessError:  # not our child
+            try:
+                if psutil.Process(pid).status() == psutil.STATUS_ZOMBIE:
+                    return True
+            except psutil.NoSuchProcess:
+                return True
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05 if deadline is None else max(0, min(0.05, deadline - time.monotonic())))
+
+
+def monitor(pid: int, timeout: float | None, memory_limit: int | None = None) -> tuple[bool, bool, int]:
+    """Wait for pid to exit, return (exited, over_memory, sampled peak RSS of its tree).
+
+    With memory_limit the wait wakes up every SAMPLE_INTERVAL to add up the RSS of
+    pid and all its descendants; it is only needed when no cgroup enforces the limit.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    peak = 0
+    while True:
+        interval = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if memory_limit is not None:
+            interval = SAMPLE_INTERVAL if interval is None else min(interval, SAMPLE_INTERVAL)
+        if wait_for_exit(pid, interval):
+            return True, False, peak
+        if memory_limit is not None:
+            rss = tree_rss(pid)
+            peak = max(peak, rss)
+            if rss > memory_limit:
+                return False, True, peak
+        if deadline is not None and time.monotonic() >= deadline:
+            return False, False, peak
+
+
+def supervise(args: list[str], cwd: str, env: dict, log_file: str | None = None,
+              timeout: float | None = None, memory_limit: int | None = MEMORY_LIMIT) -> RunResult:
+    """Run args to completion under a wall-clock and memory limit, then kill whatever it left behind."""
+    start = time.monotonic()
+    log_fh = open(log_file, "w") if log_file is not None else None
+    try:
+        process = subprocess.Popen(args, cwd=cwd, stdout=log_fh, stderr=log_fh, env=env, start_new_session=True)
+    finally:
+        if log_fh is not None:
+            log_fh.close()
+    cgroup = confine(process.pid, memory_limit) if memory_limit else None
+    peak, oom = None, False
+    try:
+        exited, over_memory, sampled = monitor(process.pid, timeout, memory_limit if cgroup is None else None)
+        kill_tree(process.pid, cgroup)
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    except BaseException:
+        kill_tree(process.pid, cgroup)
+        process.wait()
+        raise
+    finally:
+        if cgroup is not None:
+            peak, oom = cgroup.peak(), cgroup.oom_killed()
+            cgroup.remove()
+    return RunResult(returncode=process.returncode,
+                     wall_time=time.monotonic() - start,
+                     peak_rss=peak if peak is not None else max(rusage.ru_maxrss * 1024, sampled),
+                     timed_out=not exited and not over_memory,
+                     out_of_memory=oom or over_memory)
@@ -1,4 +1,5 @@
 import os, json
+import shutil
 import textwrap
 
 def load_json_data(input_file: str):
@@ -22,4 +23,32 @@ def adjust_indent(code, new_indent):
     dedented_code = textwrap.dedent(code)
     # add new indentation
     indented_code = textwrap.indent(dedented_code, ' ' * new_indent)
-    return indented_code
\ No newline at end of file
+    return indented_code
+
+
+def link_tree(src, dst):
+    """Clone the project at src into dst.
+
+    Files inside a virtual environment (any top-level directory holding a
+    `pyvenv.cfg`) are hard-linked, everything else is copied. The venv is the
+    bulk of a project and is only ever replaced file-by-file by pip, while the
+    sources are rewritten in place by SetUp_evaluation and the build steps, so
+    those must stay private to the clone.
+    """
+    if os.path.exists(dst):
+        return
+    venv_roots = tuple(os.path.join(src, d) + os.sep for d in os.listdir(src)
+                       if os.path.isfile(os.path.join(src, d, 'pyvenv.cfg')))
+
+    def copy_function(s, d):
+        if s.startswith(venv_roots):
+            try:
+                return os.link(s, d)
+            except OSError:  # cross-device or unsupported fs
+                pass
+        return shutil.copy2(s, d)
+
+    tmp_dst = dst + '.tmp'
+    shutil.rmtree(tmp_dst, ignore_errors=True)
+    shutil.copytree(src, tmp_dst, symlinks=True, copy_function=copy_function)
+    os.rename(tmp_dst, dst)